@@ -0,0 +1,86 @@
+#!/bin/python
+
+import os
+import json
+import hashlib
+
+manifest_version = 1
+
+def hashFile(path):
+	digest = hashlib.md5()
+	with open(path, "rb") as fd:
+		while True:
+			block = fd.read(1 << 16)
+			if not block:
+				break
+			digest.update(block)
+	return digest.hexdigest()
+
+class BuildManifest(object):
+
+	def __init__(self, destination):
+		self.destination = destination
+		self.file = "%s/.visualize.manifest" % destination
+		# path -> [size, mtime, md5], content is hashed again only when stat changes
+		self.files = {}
+		# html page (relative to destination) -> {'source': ..., 'inputs': {path: md5}, 'settings': ...}
+		self.pages = {}
+		self.parse()
+
+	def parse(self):
+		if not os.path.exists(self.file):
+			return
+
+		try:
+			with open(self.file, "r") as fd:
+				manifest = json.load(fd)
+		except ValueError:
+			# broken manifest, everything gets rendered again
+			return
+
+		if manifest.get('version') != manifest_version:
+			return
+
+		self.files = manifest['files']
+		self.pages = manifest['pages']
+
+	def save(self):
+		tmp_file = "%s.tmp" % self.file
+		with open(tmp_file, "w") as fd:
+			json.dump({'version': manifest_version, 'files': self.files, 'pages': self.pages}, fd)
+		os.rename(tmp_file, self.file)
+
+	def fingerprint(self, path):
+		try:
+			st = os.stat(path)
+		except OSError:
+			return ""
+
+		if path in self.files:
+			(size, mtime, digest) = self.files[path]
+			if size == st.st_size and mtime == st.st_mtime:
+				return digest
+
+		digest = hashFile(path)
+		self.files[path] = [st.st_size, st.st_mtime, digest]
+		return digest
+
+	def fingerprintAll(self, paths):
+		fingerprints = {}
+		for path in paths:
+			fingerprints[path] = self.fingerprint(path)
+		return fingerprints
+
+	def pageKey(self, html_file):
+		return os.path.relpath(html_file, self.destination)
+
+	def isUpToDate(self, html_file, inputs, settings = ""):
+		key = self.pageKey(html_file)
+		if key not in self.pages or not os.path.exists(html_file):
+			return False
+
+		page = self.pages[key]
+		return page.get('settings', "") == settings and page['inputs'] == self.fingerprintAll(inputs)
+
+	def update(self, html_file, src_file, inputs, settings = ""):
+		self.pages[self.pageKey(html_file)] = {'source': src_file, 'inputs': self.fingerprintAll(inputs), 'settings': settings}
@@ -0,0 +1,206 @@
+#!/bin/python
+
+import os
+import json
+import multiprocessing
+from BuildManifest import hashFile
+from SymbolIndex import streamTokens, lookahead, advanceCandidates, isCandidate
+
+cache_version = 1
+# identifiers followed by a parenthesis which are not calls
+statement_keywords = frozenset(['if', 'for', 'while', 'switch', 'return', 'sizeof', 'defined'])
+
+# [name, line, [[called name, line], ...]] of every function defined in
+# a stream of significant tokens, bodies are found by brace tracking
+def findCalls(significant):
+	functions = []
+	function = None
+	candidates = []
+	depth = 0
+	for (previous, token, next, after) in lookahead(significant):
+		(type, text, line_number) = token
+		for (name, line, level) in advanceCandidates(candidates, type):
+			function = [name, line, []]
+			functions.append(function)
+
+		if type == 'LBRACE':
+			depth = depth + 1
+		elif type == 'RBRACE':
+			depth = max(depth - 1, 0)
+			if depth == 0:
+				function = None
+		elif type != 'IDENTIFIER' or next is None or next[0] != 'LPARENTHESIS':
+			continue
+		elif depth == 0:
+			if isCandidate(previous, token, next):
+				candidates.append( [text, line_number, 0] )
+		elif function is not None and text not in statement_keywords:
+			function[2].append([text, line_number])
+
+	return functions
+
+# worker of CallGraph.update, a file not lexed has no functions
+def findFileCalls(src_file):
+	try:
+		return (src_file, findCalls(streamTokens(src_file)))
+	except (IOError, TypeError):
+		return (src_file, [])
+
+# Call graph of all files rendered into a destination, written there as
+# callgraph.dot and callgraph.json. Functions (and calls) of every file
+# are summarized once per content, a run lexes only changed files and
+# merges the summaries of all of them.
+class CallGraph(object):
+
+	def __init__(self, destination):
+		self.directory = os.path.realpath(destination)
+		self.cache_file = "%s/.callgraph.cache" % self.directory
+		# source -> [size, mtime, md5, page relative to the directory]
+		self.files = {}
+		# md5 of a file content -> summary of findCalls
+		self.summaries = {}
+		self.parse()
+
+	def parse(self):
+		if not os.path.exists(self.cache_file):
+			return
+
+		try:
+			with open(self.cache_file, "r") as fd:
+				cache = json.load(fd)
+		except ValueError:
+			# broken cache, everything gets analyzed again
+			return
+
+		if cache.get('version') != cache_version:
+			return
+
+		self.files = cache['files']
+		self.summaries = cache['summaries']
+
+	def save(self):
+		# summaries of no file are dropped
+		used = set([self.files[source][2] for source in self.files])
+		summaries = dict([(digest, self.summaries[digest]) for digest in used if digest in self.summaries])
+
+		tmp_file = "%s.tmp" % self.cache_file
+		with open(tmp_file, "w") as fd:
+			json.dump({'version': cache_version, 'files': self.files, 'summaries': summaries}, fd)
+		os.rename(tmp_file, self.cache_file)
+
+	def getBaseName(self):
+		return "%s/callgraph" % self.directory
+
+	def fingerprint(self, src_file):
+		# content is hashed again only when stat changes
+		st = os.stat(src_file)
+		if src_file in self.files:
+			(size, mtime, digest, page) = self.files[src_file]
+			if size == st.st_size and mtime == st.st_mtime:
+				return (size, mtime, digest)
+
+		return (st.st_size, st.st_mtime, hashFile(src_file))
+
+	# summaries of (source file, page file) jobs, changed files are lexed in
+	# parallel unless processes == 1, the graph of all known files is written,
+	# returns number of lexed files
+	def update(self, jobs, processes = None):
+		changed = []
+		# the graph is written again only if any file changed
+		dirty = not os.path.exists("%s.json" % self.getBaseName())
+		for (src_file, page_file) in jobs:
+			src_file = os.path.realpath(src_file)
+			try:
+				(size, mtime, digest) = self.fingerprint(src_file)
+			except (IOError, OSError):
+				continue
+			entry = [size, mtime, digest, os.path.relpath(os.path.realpath(page_file), self.directory)]
+			if self.files.get(src_file) != entry:
+				dirty = dirty or self.files.get(src_file, [None] * 4)[2:] != entry[2:]
+				self.files[src_file] = entry
+			if digest not in self.summaries and src_file not in changed:
+				changed.append(src_file)
+
+		for source in self.files.keys():
+			if not os.path.exists(source):
+				del(self.files[source])
+				dirty = True
+
+		if processes == 1 or len(changed) < 2:
+			results = map(findFileCalls, changed)
+		else:
+			pool = multiprocessing.Pool(processes)
+			try:
+				results = pool.map(findFileCalls, changed, 8)
+			finally:
+				pool.close()
+				pool.join()
+
+		for (source, functions) in results:
+			self.summaries[self.files[source][2]] = functions
+
+		self.save()
+		if dirty or changed:
+			self.write(self.merge())
+		return len(changed)
+
+	# function id (page#line) -> {name, source, line, calls: [[name, line, id or None]]},
+	# a call goes to the function of the same file first, then to any other one
+	def merge(self):
+		# name -> {source: id}, the first defined id
+		defined = {}
+		first = {}
+		for source in sorted(self.files):
+			for (name, line, calls) in self.summaries.get(self.files[source][2], []):
+				function_id = "%s#%d" % (self.files[source][3], line)
+				defined.setdefault(name, {}).setdefault(source, function_id)
+				first.setdefault(name, function_id)
+
+		functions = {}
+		for source in sorted(self.files):
+			for (name, line, calls) in self.summaries.get(self.files[source][2], []):
+				resolved = []
+				for (callee, call_line) in calls:
+					target = first.get(callee)
+					if target is not None:
+						target = defined[callee].get(source, target)
+					resolved.append( [callee, call_line, target] )
+				functions["%s#%d" % (self.files[source][3], line)] = {'name': name, 'source': source, 'line': line, 'calls': resolved}
+
+		return functions
+
+	def dotString(self, text):
+		return "\"%s\"" % text.replace("\\", "\\\\").replace("\"", "\\\"")
+
+	def write(self, functions):
+		base = self.getBaseName()
+		tmp_file = "%s.json.tmp" % base
+		with open(tmp_file, "w") as fd:
+			json.dump({'functions': functions}, fd, separators = (',', ':'), sort_keys = True)
+		os.rename(tmp_file, "%s.json" % base)
+
+		# one cluster per file, nodes link to the function in its page
+		# (e.g. in svg made by dot -Tsvg)
+		clusters = {}
+		for function_id in functions:
+			clusters.setdefault(functions[function_id]['source'], []).append(function_id)
+		# clusters are labeled by paths relative to the common directory
+		root = os.path.dirname(os.path.commonprefix(sorted(clusters)))
+
+		tmp_file = "%s.dot.tmp" % base
+		with open(tmp_file, "w") as fd:
+			fd.write("digraph callgraph {\n")
+			fd.write("\tnode [shape=box, fontname=\"Courier\"];\n")
+			for (index, source) in enumerate(sorted(clusters)):
+				fd.write("\tsubgraph \"cluster_%d\" {\n" % index)
+				fd.write("\t\tlabel=%s;\n" % self.dotString(os.path.relpath(source, root)))
+				for function_id in sorted(clusters[source]):
+					fd.write("\t\t%s [label=%s, URL=%s];\n" % (self.dotString(function_id), self.dotString(functions[function_id]['name']), self.dotString(function_id)))
+				fd.write("\t}\n")
+
+			for function_id in sorted(functions):
+				targets = set([target for (callee, line, target) in functions[function_id]['calls'] if target is not None])
+				for target in sorted(targets):
+					fd.write("\t%s -> %s;\n" % (self.dotString(function_id), self.dotString(target)))
+			fd.write("}\n")
+		os.rename(tmp_file, "%s.dot" % base)
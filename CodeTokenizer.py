@@ -1,6 +1,14 @@
 #!/bin/python
 
 import sys
+import os
+import re
+import gc
+import hashlib
+import marshal
+import multiprocessing
+from collections import deque
+from cStringIO import StringIO
 from ply import lex
 
 tokens = [
@@ -130,80 +138,369 @@ def t_error(t):
 	raise TypeError("Unknown text '%s'" % (t.value[0:20],))
 
 ################################################
-source_code_keywords = {}
-source_code_comments = []
-def getCodeKeywordsOccurences(file):
-	lex.lex()
-
-	with open(file, "r") as fd:
-		content = fd.read()
-		lex.input(content)
-
-	line_number = 1
-	column_number = 1
-	for tok in iter(lex.token, None):
-		#print tok
-		#print repr(tok.type), repr(tok.value), line_number, column_number
-		# for each token compute next column_number (not for actual token but for the next)
-		if tok.type == 'COMMENT':
-			#print line_number, tok.value
-			mcomment = []
-			mcomment.append( (line_number, column_number) )
-			#print (line_number, column_number)
-			#print repr(tok.value)[1:-1]
-			#print (line_number, column_number + len(repr(tok.value)[1:-1]) - 1)
-			mcomment.append( (line_number, column_number + len(repr(tok.value)[1:-1]) - 1) )
-			#print mcomment
-			source_code_comments.append( mcomment )
+# contents at least this large are lexed in chunks by a pool of processes
+parallel_threshold = 1 << 20
+parallel_chunk_size = 1 << 18
+
+# master lexer, built once per process, every file gets its clone
+master_lexer = None
+
+def getCacheDir():
+	cache_home = os.environ.get("XDG_CACHE_HOME", "")
+	if len(cache_home) == 0:
+		cache_home = os.path.expanduser("~/.cache")
+	return "%s/codevisualizer" % cache_home
+
+def getLexTabName():
+	# lextab is named after the rules so changed rules never load a stale table
+	rules = []
+	for name in sorted(globals().keys()):
+		if name.startswith("t_") and isinstance(globals()[name], str):
+			rules.append( (name, globals()[name]) )
+
+	return "cvlextab_%s" % hashlib.md5(repr((tokens, rules))).hexdigest()[:12]
+
+def buildLexer():
+	cache_dir = getCacheDir()
+	try:
+		if not os.path.exists(cache_dir):
+			os.makedirs(cache_dir)
+	except OSError:
+		# no cache, compile the rules from scratch
+		return lex.lex()
+
+	# lextab is imported by its name
+	if cache_dir not in sys.path:
+		sys.path.append(cache_dir)
+
+	return lex.lex(optimize = 1, lextab = getLexTabName(), outputdir = cache_dir)
+
+def getLexer():
+	global master_lexer
+	if master_lexer is None:
+		master_lexer = buildLexer()
+
+	return master_lexer.clone()
+
+class CodeTokenizer(object):
+
+	def __init__(self, file, content = None, first_line = 1, processes = 1):
+		self.file = file
+		self.content = content
+		# content may be a chunk of the file starting at first_line
+		self.first_line = first_line
+		# large contents are lexed in parallel unless processes == 1
+		self.processes = processes
+		self.tokenize()
+
+	def addLineToken(self, type, line_number, column_number, value):
+		# tokens spanning more lines are split into one piece per line
+		for piece in value.split('\n'):
+			if len(piece) > 0:
+				if line_number not in self.tokens:
+					self.tokens[line_number] = [(type, column_number, len(piece))]
+				else:
+					self.tokens[line_number].append( (type, column_number, len(piece)) )
+			line_number = line_number + 1
 			column_number = 1
-		elif tok.type == 'WHITESPACE' or tok.type == 'MCOMMENT':
-			#if tok.type == 'MCOMMENT':
-			#	print line_number
-			mcomment = []
-			if tok.type == 'MCOMMENT':
-				#print "cs: (%d, %d)" % (line_number, column_number)
-				mcomment.append( (line_number, column_number) )
-
-			line_number = line_number + tok.value.count('\n')
-			# find the last \n character
-			lnl = tok.value.rfind('\n')
-			ll = len(tok.value)
-			#print(ll, lnl + 1)
 
-			if ll == (lnl + 1):
+	def tokenize(self):
+		# every run starts with fresh structures
+		self.keywords = {}
+		self.comments = []
+		# line number -> [(token type, column, length)]
+		self.tokens = {}
+
+		content = self.content
+		if content is None:
+			with open(self.file, "r") as fd:
+				content = fd.read()
+
+		if len(content) >= parallel_threshold and canLexInParallel(self.processes):
+			self.tokenizeParallel(content)
+			return
+
+		lexer = getLexer()
+		lexer.input(content)
+
+		line_number = self.first_line
+		column_number = 1
+		for tok in iter(lexer.token, None):
+			#print tok
+			#print repr(tok.type), repr(tok.value), line_number, column_number
+			self.addLineToken(tok.type, line_number, column_number, tok.value)
+			# for each token compute next column_number (not for actual token but for the next)
+			if tok.type == 'COMMENT':
+				#print line_number, tok.value
+				mcomment = []
+				mcomment.append( (line_number, column_number) )
+				#print (line_number, column_number)
+				#print repr(tok.value)[1:-1]
+				#print (line_number, column_number + len(repr(tok.value)[1:-1]) - 1)
+				mcomment.append( (line_number, column_number + len(repr(tok.value)[1:-1]) - 1) )
+				#print mcomment
+				self.comments.append( mcomment )
 				column_number = 1
+			elif tok.type == 'WHITESPACE' or tok.type == 'MCOMMENT' or tok.type == 'INCLUDE':
+				#if tok.type == 'MCOMMENT':
+				#	print line_number
+				mcomment = []
+				if tok.type == 'MCOMMENT':
+					#print "cs: (%d, %d)" % (line_number, column_number)
+					mcomment.append( (line_number, column_number) )
+
+				line_number = line_number + tok.value.count('\n')
+				# find the last \n character
+				lnl = tok.value.rfind('\n')
+				ll = len(tok.value)
+				#print(ll, lnl + 1)
+
+				if ll == (lnl + 1):
+					column_number = 1
+				else:
+					if lnl != -1:
+						column_number = ll - (lnl + 1) + 1
+					else:
+						column_number = column_number + ll
+				if tok.type == 'MCOMMENT':
+					#print "ce: (%d, %d)" % (line_number, column_number)
+					mcomment.append( (line_number, column_number) )
+					self.comments.append(mcomment)
+					#print mcomment
 			else:
-				if lnl != -1:
-					column_number = ll - (lnl + 1) + 1
+				#print (line_number, tok.value)
+				# save only identifiers
+				if tok.type == 'IDENTIFIER':
+					# filter out all language keywords
+
+					# save into db keyword and its line number
+					key = repr(tok.value)
+					key = key[1:-1] # get rid of ' char at the beggining and end
+					#print (key, line_number, column_number)
+					if key not in self.keywords:
+						self.keywords[key] = {line_number: [column_number]}
+					if line_number not in self.keywords[key]:
+						self.keywords[key][line_number] = [column_number]
+					elif column_number not in self.keywords[key][line_number]:
+						self.keywords[key][line_number].append(column_number)
+
+				column_number = column_number + len(tok.value)
+
+	def tokenizeParallel(self, content):
+		jobs = []
+		first_line = self.first_line
+		for (chunk, last) in readChunks(StringIO(content), parallel_chunk_size):
+			jobs.append( (self.file, chunk, first_line) )
+			first_line = first_line + chunk.count('\n')
+
+		pool = multiprocessing.Pool(self.processes)
+		try:
+			parts = pool.map(lexChunk, jobs, 1)
+		finally:
+			pool.close()
+			pool.join()
+
+		for part in parts:
+			self.mergeChunk(part)
+
+	# adds tables of the next chunk made by lexChunk, chunks cover disjoint
+	# lines and everything is inserted in the order the serial pass does it
+	# so even iteration order is the same
+	def mergeChunk(self, part):
+		# collections of the garbage collector would take longer than that
+		enabled = gc.isenabled()
+		gc.disable()
+		try:
+			(keywords, comments, tokens) = marshal.loads(part)
+			for (key, occurences) in keywords:
+				if key not in self.keywords:
+					self.keywords[key] = dict(occurences)
 				else:
-					column_number = column_number + ll
-			if tok.type == 'MCOMMENT':
-				#print "ce: (%d, %d)" % (line_number, column_number)
-				mcomment.append( (line_number, column_number) )
-				source_code_comments.append(mcomment)
-				#print mcomment
+					self.keywords[key].update(occurences)
+			self.comments.extend(comments)
+			self.tokens.update(tokens)
+		finally:
+			if enabled:
+				gc.enable()
+
+	def getKeywords(self):
+		return self.keywords
+
+	def getComments(self):
+		return self.comments
+
+	def getTokens(self):
+		return self.tokens
+
+# Chunks of a file can be lexed on their own if they end with a new line
+# no token spans over. Only multi-line comments and includes do, strings
+# and characters end at the end of their line (or are a single DOT).
+special_re = re.compile(r"[/\"'#]")
+include_start_re = re.compile(r"\#include\s+")
+include_re = re.compile(t_INCLUDE, re.VERBOSE)
+
+# position after the last new line content can be cut at, -1 if there is none,
+# complete is False if more content follows (and may close an open comment)
+def findSafeCut(content, complete = False):
+	size = len(content)
+	cut = -1
+	position = 0
+	while position < size:
+		match = special_re.search(content, position)
+		end = size
+		if match is not None:
+			end = match.start()
+
+		# new lines between tokens are safe
+		line_end = content.rfind("\n", position, end)
+		if line_end != -1:
+			cut = line_end + 1
+
+		if match is None:
+			break
+
+		position = end
+		char = content[position]
+		if content.startswith("/*", position):
+			comment_end = content.find("*/", position + 2)
+			if comment_end != -1:
+				position = comment_end + 2
+				continue
+			if not complete:
+				# the comment may be closed in the rest of the file
+				break
+			position = position + 1
+		elif content.startswith("//", position):
+			line_end = content.find("\n", position)
+			if line_end == -1:
+				break
+			position = line_end
+		elif char == "#" and include_start_re.match(content, position):
+			line_end = content.find("\n", include_start_re.match(content, position).end())
+			if line_end == -1 and not complete:
+				break
+			match = include_re.match(content, position)
+			if match is not None:
+				position = match.end()
+			else:
+				position = position + 1
+		elif char == '"' or char == "'":
+			line_end = content.find("\n", position)
+			if line_end == -1:
+				line_end = size
+				if not complete:
+					break
+			literal_end = content.find(char, position + 1, line_end)
+			if literal_end != -1:
+				position = literal_end + 1
+			else:
+				position = position + 1
 		else:
-			#print (line_number, tok.value)
-			# save only identifiers
-			if tok.type == 'IDENTIFIER':
-				# filter out all language keywords
-
-				# save into db keyword and its line number
-				key = repr(tok.value)
-				key = key[1:-1] # get rid of ' char at the beggining and end
-				#print (key, line_number, column_number)
-				if key not in source_code_keywords:
-					source_code_keywords[key] = {line_number: [column_number]}
-				if line_number not in source_code_keywords[key]:
-					source_code_keywords[key][line_number] = [column_number]
-				elif column_number not in source_code_keywords[key][line_number]:
-					source_code_keywords[key][line_number].append(column_number)
-
-			column_number = column_number + len(tok.value)
-
-	#for key in source_code_keywords:
-	#	print "%s (%s)" % (key, str(source_code_keywords[key]))
-	return (source_code_keywords, source_code_comments)
+			position = position + 1
+
+	return cut
+
+# split an open file into (chunk, last) of about chunk_size ending at safe
+# new lines, a chunk gets longer only if a comment spans over its end
+def readChunks(fd, chunk_size):
+	content = ""
+	complete = False
+	while True:
+		while not complete and len(content) < chunk_size:
+			block = fd.read(chunk_size)
+			if len(block) == 0:
+				complete = True
+			content = content + block
+
+		if complete:
+			yield (content, True)
+			return
+
+		cut = findSafeCut(content)
+		if cut <= 0:
+			# no safe new line yet, read more
+			block = fd.read(chunk_size)
+			if len(block) == 0:
+				complete = True
+			content = content + block
+			continue
+
+		yield (content[:cut], False)
+		content = content[cut:]
+
+# workers of a pool can not have one of their own
+def canLexInParallel(processes):
+	if processes is None:
+		processes = multiprocessing.cpu_count()
+	return processes > 1 and not multiprocessing.current_process().daemon
+
+# worker of CodeTokenizer.tokenizeParallel and tokenizeChunksParallel,
+# keywords (in order of their first occurence) and their lines and tokens
+# are lists of items in line order, marshalled as it is much faster to load
+# than a pickle
+def lexChunk(job):
+	(file, chunk, first_line) = job
+	codeTokenizer = CodeTokenizer(file, chunk, first_line)
+	keywords = codeTokenizer.getKeywords()
+	first = {}
+	for key in keywords:
+		line_number = min(keywords[key])
+		first[key] = (line_number, min(keywords[key][line_number]))
+	ordered = [(key, sorted(keywords[key].items())) for key in sorted(keywords, key = first.get)]
+	return marshal.dumps( (ordered, codeTokenizer.getComments(), sorted(codeTokenizer.getTokens().items())) )
+
+# (first line index, lines, CodeTokenizer) for every chunk of a file,
+# only one chunk is in memory at a time (a few per process if chunks of
+# large files are lexed ahead in parallel, unless processes == 1)
+def tokenizeChunks(file, chunk_size, processes = 1):
+	if os.path.getsize(file) >= parallel_threshold and canLexInParallel(processes):
+		for chunk in tokenizeChunksParallel(file, chunk_size, processes):
+			yield chunk
+		return
+
+	first_index = 0
+	with open(file, "r") as fd:
+		for (chunk, last) in readChunks(fd, chunk_size):
+			lines = chunk.split("\n")
+			if not last:
+				# the line after the last new line starts the next chunk
+				lines.pop()
+			codeTokenizer = CodeTokenizer(file, chunk, first_index + 1)
+			yield (first_index, lines, codeTokenizer)
+			first_index = first_index + len(lines)
+
+def mergedChunk(file, pending):
+	(first_index, lines, result) = pending
+	codeTokenizer = CodeTokenizer(file, "", first_index + 1)
+	codeTokenizer.mergeChunk(result.get())
+	return (first_index, lines, codeTokenizer)
+
+def tokenizeChunksParallel(file, chunk_size, processes):
+	pool = multiprocessing.Pool(processes)
+	# (first line index, lines, result) of chunks being lexed, in order
+	pending = deque()
+	ahead = 2 * (processes or multiprocessing.cpu_count())
+	try:
+		first_index = 0
+		with open(file, "r") as fd:
+			for (chunk, last) in readChunks(fd, chunk_size):
+				lines = chunk.split("\n")
+				if not last:
+					lines.pop()
+				pending.append( (first_index, lines, pool.apply_async(lexChunk, ((file, chunk, first_index + 1),))) )
+				first_index = first_index + len(lines)
+				if len(pending) >= ahead:
+					yield mergedChunk(file, pending.popleft())
+
+		while pending:
+			yield mergedChunk(file, pending.popleft())
+	finally:
+		pool.terminate()
+		pool.join()
+
+def getCodeKeywordsOccurences(file):
+	codeTokenizer = CodeTokenizer(file)
+	return (codeTokenizer.getKeywords(), codeTokenizer.getComments(), codeTokenizer.getTokens())
 
 if __name__ == "__main__":
 	print getCodeKeywordsOccurences(sys.argv[1])
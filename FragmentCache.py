@@ -0,0 +1,67 @@
+#!/bin/python
+
+import os
+import marshal
+
+fragments_version = 1
+
+# What the last render of a page left behind: token table of its source
+# and html of every line. Valid only for the same source and tool files,
+# lines are then rendered again only if their commands changed.
+# Stored with marshal, much faster than pickle for plain dicts and lists.
+class FragmentCache(object):
+
+	def __init__(self, file):
+		self.file = file
+		# md5 of the source and of the tool files
+		self.key = None
+		self.keywords = {}
+		self.comments = []
+		self.tokens = {}
+		# line number -> (line key, html)
+		self.fragments = {}
+		self.parse()
+
+	def parse(self):
+		if not os.path.exists(self.file):
+			return
+
+		try:
+			with open(self.file, "rb") as fd:
+				cache = marshal.load(fd)
+		except (EOFError, ValueError, TypeError):
+			# broken cache, the page gets rendered from scratch
+			return
+
+		if not isinstance(cache, dict) or cache.get('version') != fragments_version:
+			return
+
+		self.key = cache['key']
+		self.keywords = cache['keywords']
+		self.comments = cache['comments']
+		self.tokens = cache['tokens']
+		self.fragments = cache['fragments']
+
+	def isValid(self, key):
+		return self.key == key
+
+	def update(self, key, keywords, comments, tokens, fragments):
+		self.key = key
+		self.keywords = keywords
+		self.comments = comments
+		self.tokens = tokens
+		self.fragments = fragments
+
+	def save(self):
+		cache = {
+			'version': fragments_version,
+			'key': self.key,
+			'keywords': self.keywords,
+			'comments': self.comments,
+			'tokens': self.tokens,
+			'fragments': self.fragments
+		}
+		tmp_file = "%s.tmp" % self.file
+		with open(tmp_file, "wb") as fd:
+			marshal.dump(cache, fd)
+		os.rename(tmp_file, self.file)
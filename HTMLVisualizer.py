@@ -1,73 +1,182 @@
 import re
 import os
+import json
 import shutil
+import cStringIO
+from LayoutSync import syncLayout, layout_styles, layout_scripts
+from OutputFile import OutputFile
+from SpanResolver import nestSpans, resolveFolds, highlight_rank, needinfo_rank, symbol_rank
+from KeywordDB import readKeywordDB, loadKeywordDB
+from SearchIndex import PageTerms, getTermsFile
+
+include_re = re.compile(r"(\#include)(\s+)(.*)")
+# tokens which can get a markup, everything else is just escaped
+markup_types = frozenset(['IDENTIFIER', 'MACRO', 'STRING', 'CHARACTER', 'COMMENT', 'MCOMMENT', 'INCLUDE'])
+# short class names of compact pages, keyword classes are short already
+compact_classes = {
+	'str_literal': 's',
+	'codecomment': 'c',
+	'comment': 'm',
+	'highlight': 'h',
+	'highlight_text': 'ht',
+	'needinfo': 'n',
+	'needinfo_text': 'nt',
+	'symbol': 'y'
+}
+# label text in a class name, replaced by its index into the page labels
+label_re = re.compile("L\x00([^\x00]*)\x00")
+
+def copyLayout(layout_dir, destination, mode = "copy"):
+	# only missing or changed css and js files are copied
+	return syncLayout(layout_dir, "%s/layout" % destination, mode)
+
+def readKeywords(keywords_file):
+	content = ""
+	with open(keywords_file, 'r') as file:
+		content = file.read()
+
+	keywords = {}
+	for keyword in content.split('\n'):
+		if len(keyword) == 0:
+			continue
+
+		# has keyword specific css name?
+		parts = keyword.split(":")
+		if len(parts) == 1:
+			keywords[keyword] = ""
+		else:
+			keywords[parts[0].strip()] = parts[1:][0].strip()
+
+	return keywords
 
 class HTMLVisualizer(object):
 
-	def __init__(self, src_lines, src_keywords, src_comments, vis_lines, keywords_file, script_dir):
+	def __init__(self, src_lines, src_keywords, src_comments, vis_lines, keywords_file, script_dir, src_tokens = None, keywords = None, keyworddb = None, layout_href = "layout", fragments = None, chunks = None, lazy_folds = False, virtual = False, compact = False, bundle_href = None, gzip_output = False, symbol_index = None, src_file = None, callgraph_href = None, search_root = None, search_page = None):
 		self.src_lines = src_lines
 		self.src_keywords = src_keywords
 		self.src_comments = src_comments
+		# per line token table from CodeTokenizer
+		self.src_tokens = src_tokens
+		if self.src_tokens is None:
+			self.src_tokens = {}
 		self.vis_lines = vis_lines
 		self.keywords_file = keywords_file
 		self.layout_dir = "%s/layout" % script_dir
-		self.keywords = self.getKeywords()
-
-	def copyLayout(self, layout_dir, destination):
-		# copy css
-		#shutil.copyfile("%s/vis.css" % layout_dir, "%s/vis.css" % destination)
-		#shutil.copyfile("%s/vis.js" % layout_dir, "%s/js.css" % destination)
-		#shutil.copyfile("%s/jquery-1.9.1.js" % layout_dir, "%s/jquery-1.9.1.js" % destination)	
-		if os.path.exists("%s/layout" % destination):
-			shutil.rmtree("%s/layout" % destination)
-
-		shutil.copytree(layout_dir, "%s/layout" % destination)
+		# where the page finds css and js files (relative to the page)
+		self.layout_href = layout_href
+		# keywords and the destination keyworddb can be parsed once
+		# by the caller and shared by all rendered pages
+		self.keywords = keywords
+		if self.keywords is None:
+			self.keywords = self.getKeywords()
+		self.shared_keyworddb = keyworddb
+		# line number -> (line key, html) of the last render of the page,
+		# filled with fragments of this render by printPage
+		self.cached_fragments = fragments
+		if self.cached_fragments is None:
+			self.cached_fragments = {}
+		self.fragments = {}
+		# (first line index, lines, keywords, comments, tokens) of every
+		# chunk of a streamed source, nothing is kept from rendered chunks
+		self.src_chunks = chunks
+		if self.src_chunks is not None:
+			self.fragments = None
+		self.line_offset = 0
+		self.line_count = 0
+		# folded folds are written into their own files, loaded on unfold
+		self.lazy_folds = lazy_folds
+		# line data drawn by vis.js instead of html lines
+		self.virtual = virtual
+		# short class names, plain whitespaces and every label text
+		# written once into the page style
+		self.compact = compact
+		self.labels = []
+		self.label_index = {}
+		# one script with all layout files instead of them (or None)
+		self.bundle_href = bundle_href
+		# written files get .gz siblings
+		self.gzip_output = gzip_output
+		# identifiers defined in the SymbolIndex link to their definitions,
+		# line -> [(column, name, href)] of the current chunk
+		self.symbol_index = symbol_index
+		self.src_file = src_file
+		self.link_index = {}
+		# callgraph.dot and .json linked at the top of the page (or None)
+		self.callgraph_href = callgraph_href
+		# destination of the search index (relative to the page) and the
+		# page in it, terms of the page are collected while it is written
+		self.search_root = search_root
+		self.search_page = search_page
+		self.page_terms = None
+		self.compileKeywords()
+
+	def copyLayout(self, layout_dir, destination, mode = "copy"):
+		return copyLayout(layout_dir, destination, mode)
 
 	def getKeywords(self):
-		content = ""
-		with open(self.keywords_file, 'r') as file:
-			content = file.read()
-
-		keywords = {}
-		for keyword in content.split('\n'):
-			if len(keyword) == 0:
-				continue
-
-			# has keyword specific css name?
-			parts = keyword.split(":")
-			if len(parts) == 1:
-				keywords[keyword] = ""
-			else:
-				keywords[parts[0].strip()] = parts[1:][0].strip()
+		return readKeywords(self.keywords_file)
 
-		return keywords
+	def compileKeywords(self):
+		self.keyword_classes = {}
+		for keyword in self.keywords:
+			# has keyword specific css name? (#else -> sharpelse)
+			css = self.keywords[keyword]
+			if css == "":
+				css = keyword.replace('#', '')
+			self.keyword_classes[keyword] = css
 
 	def parseKeywordDB(self, file):
-		content = ""
-		keyworddb = {}
-
-		# keyworddb exists?
-		if not os.path.exists(file):
-			open(file, 'a').close()
-			return {}
-
-		with open(file, 'r') as fd:
-                        content = fd.read()
-
-		for line in content.split("\n"):
-			if len(line) == 0:
-				continue
-
-			if line[0] == '#':
-				continue
-
-			items = line.split(":")
-			if len(items) < 2:
-				continue
-
-			keyworddb[items[0]] = ":".join(items[1:])
-
-		return keyworddb
+		return readKeywordDB(file)
+
+	def indexKeywordDB(self, keyworddb, filekeyworddb):
+		# intersection of the file identifiers and the keyworddb, inverted
+		# into line -> [(column, keyword, value)], the cost does not depend
+		# on the size of the keyworddb
+		db_index = {}
+		for keyword in self.src_keywords:
+			# source code file specific keywords has higher priority (later maybe display both)
+			if keyword in filekeyworddb:
+				value = filekeyworddb[keyword]
+			else:
+				# one lookup, keyworddb can be a compiled one
+				value = keyworddb.get(keyword)
+				if value is None:
+					continue
+
+			for line_number in self.src_keywords[keyword]:
+				for column in self.src_keywords[keyword][line_number]:
+					if line_number not in db_index:
+						db_index[line_number] = [(column, keyword, value)]
+					else:
+						db_index[line_number].append( (column, keyword, value) )
+
+		for line_number in db_index:
+			db_index[line_number].sort()
+
+		return db_index
+
+	def indexSymbols(self, file, destination):
+		# like indexKeywordDB, names are looked up once per chunk
+		link_index = {}
+		if self.symbol_index is None:
+			return link_index
+
+		links = self.symbol_index.lookup(self.src_keywords, self.src_file, "%s/%s.html" % (destination, file))
+		for name in links:
+			for line_number in self.src_keywords[name]:
+				# the definition is not linked to itself
+				if links[name] == "#%d" % line_number:
+					continue
+				for column in self.src_keywords[name][line_number]:
+					if line_number not in link_index:
+						link_index[line_number] = [(column, name, links[name])]
+					else:
+						link_index[line_number].append( (column, name, links[name]) )
+
+		for line_number in link_index:
+			link_index[line_number].sort()
+
+		return link_index
 
 	def pretokenize(self, line):
 		line = line.replace('&', "&amp;")
@@ -75,295 +184,512 @@ class HTMLVisualizer(object):
 		line = line.replace('>', "&gt;")
 		return line
 
-	def tokenize(self, line):
-		return line.replace('\t', 6*"&nbsp;")
+	def whitespaces(self, text):
+		# text without any tags, compact pages keep whitespaces as they are
+		if self.compact:
+			return text.replace('\t', 6*" ")
+		return text.replace('\t', 6*"&nbsp;").replace(' ', "&nbsp;")
+
+	def css(self, name):
+		if self.compact:
+			return compact_classes.get(name, name)
+		return name
+
+	def escape(self, text):
+		return self.whitespaces(self.pretokenize(text))
+
+	def renderToken(self, type, text):
+		if type == 'WHITESPACE':
+			return self.whitespaces(text)
+		elif type == 'IDENTIFIER' or type == 'MACRO':
+			if text in self.keyword_classes:
+				return "<span class='%s'>%s</span>" % (self.keyword_classes[text], text)
+			# nothing to escape in identifiers
+			if type == 'IDENTIFIER':
+				return text
+		elif type == 'STRING' or type == 'CHARACTER':
+			return "<span class='%s'>%s</span>" % (self.css('str_literal'), self.escape(text))
+		elif type == 'COMMENT' or type == 'MCOMMENT':
+			return "<span class='%s'>%s</span>" % (self.css('codecomment'), self.escape(text))
+		elif type == 'INCLUDE':
+			# #include <file.h> or #include "file.h" is lexed as one token
+			match = include_re.match(text)
+			if match:
+				return self.renderToken('MACRO', match.group(1)) + self.renderToken('WHITESPACE', match.group(2)) + self.renderToken(match.group(3)[0] == '"' and 'STRING' or 'HEADER', match.group(3))
+
+		return self.escape(text)
+
+	def renderTokens(self, line, tokens, start, end):
+		# render line[start:end] from the line's token table, only keywords,
+		# literals and comments get a markup, text between them is escaped
+		# at once, tokens crossing the segment boundaries are clipped
+		out = []
+		last = start
+		for (type, column, length) in tokens:
+			tstart = column - 1
+			if tstart >= end:
+				break
+			tend = tstart + length
+			if tend <= start or type not in markup_types:
+				continue
+			if (type == 'IDENTIFIER' or type == 'MACRO') and line[tstart:tend] not in self.keyword_classes:
+				continue
 
-	def postTokenize(self, line):
-		in_tag = 0
-		oline = ""
-		for char in line:
-			if char == ' ' and in_tag == 0:
-					oline = oline + "&nbsp;"
-			else:
-				oline = oline + char
+			tstart = max(tstart, start)
+			tend = min(tend, end)
+			if tstart > last:
+				out.append(self.escape(line[last:tstart]))
+			out.append(self.renderToken(type, line[tstart:tend]))
+			last = tend
 
-			if char == '<':
-				in_tag = in_tag + 1
-			elif char == '>':
-				in_tag = in_tag - 1
-		
-		return oline
+		if last < end:
+			out.append(self.escape(line[last:end]))
 
-	def colorKeywords(self, line):
-		for keyword in self.keywords:
-			line = re.sub(r"(\s)(%s)(\s)" % keyword, r"\1<span class='%s'>\2</span>\3" % (keyword.replace('#', '')), line)
-			line = re.sub(r"^%s(\s)" % keyword, r"<span class='%s'>%s</span>\1" % (keyword.replace('#', ''), keyword), line)
-			line = re.sub(r"(\s)%s$" % keyword, "\1<span class='%s'>%s</span>" % (keyword.replace('#', ''), keyword), line)
-		return line
-
-	def colorLiterals(self, line):
-		line = re.sub(r"('[^']*')", r"<span class='str_literal'>\1</span>", line)
-		line = re.sub(r'("[^"]*")', r"<span class='str_literal'>\1</span>", line)
-		return line
+		return "".join(out)
 
 	def commentBox(self, comment):
-		return "<span class='comment'>%s</span>" % comment
+		return "<span class='%s'>%s</span>" % (self.css('comment'), comment)
 
-	def highlightKeyword(self, line, keyword, value):
-		line = line.replace(keyword, "<span class='highlight'>%s</span>" % keyword)
-		return line + "<span class='highlight_text'>%s</span>" % value
+	# (start, end, rank, open, close, plain) span of an annotated keyword
+	def highlightSpan(self, start, keyword):
+		return (start, start + len(keyword), highlight_rank, "<span class='%s'>" % self.css('highlight'), "</span>", True)
 
-	def needinfoKeyword(self, line, keyword, value, attrs):
-		lkeyword = keyword
+	def needinfoSpan(self, start, keyword, attrs):
 		if 'link' in attrs:
-			lkeyword = "<a href='#%s'>%s</a>" % (attrs['link'], keyword)
-
-		line = line.replace(keyword, "<span class='needinfo'>%s</span>" % lkeyword)
-		return line + "<span class='needinfo_text'><b>NEEDINFO:</b> %s</span>" % value
-
-	def highlightBox(self, keyword):
-		return "<span class='highlight'>%s</span>" % keyword
+			return (start, start + len(keyword), needinfo_rank, "<span class='%s'><a href='#%s'>" % (self.css('needinfo'), attrs['link']), "</a></span>", True)
+		return (start, start + len(keyword), needinfo_rank, "<span class='%s'>" % self.css('needinfo'), "</span>", True)
 
-	def needinfoBox(self, keyword, attrs):
-		lkeyword = keyword
-                if 'link' in attrs:
-                        lkeyword = "<a href='#%s'>%s</a>" % (attrs['link'], keyword)
-
-		return "<span class='needinfo'>%s</span>" % lkeyword
+	def symbolSpan(self, start, name, href):
+		return (start, start + len(name), symbol_rank, "<a class='%s' href='%s'>" % (self.css('symbol'), href), "</a>", False)
 
 	def highlightLabel(self, value):
+		if self.compact:
+			return self.labelBox('highlight_text', value)
 		return "<span class='highlight_text'>%s</span>" % value
 		
 	def needinfoLabel(self, value):
+		if self.compact:
+			return self.labelBox('needinfo_text', value)
 		return "<span class='needinfo_text'><b>NEEDINFO:</b> %s</span>" % value
 
-	def add2lnSubs(self, clm, size, value):
-		#print "clm: %d" % clm
-		if clm not in self.ln_subs:
-			self.ln_subs[clm] = [(size, value)]
+	# empty label showing its text from the page style, the text stays in
+	# the html (and in cached fragments) until internLabels is called
+	def labelBox(self, css, value):
+		return "<span class='%s L\x00%s\x00'></span>" % (self.css(css), value.replace("\x00", ""))
+
+	def internLabels(self, html):
+		if "\x00" not in html:
+			return html
+		return label_re.sub(self.labelClass, html)
+
+	def labelClass(self, match):
+		text = match.group(1)
+		if text not in self.label_index:
+			self.label_index[text] = len(self.labels)
+			self.labels.append(text)
+		return "L%d" % self.label_index[text]
+
+	def cssString(self, text):
+		# label texts are escaped for html
+		text = text.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+		text = text.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\a ").replace("<", "\\3c ")
+		return "\"%s\"" % text
+
+	def printLabels(self, fd):
+		if not self.labels:
+			return
+
+		fd.write("<style type=\"text/css\">\n")
+		for index in range(0, len(self.labels)):
+			fd.write("span.L%d:after {content: %s;}\n" % (index, self.cssString(self.labels[index])))
+		fd.write("</style>\n")
+
+	def getLineKey(self, line_number, db_index):
+		# everything a line's html depends on besides the source itself,
+		# folds only wrap the line
+		commands = []
+		for command in self.vis_lines.get(line_number, []):
+			if command['command'] != 'fold':
+				commands.append(tuple(sorted(command.items())))
+		return (tuple(commands), tuple(db_index.get(line_number, [])), tuple(self.link_index.get(line_number, [])))
+
+	def renderLine(self, index, db_index):
+		self.collectSubs(index, db_index)
+		return self.renderSubs(index)
+
+	# spans of annotated keywords into self.ln_spans, labels and comments
+	# put at the end of the line into self.ln_tail
+	def collectSubs(self, index, db_index):
+		line = self.src_lines[index - self.line_offset]
+
+		self.ln_spans = []
+		self.ln_tail = []
+		# columns of needinfo links, links are never nested
+		anchored = set()
+
+		if (index + 1) in self.vis_lines:
+			commands = self.vis_lines[index + 1]
+			for command in commands:
+				if command['command'] == 'comment':
+					prefix = ""
+					if len(line) > 0:
+						prefix = self.whitespaces(3*" ")
+					self.ln_tail.append(prefix + self.commentBox( command['value'] ))
+
+				elif command['command'] == 'highlight':
+					v_keyword = command['keyword']
+					if v_keyword in self.src_keywords and (index + 1) in self.src_keywords[ v_keyword ]:
+						for clm_item in self.src_keywords[ v_keyword ][ index + 1 ]:
+							self.ln_spans.append(self.highlightSpan(clm_item - 1, v_keyword))
+							self.ln_tail.append(self.highlightLabel( self.pretokenize(command['value']) ))
+				elif command['command'] == 'needinfo':
+					v_keyword = command['keyword']
+					if v_keyword in self.src_keywords and (index + 1) in self.src_keywords[ v_keyword ]:
+						for clm_item in self.src_keywords[ v_keyword ][ index + 1 ]:
+							self.ln_spans.append(self.needinfoSpan(clm_item - 1, v_keyword, command['attrs']))
+							if 'link' in command['attrs']:
+								anchored.add(clm_item)
+							self.ln_tail.append(self.needinfoLabel( self.pretokenize(command['value']) ))
+
+		for (clm_item, keyword, value) in db_index.get(index + 1, []):
+			self.ln_spans.append(self.highlightSpan(clm_item - 1, keyword))
+			self.ln_tail.append(self.highlightLabel( self.pretokenize(value) ))
+
+		for (clm_item, name, href) in self.link_index.get(index + 1, []):
+			if clm_item not in anchored:
+				self.ln_spans.append(self.symbolSpan(clm_item - 1, name, href))
+
+	def renderSubs(self, index):
+		line = self.src_lines[index - self.line_offset]
+		out_line = []
+		for piece in nestSpans(self.ln_spans, len(line)):
+			if not isinstance(piece, tuple):
+				out_line.append(piece)
+				continue
+
+			(start, end, plain) = piece
+			if plain:
+				out_line.append(self.escape(line[start:end]))
+			else:
+				out_line.append(self.renderTokens(line, self.src_tokens.get(index + 1, []), start, end))
+
+		return "".join(out_line + self.ln_tail)
+
+	def jsString(self, text):
+		return "\"%s\"" % text.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n").replace("\r", "\\r")
+
+	def getFoldsDir(self, file):
+		return "%s.html.folds" % file
+
+	def startLazyFold(self, fold, file):
+		return {'id': fold['id'], 'src': "%s/%d.js" % (self.getFoldsDir(file), fold['id']), 'content': cStringIO.StringIO(), 'folded': []}
+
+	def finishLazyFold(self, lazy_fold, destination):
+		# vis.js fills the fold with the content and folds the folded ones in it
+		with OutputFile("%s/%s" % (destination, lazy_fold['src']), self.gzip_output) as fd:
+			fd.write("foldLoaded(%d, %s, [%s])\n" % (lazy_fold['id'], self.jsString(lazy_fold['content'].getvalue()), ", ".join(map(str, lazy_fold['folded']))))
+
+	def printHeader(self, fd):
+		fd.write("<!DOCTYPE html PUBLIC \"-//W3C//DTD XHTML 1.0 Strict//EN\" \"http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd\">\n")
+		fd.write("<html>\n")
+		fd.write("<head>\n")
+		if self.bundle_href is not None:
+			fd.write("<script type=\"text/javascript\" src=\"%s\"></script>\n" % self.bundle_href)
 		else:
-			self.ln_subs[clm].append( (size, value) )
-
-	def decomposeLineForSubs(self, line, points):
-		#print line
-		# get all intersection points
-		i_points = {}
-		i_substs = {}
-		for point in points:
-			sz = 0
-			i_substs[point] = []
-
-			for (size, subs) in points[point]:
-				sz = max(sz, size)
-				if point in i_substs:
-					i_substs[point].append(subs)
-				else:
-					i_substs[point] = [subs]
-
-			i_points[point] = sz
-
-		if i_points:
-			#print i_points
-			ks = sorted(i_points.keys())
-			#print ks
-
-			d_lines = []
-			pks = 0
-			for p in ks:
-				#print p
-				d_lines.append( (line[pks:p-1], line[pks:p-1]) )
-				#print line[pks:p-1]
-				# primarly for more comments at the end of a line
-				# but having more highlighted keywords (needinfo+highligh)
-				jp = "".join(i_substs[p])
-				#print jp
-				# THIS IS HACK, HAS TO BE REWRITTEN!!!
-				if len(i_substs[p]) == 2:
-					if "<span class='highlight'>" in jp and "<span class='needinfo'>" in jp:
-						keyword = re.sub(r"<[^>]*>", "", jp)
-						# now the keyword is 2 times duplicated
-						size = len(keyword)
-						keyword = keyword[:size/2]
-						jp = "<span class='highlight'><span class='needinfo'>%s</span></span>" % (keyword)
-
-				d_lines.append( (line[(p-1):p - 1 + i_points[p]], jp ) )
-				#print d_lines
-				pks = i_points[p] + p - 1
-			# append the last bit of the line
-			d_lines.append( (line[pks:], line[pks:]) )
-			#exit(0)
-			return d_lines
-
-		return [(line,line)]
-
-	def addToCommentsDB(self, line, column, start):
-		if line not in self.comments_db:
-			self.comments_db[line] = [(column, start)]
+			for style in layout_styles:
+				fd.write("<link rel=\"stylesheet\" type=\"text/css\" href=\"%s/%s\" />\n" % (self.layout_href, style))
+			for script in layout_scripts:
+				fd.write("<script type=\"text/javascript\" src=\"%s/%s\"></script>\n" % (self.layout_href, script))
+		fd.write("<script type=\"text/javascript\">\n<!--\n")
+		fd.write("$(document).ready(function() { $('span.fold_off').hide(); })\n")
+		fd.write("// -->\n</script>\n")
+		fd.write("</head>\n")
+		fd.write("<body>\n")
+		if self.callgraph_href is not None:
+			fd.write("<div class='callgraph'>call graph: <a href='%s.dot'>dot</a> <a href='%s.json'>json</a></div>\n" % (self.callgraph_href, self.callgraph_href))
+		if self.search_root is not None:
+			fd.write("<div class='search'><input type='text' id='search' placeholder='search' /><div id='search_results'></div></div>\n")
+			fd.write("<script type=\"text/javascript\">searchInit(%s, %s)</script>\n" % (self.jsonValue(self.search_root), self.jsonValue(self.search_page)))
+
+	# shared keyworddb into self.keyworddb, returns the file's keyworddb
+	def loadKeywordDBs(self, file, destination):
+		if self.shared_keyworddb is None:
+			self.keyworddb = loadKeywordDB("%s/keyworddb" % destination)
 		else:
-			self.comments_db[line].append( (column, start) )
+			self.keyworddb = self.shared_keyworddb
+		return self.parseKeywordDB("%s/%s.keyworddb" % (destination, file))
+
+	def startTerms(self):
+		self.page_terms = None
+		if self.search_root is not None:
+			self.page_terms = PageTerms(self.keywords)
+			self.page_terms.addCommands(self.vis_lines)
+
+	def addTerms(self, db_index):
+		if self.page_terms is not None:
+			self.page_terms.addIdentifiers(self.src_keywords)
+			self.page_terms.addLabels(db_index)
+
+	def saveTerms(self, file, destination):
+		terms_file = getTermsFile("%s/%s.html" % (destination, file))
+		if self.page_terms is not None:
+			self.page_terms.save(terms_file)
+		elif os.path.exists(terms_file):
+			# the page is not searched any more
+			os.unlink(terms_file)
+
+	def getClassIndex(self, css):
+		if css not in self.class_index:
+			self.class_index[css] = len(self.classes)
+			self.classes.append(css)
+		return self.class_index[css]
+
+	def tokenRuns(self, line, tokens):
+		# flat [start, length, class index, ...] of tokens with a markup,
+		# the same ones renderTokens puts into spans
+		runs = []
+		for (type, column, length) in tokens:
+			if type not in markup_types:
+				continue
 
-	def processComments(self):
-		self.comments_db = {}
-		for [(ls,cs),(le,ce)] in self.src_comments:
-			self.addToCommentsDB(ls, cs, True)
-			self.addToCommentsDB(le, ce, False)
+			start = column - 1
+			text = line[start:start + length]
+			if type == 'IDENTIFIER' or type == 'MACRO':
+				if text in self.keyword_classes:
+					runs.extend([start, length, self.getClassIndex(self.keyword_classes[text])])
+			elif type == 'STRING' or type == 'CHARACTER':
+				runs.extend([start, length, self.getClassIndex(self.css('str_literal'))])
+			elif type == 'COMMENT' or type == 'MCOMMENT':
+				runs.extend([start, length, self.getClassIndex(self.css('codecomment'))])
+			elif type == 'INCLUDE':
+				match = include_re.match(text)
+				if match is None:
+					continue
+				if match.group(1) in self.keyword_classes:
+					runs.extend([start, len(match.group(1)), self.getClassIndex(self.keyword_classes[match.group(1)])])
+				if match.group(3)[0] == '"':
+					runs.extend([start + match.start(3), len(match.group(3)), self.getClassIndex(self.css('str_literal'))])
+
+		return runs
+
+	def jsonText(self, text):
+		# sources are not always utf-8
+		try:
+			return text.decode("utf-8")
+		except UnicodeDecodeError:
+			return text.decode("latin-1")
+
+	def charRuns(self, line, runs):
+		# runs in characters of the decoded line, not in bytes
+		char_runs = []
+		for index in range(0, len(runs), 3):
+			start = len(line[:runs[index]].decode("utf-8", "replace"))
+			end = len(line[:runs[index] + runs[index + 1]].decode("utf-8", "replace"))
+			char_runs.extend([start, end - start, runs[index + 2]])
+		return char_runs
+
+	def jsonValue(self, value):
+		# inside a script element
+		return json.dumps(value, separators = (',', ':')).replace("</", "<\\/")
+
+	# page with lines as data, vis.js draws only the lines in the window:
+	# a line is its text, [text, runs] or {'h': html} if it has annotations
+	def printVirtualPage(self, file, destination):
+		self.classes = []
+		self.class_index = {}
+		(folds, fold_starts, fold_ends) = self.getFolds()
+		self.startTerms()
+
+		with OutputFile("%s/%s.html" % (destination, file), self.gzip_output) as fd:
+			self.printHeader(fd)
+			filekeyworddb = self.loadKeywordDBs(file, destination)
+
+			if self.compact:
+				fd.write("<div id='lines' class='code'></div>\n")
+			else:
+				fd.write("<div id='lines'></div>\n")
+			fd.write("<script type=\"text/javascript\">\nvisPage({\"lines\":[\n")
+			separator = ""
+			for (first_index, lines, keywords, comments, tokens) in self.getChunks():
+				self.line_offset = first_index
+				self.src_lines = lines
+				self.src_keywords = keywords
+				self.src_comments = comments
+				self.src_tokens = tokens
+				self.line_count = first_index + len(lines)
+
+				db_index = self.indexKeywordDB(self.keyworddb, filekeyworddb)
+				self.link_index = self.indexSymbols(file, destination)
+				self.addTerms(db_index)
+
+				for index in range(first_index, first_index + len(lines)):
+					line = lines[index - first_index]
+					self.collectSubs(index, db_index)
+					if self.ln_spans or self.ln_tail:
+						entry = {'h': self.jsonText(self.internLabels(self.renderSubs(index)))}
+					else:
+						entry = self.jsonText(line)
+						runs = self.tokenRuns(line, self.src_tokens.get(index + 1, []))
+						if runs and len(entry) != len(line):
+							runs = self.charRuns(line, runs)
+						if runs:
+							entry = [entry, runs]
+
+					fd.write(separator + self.jsonValue(entry))
+					separator = ",\n"
+
+			# outermost first, as vis.js expects them
+			folds = [[fold['id'], fold['start'], fold['end'], fold['folded'], self.jsonText(fold['label'])] for fold in folds]
+			fd.write("\n],\"folds\":%s,\"classes\":%s})\n</script>\n" % (self.jsonValue(folds), self.jsonValue(self.classes)))
+			self.printLabels(fd)
+			fd.write("</body>\n")
+			fd.write("</html>\n")
 
-	def printPage(self, file, destination):
+		self.saveTerms(file, destination)
 
-		with open("%s/%s.html" % (destination, file), 'w') as fd:
-			fd.write("<!DOCTYPE html PUBLIC \"-//W3C//DTD XHTML 1.0 Strict//EN\" \"http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd\">\n")
-			fd.write("<html>\n")
-			fd.write("<head>\n")
-			fd.write("<link rel=\"stylesheet\" type=\"text/css\" href=\"layout/vis.css\" />\n")
-			fd.write("<script type=\"text/javascript\" src=\"layout/jquery-1.9.1.js\"></script>\n")
-			fd.write("<script type=\"text/javascript\" src=\"layout/vis.js\"></script>\n")
-			fd.write("<script type=\"text/javascript\">\n<!--\n")
-			fd.write("$(document).ready(function() { $('span.fold_off').hide(); })\n")
-			fd.write("// -->\n</script>\n")
-			fd.write("</head>\n")
-			fd.write("<body>\n")
-
-			self.copyLayout(self.layout_dir, destination)
-			self.keyworddb = self.parseKeywordDB("%s/keyworddb" % destination)
-			filekeyworddb = self.parseKeywordDB("%s/%s.keyworddb" % (destination, file))
+	# folds of the page nested by the span resolver, numbered in the order
+	# of their lines and commands
+	def getFolds(self):
+		folds = []
+		for line_number in sorted(self.vis_lines):
+			for command in self.vis_lines[line_number]:
+				if command['command'] == 'fold':
+					folds.append( {'id': len(folds) + 1, 'start': line_number, 'end': command['endline'], 'folded': command['folded'], 'label': self.pretokenize(command['value']) } )
+		return resolveFolds(folds)
 
-			# source code file specific keywords has higher priority (later maybe display both)
-			for key in filekeyworddb:
-				self.keyworddb[key] = filekeyworddb[key]
-
-			#self.src_keywords
-			
-
-			count = len(self.src_lines)
-			fold_id = 1
-			fold = False
-			fold_start = -1
-			fold_end = -1
-			fold_text = ""
-			folded = 0
-			fold_stack = []
-
-			self.processComments()
-
-	                for index in range(0, count):
-				ln = "%4s" % (index + 1)
-				ln = "<a name='%s'>%s</a>" % (index + 1, ln.replace(' ', "&nbsp;"))
-				oline = line = self.src_lines[index]
-
-				self.ln_subs = {}
-
-				if (index + 1) in self.vis_lines:
-					commands = self.vis_lines[index + 1]
-					for command in commands:
-						if command['command'] == 'comment':
-							#print index + 1
-							prefix = ""
-							if len(line) > 0:
-								prefix = 3*"&nbsp;"
-							# put comment at the end of the current line
-							clm = len(oline) + 1
-							self.add2lnSubs(clm, len(command['value']), prefix + self.commentBox( command['value'] ))
-
-						elif command['command'] == 'fold':
-							fold = True
-							fold_start = index + 1
-							fold_end = command['endline']
-							fold_text = self.pretokenize(command['value'])
-							folded = command['folded']
-
-							fold_stack.append( {'id': fold_id, 'start': index + 1, 'end': command['endline'], 'folded': command['folded'], 'label': self.pretokenize(command['value']) } )
-							fold_id = fold_id + 1
-
-						elif command['command'] == 'highlight':
-							v_keyword = command['keyword']
-							if v_keyword in self.src_keywords and (index + 1) in self.src_keywords[ v_keyword ]:
-								clm = self.src_keywords[ v_keyword ][ index + 1 ]
-								for clm_item in clm:
-									self.add2lnSubs(clm_item, len(v_keyword), self.highlightBox(v_keyword))
-									comment = self.highlightLabel( self.pretokenize(command['value']) )
-									self.add2lnSubs(len(oline)+1, len(comment), comment)
-						elif command['command'] == 'needinfo':
-							v_keyword = command['keyword']
-							if v_keyword in self.src_keywords and (index + 1) in self.src_keywords[ v_keyword ]:
-	                                                        clm = self.src_keywords[ v_keyword ][ index + 1 ]
-	                                                        for clm_item in clm:
-									self.add2lnSubs(clm_item, len(v_keyword), self.needinfoBox(v_keyword, command['attrs']))
-									comment = self.needinfoLabel( self.pretokenize(command['value']) )
-									self.add2lnSubs(len(oline)+1, len(comment), comment)
-						
-				for keyword in self.keyworddb:
-					if keyword not in self.src_keywords:
-						continue
-
-					if (index + 1) not in self.src_keywords[ keyword ]:
-						continue
-
-					clm = self.src_keywords[ keyword ][ index + 1 ]
-					for clm_item in clm:
-						self.add2lnSubs(clm_item, len(keyword), self.highlightBox(keyword))
-						comment = self.highlightLabel( self.pretokenize( self.keyworddb[keyword]) )
-						self.add2lnSubs(len(oline)+1, len(comment), comment)
-							
-
-				# color comments
-				if index + 1 in self.comments_db:
-					for (column, start) in self.comments_db[index + 1]:
-						#print (column, start)
-						if start:
-							self.add2lnSubs(column, 0, "<span class='codecomment'>")
-						else:
-							self.add2lnSubs(column, 0, "</span>")
-						#print self.ln_subs[column]
-
-				out_line = []
-				# split the line into pairs of substrings (to replace, replace with
-				d_lines = self.decomposeLineForSubs(oline, self.ln_subs)
-				for (orig, new) in d_lines:
-					if orig == new:
-						new = self.pretokenize(new)
-						new = self.colorLiterals(new)
-						new = self.colorKeywords(new)
-						new = self.tokenize(new)
-						new = self.postTokenize(new)
-
-					out_line.append(new)
-				
-				out_line = "".join(out_line)
-
-				prefix = ""
-				sufix = "<br />"
-				# get the current fold
-				cfold = []
-				if fold_stack:
-					fold = True
-					cfold = fold_stack[-1]
-				else:
-					fold = False
-
-				if fold and cfold['start'] == (index + 1):
-					prefix = "<span class='fold_button fold_off fold_off_id_%d' onclick='toggleFold(%d)'>Unfold</span>" % (cfold['id'], cfold['id'])
-					prefix = prefix + "<span class='fold_button fold_on fold_on_id_%d' onclick='toggleFold(%d)'>Fold</span>" % (cfold['id'], cfold['id'])
-					prefix = prefix + "<span class='fold_text'>%s</span><br />" % cfold['label']
-					prefix = prefix + "<div class='fold' id='fold_%d'>" % cfold['id']
-
-					if cfold['folded']:
-						fd.write("<script type='text/javascript'>\n")
-						fd.write("$(document).ready(function() { toggleFold(%d) })\n" % cfold['id'])
-						fd.write("</script>\n")
-
-				if fold and cfold['end'] == (index + 1):
-					sufix = "</div>"
-					while True:
-						# remove fold from stack
-						del(fold_stack[-1])
-						if fold_stack and fold_stack[-1]['end'] == (index + 1):
-							sufix = sufix + "</div>"
-							cfold = fold_stack[-1]
-							continue
-						else:
-							break
+	def getChunks(self):
+		if self.src_chunks is None:
+			return [(0, self.src_lines, self.src_keywords, self.src_comments, self.src_tokens)]
+		return self.src_chunks
+
+	def printPage(self, file, destination):
 
-				fd.write("%s%s %s%s\n" % (prefix, ln, out_line, sufix))
+		if self.virtual:
+			return self.printVirtualPage(file, destination)
+
+		self.startTerms()
+		with OutputFile("%s/%s.html" % (destination, file), self.gzip_output) as fd:
+			self.printHeader(fd)
+			filekeyworddb = self.loadKeywordDBs(file, destination)
+
+			(folds, fold_starts, fold_ends) = self.getFolds()
+			# ids of folds written so far and not closed, innermost last
+			open_folds = []
+			# lazy fold being written and where lines go meanwhile
+			lazy_fold = None
+			out = fd
+			folds_dir = "%s/%s" % (destination, self.getFoldsDir(file))
+			if os.path.exists(folds_dir):
+				shutil.rmtree(folds_dir)
+			if self.lazy_folds:
+				os.mkdir(folds_dir)
+
+			# whitespaces of compact pages are kept by the code block, lines
+			# are ended by a newline and folded folds folded by one script
+			line_end = "<br />\n"
+			block_end = "\n"
+			folded = []
+			if self.compact:
+				line_end = "\n"
+				block_end = ""
+				fd.write("<div class='code'>")
+
+			for (first_index, lines, keywords, comments, tokens) in self.getChunks():
+				self.line_offset = first_index
+				self.src_lines = lines
+				self.src_keywords = keywords
+				self.src_comments = comments
+				self.src_tokens = tokens
+				self.line_count = first_index + len(lines)
+
+				# only keyworddb entries occuring in the chunk, by line
+				db_index = self.indexKeywordDB(self.keyworddb, filekeyworddb)
+				self.link_index = self.indexSymbols(file, destination)
+				self.addTerms(db_index)
+
+				for index in range(first_index, first_index + len(lines)):
+					ln = "<a name='%s'>%s</a>" % (index + 1, self.whitespaces("%4s" % (index + 1)))
+
+					# lines with the same commands and keyworddb entries as the last
+					# time are taken from the fragment cache
+					line_key = self.getLineKey(index + 1, db_index)
+					fragment = self.cached_fragments.get(index + 1)
+					if fragment is not None and fragment[0] == line_key:
+						out_line = fragment[1]
+					else:
+						out_line = self.renderLine(index, db_index)
+					if self.fragments is not None:
+						self.fragments[index + 1] = (line_key, out_line)
+
+					out_line = self.internLabels(out_line)
+
+					# folds starting on the line, outermost first
+					prefix = []
+					for cfold in fold_starts.get(index + 1, []):
+						open_folds.append(cfold['id'])
+						prefix.append("<span class='fold_button fold_off fold_off_id_%d' onclick='toggleFold(%d)'>Unfold</span>" % (cfold['id'], cfold['id']))
+						prefix.append("<span class='fold_button fold_on fold_on_id_%d' onclick='toggleFold(%d)'>Fold</span>" % (cfold['id'], cfold['id']))
+						prefix.append("<span class='fold_text'>%s</span><br />" % cfold['label'])
+
+						if cfold['folded'] and lazy_fold is not None:
+							lazy_fold['folded'].append(cfold['id'])
+						elif cfold['folded'] and self.compact:
+							folded.append(cfold['id'])
+						elif cfold['folded']:
+							fd.write("<script type='text/javascript'>\n")
+							fd.write("$(document).ready(function() { toggleFold(%d) })\n" % cfold['id'])
+							fd.write("</script>\n")
+
+						if cfold['folded'] and self.lazy_folds and lazy_fold is None:
+							# only the empty fold goes into the page
+							lazy_fold = self.startLazyFold(cfold, file)
+							fd.write("".join(prefix) + "<div class='fold' id='fold_%d' data-src='%s'>" % (cfold['id'], lazy_fold['src']))
+							out = lazy_fold['content']
+							prefix = []
+						else:
+							prefix.append("<div class='fold' id='fold_%d'>" % cfold['id'])
+					prefix = "".join(prefix)
+
+					# folds ending on the line, innermost first
+					closed = []
+					for cfold in fold_ends.get(index + 1, []):
+						closed.append(cfold['id'])
+						del(open_folds[-1])
+
+					sufix = line_end
+					if closed:
+						sufix = "</div>" * len(closed) + block_end
+
+					if lazy_fold is not None and lazy_fold['id'] in closed:
+						# folds inside the lazy one are closed in its content
+						inner = closed.index(lazy_fold['id'])
+						out.write("%s%s %s%s" % (prefix, ln, out_line, "</div>" * inner))
+						self.finishLazyFold(lazy_fold, destination)
+						lazy_fold = None
+						out = fd
+						fd.write("%s%s" % ("</div>" * (len(closed) - inner), block_end))
+					else:
+						out.write("%s%s %s%s" % (prefix, ln, out_line, sufix))
+
+			# folds running past the last line
+			closed = list(reversed(open_folds))
+			if lazy_fold is not None:
+				inner = closed.index(lazy_fold['id'])
+				out.write("</div>" * inner)
+				self.finishLazyFold(lazy_fold, destination)
+				closed = closed[inner:]
+			if closed:
+				fd.write("%s%s" % ("</div>" * len(closed), block_end))
+
+			if self.compact:
+				fd.write("</div>\n")
+				if folded:
+					fd.write("<script type='text/javascript'>\n")
+					fd.write("$(document).ready(function() { %s })\n" % "; ".join(["toggleFold(%d)" % folded_id for folded_id in folded]))
+					fd.write("</script>\n")
+				self.printLabels(fd)
 
 			fd.write("</body>\n")
 			fd.write("</html>\n")
+
+		self.saveTerms(file, destination)
@@ -0,0 +1,155 @@
+#!/bin/python
+
+import os
+import mmap
+import struct
+
+# compiled keyworddb:
+#   magic
+#   header: size and mtime of the text keyworddb it was compiled from, number of keys
+#   offsets: number of keys + 1 offsets of records into the data
+#   data: records "keyword\0text" sorted by keyword
+compiled_magic = "CVKDB01\n"
+header_format = "<qdI"
+header_size = struct.calcsize(header_format)
+offset_format = "<I"
+offset_size = struct.calcsize(offset_format)
+
+def readKeywordDB(file):
+	content = ""
+	keyworddb = {}
+
+	# keyworddb exists?
+	if not os.path.exists(file):
+		open(file, 'a').close()
+		return {}
+
+	with open(file, 'r') as fd:
+		content = fd.read()
+
+	for line in content.split("\n"):
+		if len(line) == 0:
+			continue
+
+		if line[0] == '#':
+			continue
+
+		items = line.split(":")
+		if len(items) < 2:
+			continue
+
+		keyworddb[items[0]] = ":".join(items[1:])
+
+	return keyworddb
+
+def getCompiledFile(file):
+	return "%s.idx" % file
+
+def compileKeywordDB(file):
+	keyworddb = readKeywordDB(file)
+	st = os.stat(file)
+
+	offsets = []
+	data = []
+	offset = 0
+	for keyword in sorted(keyworddb.keys()):
+		record = "%s\0%s" % (keyword, keyworddb[keyword])
+		offsets.append(offset)
+		data.append(record)
+		offset = offset + len(record)
+	offsets.append(offset)
+
+	compiled_file = getCompiledFile(file)
+	tmp_file = "%s.tmp" % compiled_file
+	with open(tmp_file, "wb") as fd:
+		fd.write(compiled_magic)
+		fd.write(struct.pack(header_format, st.st_size, st.st_mtime, len(keyworddb)))
+		fd.write(struct.pack("<%dI" % len(offsets), *offsets))
+		fd.write("".join(data))
+	os.rename(tmp_file, compiled_file)
+
+	return len(keyworddb)
+
+class CompiledKeywordDB(object):
+
+	def __init__(self, file):
+		self.file = file
+		self.open()
+
+	def open(self):
+		with open(self.file, "rb") as fd:
+			self.data = mmap.mmap(fd.fileno(), 0, access = mmap.ACCESS_READ)
+
+		if self.data[0:len(compiled_magic)] != compiled_magic:
+			raise ValueError("%s is not a compiled keyworddb" % self.file)
+
+		(self.src_size, self.src_mtime, self.count) = struct.unpack_from(header_format, self.data, len(compiled_magic))
+		self.offsets_start = len(compiled_magic) + header_size
+		self.data_start = self.offsets_start + (self.count + 1) * offset_size
+
+	# workers get the file name only and map it again
+	def __getstate__(self):
+		return {'file': self.file}
+
+	def __setstate__(self, state):
+		self.file = state['file']
+		self.open()
+
+	def isFresh(self, text_file):
+		try:
+			st = os.stat(text_file)
+		except OSError:
+			return False
+
+		return st.st_size == self.src_size and st.st_mtime == self.src_mtime
+
+	def record(self, index):
+		(start,) = struct.unpack_from(offset_format, self.data, self.offsets_start + index * offset_size)
+		(end,) = struct.unpack_from(offset_format, self.data, self.offsets_start + (index + 1) * offset_size)
+		return (self.data_start + start, self.data_start + end)
+
+	def keyword(self, index):
+		(start, end) = self.record(index)
+		return self.data[start:self.data.find("\0", start, end)]
+
+	def get(self, keyword, default = None):
+		# binary search over sorted keywords
+		low = 0
+		high = self.count
+		while low < high:
+			middle = (low + high) / 2
+			if self.keyword(middle) < keyword:
+				low = middle + 1
+			else:
+				high = middle
+
+		if low == self.count or self.keyword(low) != keyword:
+			return default
+
+		(start, end) = self.record(low)
+		return self.data[start + len(keyword) + 1:end]
+
+	def __contains__(self, keyword):
+		return self.get(keyword) is not None
+
+	def __getitem__(self, keyword):
+		value = self.get(keyword)
+		if value is None:
+			raise KeyError(keyword)
+		return value
+
+	def __len__(self):
+		return self.count
+
+# compiled keyworddb if there is an up to date one, parsed text keyworddb otherwise
+def loadKeywordDB(file):
+	compiled_file = getCompiledFile(file)
+	if os.path.exists(file) and os.path.exists(compiled_file):
+		try:
+			keyworddb = CompiledKeywordDB(compiled_file)
+			if keyworddb.isFresh(file):
+				return keyworddb
+		except (ValueError, struct.error, mmap.error):
+			pass
+
+	return readKeywordDB(file)
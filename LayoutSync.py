@@ -0,0 +1,120 @@
+#!/bin/python
+
+import os
+import json
+import shutil
+import hashlib
+from OutputFile import OutputFile
+
+# how layout files get into a destination
+layout_modes = ["copy", "hardlink", "symlink"]
+# layout files in the order pages load them
+layout_styles = ["vis.css"]
+layout_scripts = ["jquery-1.9.1.js", "vis.js"]
+
+def removePath(path):
+	if os.path.isdir(path) and not os.path.islink(path):
+		shutil.rmtree(path)
+	elif os.path.lexists(path):
+		os.unlink(path)
+
+def isSynced(src_file, dst_file, mode):
+	if not os.path.lexists(dst_file):
+		return False
+
+	if mode == "hardlink":
+		return os.path.samefile(src_file, dst_file)
+
+	# copy, never write through a link to the original file
+	if os.path.islink(dst_file) or os.path.samefile(src_file, dst_file):
+		return False
+
+	src_stat = os.stat(src_file)
+	dst_stat = os.stat(dst_file)
+	return src_stat.st_size == dst_stat.st_size and int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+
+def syncFile(src_file, dst_file, mode):
+	if isSynced(src_file, dst_file, mode):
+		return False
+
+	# readers never see a half written file
+	tmp_file = "%s.tmp" % dst_file
+	removePath(tmp_file)
+	if mode == "hardlink":
+		try:
+			os.link(src_file, tmp_file)
+		except OSError:
+			# e.g. a different file system
+			shutil.copy2(src_file, tmp_file)
+	else:
+		shutil.copy2(src_file, tmp_file)
+
+	if os.path.isdir(dst_file) and not os.path.islink(dst_file):
+		shutil.rmtree(dst_file)
+	os.rename(tmp_file, dst_file)
+	return True
+
+# make dst_dir the same as layout_dir, only missing or changed files are copied
+# (or linked), returns number of files written
+def syncLayout(layout_dir, dst_dir, mode = "copy"):
+	layout_dir = os.path.realpath(layout_dir)
+
+	if mode == "symlink":
+		if os.path.islink(dst_dir) and os.readlink(dst_dir) == layout_dir:
+			return 0
+		removePath(dst_dir)
+		os.symlink(layout_dir, dst_dir)
+		return 1
+
+	# switching from the symlink mode
+	if os.path.islink(dst_dir):
+		os.unlink(dst_dir)
+
+	written = 0
+	for (root, dirs, files) in os.walk(layout_dir):
+		dst_root = os.path.normpath("%s/%s" % (dst_dir, os.path.relpath(root, layout_dir)))
+		if not os.path.isdir(dst_root):
+			removePath(dst_root)
+			os.makedirs(dst_root)
+
+		for file in files:
+			if syncFile("%s/%s" % (root, file), "%s/%s" % (dst_root, file), mode):
+				written = written + 1
+
+	return written
+
+# one script made of all layout files, css is added to the page by it,
+# returns (content hashed file name, content)
+def makeBundle(layout_dir):
+	parts = []
+	for style in layout_styles:
+		with open("%s/%s" % (layout_dir, style), "r") as fd:
+			css = fd.read()
+		parts.append("/* %s */\n(function() {\n\tvar style = document.createElement(\"style\")\n\tstyle.type = \"text/css\"\n\tstyle.appendChild(document.createTextNode(%s))\n\tdocument.getElementsByTagName(\"head\")[0].appendChild(style)\n})();\n" % (style, json.dumps(css)))
+
+	for script in layout_scripts:
+		with open("%s/%s" % (layout_dir, script), "r") as fd:
+			parts.append("/* %s */\n%s\n;\n" % (script, fd.read()))
+
+	content = "".join(parts)
+	return ("vis-%s.js" % hashlib.md5(content).hexdigest()[:12], content)
+
+# a bundle never changes under its name, bundles of older layouts are kept
+# for pages still cached by browsers, returns whether it was written
+def writeBundle(bundle_dir, name, content, compress = False):
+	bundle_file = "%s/%s" % (bundle_dir, name)
+	if os.path.exists(bundle_file) and (not compress or os.path.exists("%s.gz" % bundle_file)):
+		return False
+
+	if not os.path.isdir(bundle_dir):
+		removePath(bundle_dir)
+		os.makedirs(bundle_dir)
+
+	# readers never see a half written file
+	tmp_file = "%s.tmp" % bundle_file
+	with OutputFile(tmp_file, compress) as fd:
+		fd.write(content)
+	if compress:
+		os.rename("%s.gz" % tmp_file, "%s.gz" % bundle_file)
+	os.rename(tmp_file, bundle_file)
+	return True
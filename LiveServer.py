@@ -0,0 +1,255 @@
+#!/bin/python
+
+import os
+import re
+import sys
+import json
+import time
+import Queue
+import urllib
+import urlparse
+import threading
+import SocketServer
+import BaseHTTPServer
+import SimpleHTTPServer
+from BuildManifest import BuildManifest
+from KeywordDB import getCompiledFile
+
+# seconds between two scans of watched files
+poll_interval = 0.1
+# changes are rendered once files stop changing for this many seconds
+debounce_interval = 0.1
+# seconds a reload request waits for a new version of its page
+reload_timeout = 25
+
+body_end_re = re.compile(r'</body>', re.IGNORECASE)
+
+class LiveHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+
+	def translate_path(self, path):
+		path = urllib.unquote(urlparse.urlparse(path).path)
+		path = os.path.normpath(path).lstrip("/")
+		if path == "." or path.startswith(".."):
+			path = ""
+		return os.path.join(self.server.live.destination, path)
+
+	def do_GET(self):
+		url = urlparse.urlparse(self.path)
+		if url.path == "/__reload":
+			query = urlparse.parse_qs(url.query)
+			page = query.get('page', [""])[0]
+			version = int(query.get('version', ["0"])[0])
+			self.sendJSON({'version': self.server.live.waitForVersion(page, version, reload_timeout)})
+			return
+
+		file = self.translate_path(self.path)
+		if file.endswith(".html") and os.path.isfile(file):
+			self.sendPage(file)
+			return
+
+		SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+	def sendJSON(self, data):
+		content = json.dumps(data)
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(content)))
+		self.send_header("Cache-Control", "no-cache")
+		self.end_headers()
+		self.wfile.write(content)
+
+	# pages get a script asking for their next version
+	def sendPage(self, file):
+		page = os.path.relpath(file, self.server.live.destination)
+		version = self.server.live.getVersion(page)
+		with open(file, "r") as fd:
+			content = fd.read()
+
+		script = "<script type=\"text/javascript\">liveReload(%s, %d)</script>\n" % (json.dumps(page), version)
+		match = None
+		for match in body_end_re.finditer(content):
+			pass
+		if match is None:
+			content = content + script
+		else:
+			content = content[:match.start()] + script + content[match.start():]
+
+		self.send_response(200)
+		self.send_header("Content-Type", "text/html")
+		self.send_header("Content-Length", str(len(content)))
+		self.send_header("Cache-Control", "no-cache")
+		self.end_headers()
+		self.wfile.write(content)
+
+	def log_message(self, format, *args):
+		self.server.live.debug("%s %s" % (self.address_string(), format % args))
+
+class LiveHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+class LiveServer(object):
+
+	def __init__(self, visualizer, destination, port = 8000):
+		self.visualizer = visualizer
+		self.destination = destination
+		self.port = port
+		# warm token tables, only the changed file is lexed again
+		self.visualizer.enableTokenCache(64)
+		# page (relative to destination) -> version, bumped by every render
+		self.versions = {}
+		self.versions_changed = threading.Condition()
+		# sets of changed files, their pages are rendered by the worker
+		self.changes = Queue.Queue()
+		# path -> (size, mtime), path -> pages depending on it
+		self.stamps = {}
+		self.watched = {}
+		self.watch_lock = threading.Lock()
+
+	def debug(self, msg):
+		self.visualizer.debug(msg)
+
+	def getVersion(self, page):
+		with self.versions_changed:
+			return self.versions.get(page, 0)
+
+	def waitForVersion(self, page, version, timeout):
+		end = time.time() + timeout
+		with self.versions_changed:
+			while self.versions.get(page, 0) == version:
+				left = end - time.time()
+				if left <= 0:
+					break
+				self.versions_changed.wait(left)
+			return self.versions.get(page, 0)
+
+	def getStamp(self, path):
+		try:
+			st = os.stat(path)
+		except OSError:
+			return None
+		return (st.st_size, st.st_mtime)
+
+	# watch every input of every page in the manifest
+	def updateWatched(self, manifest):
+		watched = {}
+		for (page, entry) in manifest.pages.items():
+			for path in entry['inputs'].keys():
+				watched.setdefault(path, []).append(page)
+
+		# a compiled keyworddb is loaded instead of the text one
+		if self.visualizer.keyworddb_file:
+			compiled_file = getCompiledFile(self.visualizer.keyworddb_file)
+			watched[compiled_file] = watched.get(self.visualizer.keyworddb_file, [])
+
+		with self.watch_lock:
+			for path in watched:
+				if path not in self.stamps:
+					self.stamps[path] = self.getStamp(path)
+			self.watched = watched
+
+	def scan(self):
+		changed = []
+		with self.watch_lock:
+			for path in self.watched:
+				stamp = self.getStamp(path)
+				if stamp != self.stamps.get(path):
+					self.stamps[path] = stamp
+					changed.append(path)
+		return changed
+
+	def watch(self):
+		pending = set()
+		last_change = 0
+		while True:
+			changed = self.scan()
+			if changed:
+				last_change = time.time()
+				pending.update(changed)
+			elif pending and time.time() - last_change >= debounce_interval:
+				self.changes.put(pending)
+				pending = set()
+			time.sleep(poll_interval)
+
+	def render(self, paths):
+		keyworddb_file = self.visualizer.keyworddb_file
+		if keyworddb_file in paths or getCompiledFile(keyworddb_file) in paths:
+			self.visualizer.loadKeywordDB(self.destination)
+
+		pages = set()
+		with self.watch_lock:
+			for path in paths:
+				pages.update(self.watched.get(path, []))
+
+		manifest = BuildManifest(self.destination)
+		jobs = []
+		for page in sorted(pages):
+			if page in manifest.pages:
+				jobs.append( (manifest.pages[page]['source'], os.path.dirname("%s/%s" % (self.destination, page))) )
+		self.visualizer.updateSymbols(jobs, 1)
+		self.visualizer.updateCallGraph(jobs, 1)
+
+		rendered = []
+		for page in sorted(pages):
+			if page not in manifest.pages:
+				continue
+
+			src_file = manifest.pages[page]['source']
+			page_destination = os.path.dirname("%s/%s" % (self.destination, page))
+			# e.g. only the mtime changed
+			if self.visualizer.isUpToDate(manifest, src_file, page_destination):
+				continue
+
+			start = time.time()
+			try:
+				lines = self.visualizer.visualize(src_file, page_destination)
+			except Exception as e:
+				sys.stderr.write("%s: %s\n" % (src_file, e))
+				continue
+
+			self.visualizer.recordPage(manifest, src_file, page_destination)
+			rendered.append(page)
+			print "%8.3fs %7d lines  %s" % (time.time() - start, lines, src_file)
+			sys.stdout.flush()
+
+		if rendered:
+			manifest.save()
+			self.visualizer.buildSearchIndex(manifest)
+			self.updateWatched(manifest)
+			with self.versions_changed:
+				for page in rendered:
+					self.versions[page] = self.versions.get(page, 0) + 1
+				self.versions_changed.notify_all()
+
+	def work(self):
+		while True:
+			paths = self.changes.get()
+			# merge everything queued while the last batch was rendering
+			while not self.changes.empty():
+				paths.update(self.changes.get())
+			# a failing batch must not stop the rendering of the next ones
+			try:
+				self.render(paths)
+			except Exception as e:
+				sys.stderr.write("%s: %s\n" % (", ".join(sorted(paths)), e))
+
+	def startThread(self, target):
+		thread = threading.Thread(target = target)
+		thread.daemon = True
+		thread.start()
+		return thread
+
+	def serve(self):
+		manifest = BuildManifest(self.destination)
+		self.updateWatched(manifest)
+		self.startThread(self.watch)
+		self.startThread(self.work)
+
+		server = LiveHTTPServer(("localhost", self.port), LiveHandler)
+		server.live = self
+		print "Serving %s on http://localhost:%d/ (%d pages)" % (self.destination, self.port, len(manifest.pages))
+		sys.stdout.flush()
+		try:
+			server.serve_forever()
+		finally:
+			server.server_close()
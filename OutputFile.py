@@ -0,0 +1,59 @@
+#!/bin/python
+
+import os
+import gzip
+
+# bytes collected before they are written (and compressed)
+block_size = 1 << 16
+# files are compressed once and served many times
+compress_level = 9
+
+# Output file written in blocks. With compress a .gz sibling is written
+# along with it, static servers send it as it is (e.g. gzip_static) and
+# do not compress pages on the fly.
+class OutputFile(object):
+
+	def __init__(self, file, compress = False):
+		self.file = file
+		self.blocks = []
+		self.size = 0
+		self.fd = open(file, "wb")
+		self.gzip_fd = None
+
+		gzip_file = "%s.gz" % file
+		if compress:
+			# no timestamp, the same page is compressed into the same bytes
+			self.gzip_fd = gzip.GzipFile(gzip_file, "wb", compress_level, mtime = 0)
+		elif os.path.exists(gzip_file):
+			# would be served instead of the new file
+			os.unlink(gzip_file)
+
+	def write(self, data):
+		self.blocks.append(data)
+		self.size = self.size + len(data)
+		if self.size >= block_size:
+			self.flush()
+
+	def flush(self):
+		if not self.blocks:
+			return
+
+		data = "".join(self.blocks)
+		self.blocks = []
+		self.size = 0
+		self.fd.write(data)
+		if self.gzip_fd is not None:
+			self.gzip_fd.write(data)
+
+	def close(self):
+		self.flush()
+		self.fd.close()
+		if self.gzip_fd is not None:
+			self.gzip_fd.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+		return False
@@ -0,0 +1,142 @@
+#!/bin/python
+
+import os
+import re
+import json
+
+# characters of a term selecting its shard
+shard_prefix = 2
+# annotation texts are cut in results
+snippet_length = 80
+# shortest indexed identifier or word
+min_term_length = 2
+
+word_re = re.compile(r"[A-Za-z0-9_]+")
+shard_re = re.compile(r"[^a-z0-9]")
+
+def getShard(term):
+	return shard_re.sub("_", term[:shard_prefix].lower())
+
+# Terms of one page collected while it is rendered, saved next to the page
+# and merged into the search index after all pages are written:
+#   - identifiers: name -> lines it occurs on
+#   - texts: [line, kind, text] of annotations (c)omment, (h)ighlight,
+#     (n)eedinfo, (f)old and (k)eyworddb labels
+class PageTerms(object):
+
+	def __init__(self, keywords):
+		# language keywords are not searched for
+		self.keywords = keywords
+		self.identifiers = {}
+		self.texts = []
+		self.labeled = set()
+
+	def addIdentifiers(self, src_keywords):
+		for name in src_keywords:
+			if len(name) < min_term_length or name in self.keywords:
+				continue
+			self.identifiers.setdefault(name, []).extend(src_keywords[name].keys())
+
+	def addText(self, line, kind, text):
+		# sources (and annotations) are not always utf-8
+		try:
+			text = text.decode("utf-8")
+		except UnicodeDecodeError:
+			text = text.decode("latin-1")
+		self.texts.append( [line, kind, text] )
+
+	def addCommands(self, vis_lines):
+		for line_number in sorted(vis_lines):
+			for command in vis_lines[line_number]:
+				if command['command'] in ('comment', 'highlight', 'needinfo', 'fold'):
+					self.addText(line_number, command['command'][0], command['value'])
+
+	def addLabels(self, db_index):
+		# a keyworddb label once per page, on the first line it is used on
+		for line_number in sorted(db_index):
+			for (column, keyword, value) in db_index[line_number]:
+				if keyword not in self.labeled:
+					self.labeled.add(keyword)
+					self.addText(line_number, 'k', "%s: %s" % (keyword, value))
+
+	def save(self, file):
+		for name in self.identifiers:
+			self.identifiers[name].sort()
+		tmp_file = "%s.tmp" % file
+		with open(tmp_file, "w") as fd:
+			json.dump({'identifiers': self.identifiers, 'texts': self.texts}, fd, separators = (',', ':'))
+		os.rename(tmp_file, file)
+
+def getTermsFile(page_file):
+	(directory, name) = os.path.split(page_file)
+	return "%s/.%s.search" % (directory, name)
+
+# Prefix index of all pages of a destination in DEST/search, one JSONP file
+# per first letters of terms, the browser loads only the one it needs:
+#   pages.js: searchPages([page, ...])
+#   <prefix>.js: searchShard(prefix, {"i": {identifier: [[page, line, ...], ...]},
+#                                    "a": {word: [[page, line, kind, text], ...]}})
+class SearchIndex(object):
+
+	def __init__(self, destination):
+		self.directory = os.path.realpath(destination)
+		self.index_dir = "%s/search" % self.directory
+
+	# pages relative to the destination (e.g. of a BuildManifest), only
+	# changed shard files are written, returns their number
+	def build(self, pages):
+		page_list = []
+		shards = {}
+		for page in sorted(pages):
+			try:
+				with open(getTermsFile("%s/%s" % (self.directory, page)), "r") as fd:
+					terms = json.load(fd)
+			except (IOError, ValueError):
+				continue
+
+			page_index = len(page_list)
+			page_list.append(page)
+			for name in terms['identifiers']:
+				shard = shards.setdefault(getShard(name), {'i': {}, 'a': {}})
+				shard['i'].setdefault(name, []).append([page_index] + terms['identifiers'][name])
+
+			for (line, kind, text) in terms['texts']:
+				snippet = text[:snippet_length]
+				for word in set(word_re.findall(text)):
+					if len(word) < min_term_length:
+						continue
+					shard = shards.setdefault(getShard(word), {'i': {}, 'a': {}})
+					shard['a'].setdefault(word, []).append([page_index, line, kind, snippet])
+
+		if not os.path.exists(self.index_dir):
+			os.makedirs(self.index_dir)
+
+		written = 0
+		if self.writeFile("pages.js", "searchPages(%s)\n" % self.jsonValue(page_list)):
+			written = written + 1
+		for shard in shards:
+			if self.writeFile("%s.js" % shard, "searchShard(%s, %s)\n" % (self.jsonValue(shard), self.jsonValue(shards[shard]))):
+				written = written + 1
+
+		# shards of terms no page has any more
+		for file in os.listdir(self.index_dir):
+			if file.endswith(".js") and file != "pages.js" and file[:-3] not in shards:
+				os.unlink("%s/%s" % (self.index_dir, file))
+
+		return written
+
+	def jsonValue(self, value):
+		return json.dumps(value, separators = (',', ':'), sort_keys = True)
+
+	def writeFile(self, name, content):
+		file = "%s/%s" % (self.index_dir, name)
+		if os.path.exists(file) and os.path.getsize(file) == len(content):
+			with open(file, "r") as fd:
+				if fd.read() == content:
+					return False
+
+		tmp_file = "%s.tmp" % file
+		with open(tmp_file, "w") as fd:
+			fd.write(content)
+		os.rename(tmp_file, file)
+		return True
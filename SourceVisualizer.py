@@ -0,0 +1,529 @@
+#!/bin/python
+
+import os
+import sys
+import time
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+from CodeParser import CodeParser
+from CodeTokenizer import CodeTokenizer, tokenizeChunks
+from VisualizationParser import VisualizationParser, parseCommand
+from HTMLVisualizer import HTMLVisualizer, copyLayout, readKeywords
+from KeywordDB import loadKeywordDB
+from LayoutSync import syncLayout, makeBundle, writeBundle
+from BuildManifest import hashFile
+from FragmentCache import FragmentCache
+from SymbolIndex import SymbolIndex
+from CallGraph import CallGraph
+from SearchIndex import SearchIndex
+from VisAnchors import VisAnchors
+from StageProfiler import no_stage
+
+# C sources picked up when walking a directory
+source_suffixes = (".c", ".h")
+# larger sources are lexed and rendered chunk by chunk, in bounded memory
+stream_threshold = 4 << 20
+chunk_size = 1 << 18
+
+def mkdir_p(path):
+	if not os.access(path, os.F_OK):
+		os.makedirs(path)
+
+class SourceVisualizer(object):
+
+	def __init__(self, script_home, debug = False, layout_mode = "copy", shared_layout = ""):
+		self.script_home = script_home
+		self.keywords_file = "%s/keywords" % script_home
+		self.layout_dir = "%s/layout" % script_home
+		self.debug_mode = debug
+		# layout is copied, hardlinked or symlinked into every destination,
+		# or into one shared folder all pages point to
+		self.layout_mode = layout_mode
+		self.shared_layout = shared_layout
+		self.shared_layout_synced = False
+		# parsed once, shared by all pages (and all workers)
+		self.keywords = readKeywords(self.keywords_file)
+		self.keyworddb = None
+		self.keyworddb_file = ""
+		# files every page depends on besides its source, .vis and .keyworddb
+		self.shared_inputs = [self.keywords_file] + self.getToolFiles()
+		# content md5 -> CodeTokenizer, only a long running daemon keeps token tables
+		self.token_cache = None
+		self.token_cache_size = 0
+		self.tool_digest = None
+		self.stream_threshold = stream_threshold
+		# folded folds are written into separate files, loaded on unfold
+		self.lazy_folds = False
+		# line data drawn by vis.js, only lines in the browser window
+		self.virtual = False
+		# short markup, label texts written once per page
+		self.compact = False
+		# .gz siblings of written files, for static servers
+		self.gzip_output = False
+		# layout loaded by pages as one content hashed script
+		self.bundle = False
+		# (file name, content) of the bundle
+		self.bundle_data = None
+		# StageProfiler timing (and profiling) stages of renders
+		self.profiler = None
+		# identifiers link to definitions from the destination's SymbolIndex
+		self.symbols = False
+		self.symbol_index = None
+		# call graph of the destination's files linked from every page
+		self.callgraph = False
+		self.call_graph = None
+		# pages get a search box over the destination's search index
+		self.search = False
+		self.search_index = None
+		# .vis line numbers follow the code when the source changes
+		self.reanchor = True
+		# processes lexing chunks of a large source (None for all cpus)
+		self.lex_processes = 1
+
+	def getToolFiles(self):
+		files = []
+		for file in sorted(os.listdir(self.script_home)):
+			if file.endswith(".py"):
+				files.append("%s/%s" % (self.script_home, file))
+
+		for (root, dirs, layout_files) in os.walk(self.layout_dir):
+			dirs.sort()
+			for file in sorted(layout_files):
+				files.append("%s/%s" % (root, file))
+
+		return files
+
+	def debug(self, msg):
+		if self.debug_mode:
+			print msg
+
+	def stage(self, name):
+		if self.profiler is None:
+			return no_stage
+		return self.profiler.stage(name)
+
+	def prepareDestination(self, destination):
+		# destination folder exists?
+		if not os.path.exists(destination):
+			mkdir_p(destination)
+
+		if self.shared_layout == "":
+			copyLayout(self.layout_dir, destination, self.layout_mode)
+		elif not self.shared_layout_synced:
+			mkdir_p(self.shared_layout)
+			syncLayout(self.layout_dir, self.shared_layout, self.layout_mode)
+			self.shared_layout_synced = True
+		else:
+			return
+
+		# next to the layout, a symlinked layout is not written into
+		if self.bundle:
+			(name, content) = self.getBundle()
+			writeBundle(self.getBundleDir(destination), name, content, self.gzip_output)
+
+	def getLayoutHref(self, destination):
+		if self.shared_layout == "":
+			return "layout"
+		return os.path.relpath(self.shared_layout, destination)
+
+	def getBundle(self):
+		if self.bundle_data is None:
+			self.bundle_data = makeBundle(self.layout_dir)
+		return self.bundle_data
+
+	def getBundleDir(self, destination):
+		if self.shared_layout == "":
+			return "%s/layout-bundle" % destination
+		return "%s-bundle" % os.path.normpath(self.shared_layout)
+
+	# href of the bundle (relative to the page) or None
+	def getBundleHref(self, destination):
+		if not self.bundle:
+			return None
+		return "%s/%s" % (os.path.relpath(self.getBundleDir(destination), destination), self.getBundle()[0])
+
+	def loadKeywordDB(self, destination):
+		self.keyworddb_file = "%s/keyworddb" % destination
+		# compiled keyworddb is memory mapped, all workers share it
+		with self.stage("keyworddb"):
+			self.keyworddb = loadKeywordDB(self.keyworddb_file)
+
+	def openSymbolIndex(self, destination):
+		if self.symbol_index is not None:
+			self.symbol_index.close()
+			self.symbol_index = None
+		if self.symbols:
+			self.symbol_index = SymbolIndex("%s/.symbols.db" % destination)
+
+	# definitions of (source file, destination) jobs into the index
+	def updateSymbols(self, jobs, processes = None):
+		if self.symbol_index is None:
+			return
+		with self.stage("symbols"):
+			count = self.symbol_index.update([(src_file, self.getPageFile(src_file, destination)) for (src_file, destination) in jobs], processes)
+		self.debug("Definitions of %d files indexed" % count)
+
+	def openCallGraph(self, destination):
+		self.call_graph = None
+		if self.callgraph:
+			self.call_graph = CallGraph(destination)
+
+	# functions and calls of changed (source file, destination) jobs
+	# into the call graph, which is written again
+	def updateCallGraph(self, jobs, processes = None):
+		if self.call_graph is None:
+			return
+		with self.stage("callgraph"):
+			count = self.call_graph.update([(src_file, self.getPageFile(src_file, destination)) for (src_file, destination) in jobs], processes)
+		self.debug("Calls of %d files analyzed" % count)
+
+	# callgraph.dot and .json without the suffix (relative to the page) or None
+	def getCallGraphHref(self, destination):
+		if self.call_graph is None:
+			return None
+		return os.path.relpath(self.call_graph.getBaseName(), os.path.realpath(destination))
+
+	def openSearchIndex(self, destination):
+		self.search_index = None
+		if self.search:
+			self.search_index = SearchIndex(destination)
+
+	# shards of terms of all pages in the manifest, pages save their terms
+	# while they are written
+	def buildSearchIndex(self, manifest):
+		if self.search_index is None:
+			return
+		with self.stage("search"):
+			count = self.search_index.build(manifest.pages.keys())
+		self.debug("%d search index files written" % count)
+
+	# destination of the search index (relative to the page) or None
+	def getSearchRoot(self, destination):
+		if self.search_index is None:
+			return None
+		return os.path.relpath(self.search_index.directory, os.path.realpath(destination))
+
+	def getSearchPage(self, src_file, destination):
+		if self.search_index is None:
+			return None
+		return os.path.relpath(os.path.realpath(self.getPageFile(src_file, destination)), self.search_index.directory)
+
+	def enableTokenCache(self, size):
+		self.token_cache = OrderedDict()
+		self.token_cache_size = size
+
+	def tokenize(self, src_file):
+		if self.token_cache is None:
+			return CodeTokenizer(src_file, processes = self.lex_processes)
+
+		with open(src_file, "r") as fd:
+			content = fd.read()
+
+		key = hashlib.md5(content).hexdigest()
+		if key in self.token_cache:
+			# the most recently used token table goes last
+			codeTokenizer = self.token_cache.pop(key)
+		else:
+			codeTokenizer = CodeTokenizer(src_file, content, processes = self.lex_processes)
+			if len(self.token_cache) >= self.token_cache_size:
+				self.token_cache.popitem(last = False)
+
+		self.token_cache[key] = codeTokenizer
+		return codeTokenizer
+
+	def streamChunks(self, src_file):
+		chunks = tokenizeChunks(src_file, chunk_size, self.lex_processes)
+		while True:
+			# lexing of the next chunk, not rendering of the last one
+			with self.stage("tokenize"):
+				chunk = next(chunks, None)
+			if chunk is None:
+				return
+
+			(first_index, lines, codeTokenizer) = chunk
+			yield (first_index, lines, codeTokenizer.getKeywords(), codeTokenizer.getComments(), codeTokenizer.getTokens())
+
+	def getToolDigest(self):
+		# cached line fragments are valid only for the same keywords and code
+		if self.tool_digest is None:
+			digest = hashlib.md5()
+			for file in self.shared_inputs:
+				digest.update(hashFile(file))
+			self.tool_digest = digest.hexdigest()
+		return self.tool_digest
+
+	def getFragmentsFile(self, src_file, destination):
+		return "%s/.%s.fragments" % (destination, os.path.basename(src_file))
+
+	def getVisFile(self, src_file, destination):
+		return "%s/%s.vis" % (destination, os.path.basename(src_file))
+
+	def getAnchorsFile(self, src_file, destination):
+		return "%s/.%s.anchors" % (destination, os.path.basename(src_file))
+
+	# moves .vis commands to the lines their code is on in the current source,
+	# commands whose code is gone are commented out and reported
+	def reanchorVis(self, src_file, destination):
+		if not self.reanchor:
+			return
+
+		vis_file = self.getVisFile(src_file, destination)
+		with self.stage("anchors"):
+			(moved, unplaced) = VisAnchors(self.getAnchorsFile(src_file, destination)).update(src_file, vis_file)
+		if moved:
+			self.debug("%d commands of %s moved with the source" % (len(moved), vis_file))
+		for line in unplaced:
+			sys.stderr.write("%s: '%s' could not be placed in the changed source\n" % (vis_file, line))
+
+	def annotate(self, src_file, destination, annotation):
+		# <linenumber>:<command>:<value> appended to the page's .vis file,
+		# a malformed one would be skipped by every later render
+		parseCommand(annotation)
+
+		# the new command is for the current source
+		self.reanchorVis(src_file, destination)
+
+		vis_file = self.getVisFile(src_file, destination)
+		separator = ""
+		if os.path.exists(vis_file) and os.path.getsize(vis_file) > 0:
+			with open(vis_file, "r") as fd:
+				fd.seek(-1, os.SEEK_END)
+				if fd.read(1) != "\n":
+					separator = "\n"
+
+		with open(vis_file, "a") as fd:
+			fd.write("%s%s\n" % (separator, annotation))
+
+	def getPageFile(self, src_file, destination):
+		return "%s/%s.html" % (destination, os.path.basename(src_file))
+
+	def getPageInputs(self, src_file, destination):
+		basename = os.path.basename(src_file)
+		inputs = [src_file, self.getVisFile(src_file, destination), "%s/%s.keyworddb" % (destination, basename)]
+		if self.keyworddb_file:
+			inputs.append(self.keyworddb_file)
+		return inputs + self.shared_inputs
+
+	def getPageSettings(self, src_file, destination):
+		# options changing the page without changing any of its inputs
+		settings = "layout=%s lazy-folds=%d virtual=%d compact=%d gzip=%d bundle=%s" % (self.getLayoutHref(destination), self.lazy_folds, self.virtual, self.compact, self.gzip_output, self.getBundleHref(destination))
+		# links of the page change with definitions of names it uses
+		if self.symbol_index is not None:
+			settings = "%s symbols=%s" % (settings, self.symbol_index.getPageDigest(src_file, self.getPageFile(src_file, destination)))
+		if self.call_graph is not None:
+			settings = "%s callgraph=%s" % (settings, self.getCallGraphHref(destination))
+		if self.search_index is not None:
+			settings = "%s search=%s" % (settings, self.getSearchRoot(destination))
+		return settings
+
+	def isUpToDate(self, manifest, src_file, destination):
+		return manifest.isUpToDate(self.getPageFile(src_file, destination), self.getPageInputs(src_file, destination), self.getPageSettings(src_file, destination))
+
+	def recordPage(self, manifest, src_file, destination):
+		# called after rendering so just created .vis and .keyworddb are recorded
+		manifest.update(self.getPageFile(src_file, destination), os.path.realpath(src_file), self.getPageInputs(src_file, destination), self.getPageSettings(src_file, destination))
+
+	def visualize(self, src_file, destination):
+		basename = os.path.basename(src_file)
+		vis_file = destination + "/" + basename + ".vis"
+
+		# read visualization file
+		self.debug("Opening visualization file: %s " % vis_file)
+		# does the vis file exist?
+		if not os.path.exists(vis_file):
+			self.debug("file not found, creating empty file")
+			open(vis_file, 'a').close()
+
+		html_file = destination + "/" + basename + ".html"
+		self.debug("Opening html file for write: %s " % html_file)
+		# does the html file exist?
+		if not os.path.exists(html_file):
+			self.debug("file not found, creating empty file")
+			open(html_file, 'a').close()
+
+		self.reanchorVis(src_file, destination)
+
+		self.debug("Parsing visualization file...")
+		with self.stage("parse"):
+			visParser = VisualizationParser(vis_file)
+			vis_lines = visParser.getCommands()
+		self.debug("Visualization file parsed")
+
+		if os.path.getsize(src_file) > self.stream_threshold:
+			return self.visualizeStream(src_file, destination, vis_lines)
+
+		self.debug("Parsing source code file...")
+		with self.stage("parse"):
+			codeParser = CodeParser(src_file)
+			code_lines = codeParser.getLines()
+		self.debug("Source file parsed")
+
+		# unchanged source, only lines whose commands changed are rendered
+		with self.stage("cache"):
+			fragmentCache = FragmentCache(self.getFragmentsFile(src_file, destination))
+			# compact pages have different fragments
+			cache_key = (hashFile(src_file), self.getToolDigest(), self.compact)
+		if fragmentCache.isValid(cache_key):
+			self.debug("Source file not changed, using cached keywords and fragments")
+			src_keywords = fragmentCache.keywords
+			src_comments = fragmentCache.comments
+			src_tokens = fragmentCache.tokens
+			fragments = fragmentCache.fragments
+		else:
+			self.debug("Extracting keywords from source code file")
+			with self.stage("tokenize"):
+				codeTokenizer = self.tokenize(src_file)
+			src_keywords = codeTokenizer.getKeywords()
+			src_comments = codeTokenizer.getComments()
+			src_tokens = codeTokenizer.getTokens()
+			fragments = None
+
+		self.debug("Initializing html output...")
+		htmlVis = HTMLVisualizer(code_lines, src_keywords, src_comments, vis_lines, self.keywords_file, self.script_home, src_tokens, self.keywords, self.keyworddb, self.getLayoutHref(destination), fragments, lazy_folds = self.lazy_folds, virtual = self.virtual, compact = self.compact, bundle_href = self.getBundleHref(destination), gzip_output = self.gzip_output, symbol_index = self.symbol_index, src_file = src_file, callgraph_href = self.getCallGraphHref(destination), search_root = self.getSearchRoot(destination), search_page = self.getSearchPage(src_file, destination))
+		self.debug("Html output generated")
+		with self.stage("render"):
+			htmlVis.printPage(basename, destination)
+		self.debug("Saved to: file://%s" % html_file)
+
+		if htmlVis.fragments != fragments:
+			with self.stage("cache"):
+				fragmentCache.update(cache_key, src_keywords, src_comments, src_tokens, htmlVis.fragments)
+				fragmentCache.save()
+
+		return len(code_lines)
+
+	# huge sources, nothing but the current chunk (and no fragment cache)
+	def visualizeStream(self, src_file, destination, vis_lines):
+		self.debug("Streaming source code file in chunks of %d bytes" % chunk_size)
+		basename = os.path.basename(src_file)
+		fragments_file = self.getFragmentsFile(src_file, destination)
+		if os.path.exists(fragments_file):
+			os.unlink(fragments_file)
+
+		# lines, keywords, comments and tokens come with every chunk
+		htmlVis = HTMLVisualizer([], {}, [], vis_lines, self.keywords_file, self.script_home, {}, self.keywords, self.keyworddb, self.getLayoutHref(destination), chunks = self.streamChunks(src_file), lazy_folds = self.lazy_folds, virtual = self.virtual, compact = self.compact, bundle_href = self.getBundleHref(destination), gzip_output = self.gzip_output, symbol_index = self.symbol_index, src_file = src_file, callgraph_href = self.getCallGraphHref(destination), search_root = self.getSearchRoot(destination), search_page = self.getSearchPage(src_file, destination))
+		# chunks are lexed (the tokenize stage) while the page is rendered
+		with self.stage("render"):
+			htmlVis.printPage(basename, destination)
+		self.debug("Saved to: file://%s" % self.getPageFile(src_file, destination))
+
+		return htmlVis.line_count
+
+def findSources(directory, exclude = ""):
+	sources = []
+	for (root, dirs, files) in os.walk(directory):
+		# do not descend into the destination folder
+		dirs[:] = sorted([d for d in dirs if os.path.realpath("%s/%s" % (root, d)) != exclude])
+		for file in sorted(files):
+			if file.endswith(source_suffixes):
+				sources.append("%s/%s" % (root, file))
+
+	return sources
+
+# page -> sources of pages more jobs would be rendered into (with their .vis,
+# .anchors and .fragments files), pages are named after the source basename
+def findCollisions(visualizer, jobs):
+	sources = {}
+	for (src_file, destination) in jobs:
+		page = os.path.realpath(visualizer.getPageFile(src_file, destination))
+		sources.setdefault(page, set()).add(os.path.realpath(src_file))
+
+	collisions = {}
+	for page in sources:
+		if len(sources[page]) > 1:
+			collisions[page] = sorted(sources[page])
+	return collisions
+
+# jobs without repeated ones, a file given twice is rendered once
+def uniqueJobs(visualizer, jobs):
+	unique_jobs = []
+	pages = set()
+	for (src_file, destination) in jobs:
+		page = os.path.realpath(visualizer.getPageFile(src_file, destination))
+		if page not in pages:
+			pages.add(page)
+			unique_jobs.append( (src_file, destination) )
+	return unique_jobs
+
+# every worker gets its copy of the visualizer (with keywords and keyworddb
+# already parsed) only once, not with every file
+worker_visualizer = None
+
+def initWorker(visualizer):
+	global worker_visualizer
+	worker_visualizer = visualizer
+
+def visualizeJob(job):
+	(src_file, destination) = job
+	start = time.time()
+	try:
+		lines = worker_visualizer.visualize(src_file, destination)
+	except Exception as e:
+		return (src_file, 0, time.time() - start, str(e))
+
+	return (src_file, lines, time.time() - start, "")
+
+# render all (source file, destination) jobs, in parallel unless processes == 1,
+# with a manifest only pages with changed inputs are rendered (unless force is set),
+# returns list of (source file, lines, seconds, error) of rendered pages, raises
+# ValueError if more sources would be rendered into the same page
+def visualizeFiles(visualizer, jobs, processes = None, manifest = None, force = False):
+	collisions = findCollisions(visualizer, jobs)
+	if collisions:
+		page = sorted(collisions)[0]
+		raise ValueError("%s would be rendered from more files: %s" % (page, ", ".join(collisions[page])))
+
+	jobs = uniqueJobs(visualizer, jobs)
+	# pages link to definitions of all files, even of up to date pages
+	visualizer.updateSymbols(jobs, processes)
+	visualizer.updateCallGraph(jobs, processes)
+
+	if manifest is not None and not force:
+		jobs = [job for job in jobs if not visualizer.isUpToDate(manifest, job[0], job[1])]
+
+	destinations = []
+	for (src_file, destination) in jobs:
+		if destination not in destinations:
+			destinations.append(destination)
+
+	# layout is copied once per destination, not once per file
+	for destination in destinations:
+		visualizer.prepareDestination(destination)
+
+	if processes == 1 or len(jobs) < 2:
+		initWorker(visualizer)
+		results = map(visualizeJob, jobs)
+	else:
+		pool = multiprocessing.Pool(processes, initWorker, (visualizer,))
+		try:
+			results = pool.map(visualizeJob, jobs, 1)
+		finally:
+			pool.close()
+			pool.join()
+
+	if manifest is not None:
+		for index in range(0, len(jobs)):
+			if not results[index][3]:
+				visualizer.recordPage(manifest, jobs[index][0], jobs[index][1])
+		manifest.save()
+		visualizer.buildSearchIndex(manifest)
+
+	return results
+
+def printSummary(results, elapsed, skipped = 0, out = sys.stdout):
+	total_lines = 0
+	failed = 0
+	for (src_file, lines, seconds, error) in sorted(results, key = lambda result: result[2], reverse = True):
+		if error:
+			failed = failed + 1
+			out.write("%8.3fs %7s lines  %s: %s\n" % (seconds, "-", src_file, error))
+		else:
+			out.write("%8.3fs %7d lines  %s\n" % (seconds, lines, src_file))
+		total_lines = total_lines + lines
+
+	if skipped:
+		out.write("%d files up to date\n" % skipped)
+
+	elapsed = max(elapsed, 1e-6)
+	out.write("%d files (%d failed), %d lines in %.3fs: %.1f files/s, %.0f lines/s\n" % (len(results), failed, total_lines, elapsed, len(results) / elapsed, total_lines / elapsed))
@@ -0,0 +1,97 @@
+#!/bin/python
+
+# Overlapping spans resolved into well nested markup by a sweep over their
+# sorted boundaries, O((n + k) log n) for n spans and k splits.
+
+# order of spans covering the same text, lower rank is the outer one
+highlight_rank = 0
+needinfo_rank = 1
+comment_rank = 2
+# links to definitions are innermost, inside a highlight of the name
+symbol_rank = 3
+
+def spanOrder(span):
+	# outer spans first: earlier start, later end, lower rank
+	return (span[0], -span[1], span[2])
+
+# Spans of a line are (start, end, rank, open html, close html, plain),
+# text of plain spans is written without any markup. Returns a list of
+# html strings and (start, end, plain) text ranges of [0, length).
+# A span ending inside a later one closes it, the later one is opened
+# again right after, so tags never cross.
+def nestSpans(spans, length):
+	clipped = set()
+	for (start, end, rank, open_html, close_html, plain) in spans:
+		end = min(end, length)
+		if start < end:
+			clipped.add( (start, end, rank, open_html, close_html, plain) )
+	spans = sorted(clipped, key = spanOrder)
+
+	boundaries = set([0, length])
+	for span in spans:
+		boundaries.add(span[0])
+		boundaries.add(span[1])
+	boundaries = sorted(boundaries)
+
+	pieces = []
+	stack = []
+	next_span = 0
+	for index in range(0, len(boundaries)):
+		point = boundaries[index]
+
+		# lowest open span ending here, everything above it is closed
+		lowest = None
+		for position in range(0, len(stack)):
+			if stack[position][1] == point:
+				lowest = position
+				break
+
+		if lowest is not None:
+			for span in reversed(stack[lowest:]):
+				pieces.append(span[4])
+			reopened = [span for span in stack[lowest:] if span[1] > point]
+			del stack[lowest:]
+			for span in reopened:
+				pieces.append(span[3])
+				stack.append(span)
+
+		while next_span < len(spans) and spans[next_span][0] == point:
+			stack.append(spans[next_span])
+			pieces.append(spans[next_span][3])
+			next_span = next_span + 1
+
+		if index + 1 < len(boundaries):
+			plain = False
+			for span in stack:
+				plain = plain or span[5]
+			pieces.append( (point, boundaries[index + 1], plain) )
+
+	return pieces
+
+# Folds (dicts with id, start and end line) nested as divs can be: a fold
+# crossing the end of its enclosing fold is cut at that end, a fold ending
+# before its start is a one line fold. Returns folds in the order they are
+# opened and line -> folds starting there (outermost first) and line ->
+# folds ending there (innermost first).
+def resolveFolds(folds):
+	ordered = []
+	stack = []
+	for fold in sorted(folds, key = lambda fold: (fold['start'], -max(fold['end'], fold['start']), fold['id'])):
+		fold['end'] = max(fold['end'], fold['start'])
+		while stack and stack[-1]['end'] < fold['start']:
+			del(stack[-1])
+		if stack and fold['end'] > stack[-1]['end']:
+			fold['end'] = stack[-1]['end']
+		stack.append(fold)
+		ordered.append(fold)
+
+	starts = {}
+	for fold in ordered:
+		starts.setdefault(fold['start'], []).append(fold)
+
+	# among folds ending on the same line, the later opened one is inside
+	ends = {}
+	for fold in reversed(ordered):
+		ends.setdefault(fold['end'], []).append(fold)
+
+	return (ordered, starts, ends)
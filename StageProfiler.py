@@ -0,0 +1,108 @@
+#!/bin/python
+
+import os
+import sys
+import time
+import cProfile
+import resource
+from collections import OrderedDict
+
+# Time spent in named stages of renders (tokenize, render, ...). A stage
+# entered inside another one is not counted in the outer one, a stage
+# entered more times accumulates. With profile every stage gets its own
+# cProfile stats, dumped into <stage>.prof files.
+class StageProfiler(object):
+
+	def __init__(self, profile = False):
+		self.profile = profile
+		# stage -> [calls, seconds, peak rss in MB]
+		self.stages = OrderedDict()
+		self.profiles = {}
+		# [stage, start] of entered stages, the innermost one is running
+		self.stack = []
+
+	def stage(self, name):
+		return Stage(self, name)
+
+	def enter(self, name):
+		now = time.time()
+		if self.stack:
+			self.pause(self.stack[-1], now)
+
+		if name not in self.stages:
+			self.stages[name] = [0, 0.0, 0.0]
+			if self.profile:
+				self.profiles[name] = cProfile.Profile()
+		self.stages[name][0] = self.stages[name][0] + 1
+
+		self.stack.append([name, now])
+		if self.profile:
+			self.profiles[name].enable()
+
+	def leave(self):
+		now = time.time()
+		self.pause(self.stack[-1], now)
+		name = self.stack.pop()[0]
+		# ru_maxrss is in kilobytes on linux
+		self.stages[name][2] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+		if self.stack:
+			self.stack[-1][1] = time.time()
+			if self.profile:
+				self.profiles[self.stack[-1][0]].enable()
+
+	def pause(self, entry, now):
+		if self.profile:
+			self.profiles[entry[0]].disable()
+		self.stages[entry[0]][1] = self.stages[entry[0]][1] + now - entry[1]
+
+	# stage -> {calls, seconds, peak_rss_mb}, for json
+	def getResults(self):
+		results = OrderedDict()
+		for (name, (calls, seconds, rss)) in self.stages.items():
+			results[name] = {'calls': calls, 'seconds': seconds, 'peak_rss_mb': rss}
+		return results
+
+	def printReport(self, out = sys.stdout):
+		total = 0.0
+		out.write("%-12s %6s %10s %12s\n" % ("stage", "calls", "seconds", "peak rss MB"))
+		for (name, (calls, seconds, rss)) in self.stages.items():
+			out.write("%-12s %6d %10.3f %12.1f\n" % (name, calls, seconds, rss))
+			total = total + seconds
+		out.write("%-12s %6s %10.3f\n" % ("total", "", total))
+
+	# returns list of written files
+	def dumpStats(self, directory):
+		files = []
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		for name in self.profiles:
+			file = "%s/%s.prof" % (directory, name)
+			self.profiles[name].dump_stats(file)
+			files.append(file)
+		return files
+
+class Stage(object):
+
+	def __init__(self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+
+	def __enter__(self):
+		self.profiler.enter(self.name)
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.profiler.leave()
+		return False
+
+# stage of a render without a profiler
+class NoStage(object):
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		return False
+
+no_stage = NoStage()
@@ -0,0 +1,276 @@
+#!/bin/python
+
+import os
+import urllib
+import sqlite3
+import hashlib
+import threading
+import multiprocessing
+from collections import deque
+from CodeTokenizer import tokenizeChunks
+from BuildManifest import hashFile
+
+index_version = 2
+# bound parameters of one lookup query (sqlite allows 999)
+lookup_batch = 500
+# definition linked when a name is defined more times (in other files)
+kind_order = {'function': 0, 'struct': 1, 'union': 1, 'enum': 1, 'macro': 2}
+# tokens between the ones definitions are found by
+skipped_types = frozenset(['WHITESPACE', 'COMMENT', 'MCOMMENT'])
+# files are scanned in chunks of about this size, in bounded memory
+scan_chunk_size = 1 << 18
+record_types = frozenset(['struct', 'union', 'enum'])
+
+# (type, text, line) of tokens of a CodeTokenizer token table of lines
+# starting at first_index, without whitespaces and comments
+def significantTokens(lines, tokens, first_index = 0):
+	significant = []
+	for line_number in sorted(tokens):
+		line = lines[line_number - first_index - 1]
+		for (type, column, length) in tokens[line_number]:
+			if type not in skipped_types:
+				significant.append( (type, line[column - 1:column - 1 + length], line_number) )
+	return significant
+
+# significant tokens of a file lexed chunk by chunk, tokens of only one
+# chunk are in memory at a time
+def streamTokens(src_file):
+	for (first_index, lines, codeTokenizer) in tokenizeChunks(src_file, scan_chunk_size):
+		for token in significantTokens(lines, codeTokenizer.getTokens(), first_index):
+			yield token
+
+# (previous, token, next, the one after next) of every token of a stream,
+# None where there is none
+def lookahead(significant):
+	window = deque([None] * 4, 4)
+	for token in significant:
+		window.append(token)
+		if window[1] is not None:
+			yield tuple(window)
+	for index in range(0, 2):
+		window.append(None)
+		if window[1] is not None:
+			yield tuple(window)
+
+# [name, line, level] of names followed by a parenthesis that may be functions,
+# level of parentheses is None after the matching one. Every next token moves
+# them, returns those whose body the token opens, the rest of them is removed
+# when anything else follows the parenthesis or a brace or a semicolon is in it.
+def advanceCandidates(candidates, type):
+	bodies = []
+	remaining = []
+	for candidate in candidates:
+		if candidate[2] is None:
+			if type == 'LBRACE':
+				bodies.append(candidate)
+			continue
+		if type == 'LPARENTHESIS':
+			candidate[2] = candidate[2] + 1
+		elif type == 'RPARENTHESIS':
+			candidate[2] = candidate[2] - 1
+			if candidate[2] == 0:
+				candidate[2] = None
+		elif type in ('LBRACE', 'RBRACE', 'SEMICOLON'):
+			continue
+		remaining.append(candidate)
+	candidates[:] = remaining
+	return bodies
+
+# a name followed by a parenthesis may be a function, function like
+# macros are not
+def isCandidate(previous, token, next):
+	return token[0] == 'IDENTIFIER' and next is not None and next[0] == 'LPARENTHESIS' and (previous is None or previous[1] != '#define')
+
+# (name, kind, line) of function, struct (union, enum) and macro
+# definitions in a stream of significant tokens:
+#   - #define NAME
+#   - struct NAME {
+#   - NAME (...) { outside of any braces
+# identifiers of the stream are added to names (if given)
+def findDefinitions(significant, names = None):
+	definitions = []
+	candidates = []
+	depth = 0
+	for (previous, token, next, after) in lookahead(significant):
+		(type, text, line_number) = token
+		for (name, line, level) in advanceCandidates(candidates, type):
+			definitions.append( (name, 'function', line) )
+		if names is not None and type == 'IDENTIFIER':
+			names.add(text)
+
+		if type == 'LBRACE':
+			depth = depth + 1
+		elif type == 'RBRACE':
+			depth = max(depth - 1, 0)
+		elif type == 'MACRO' and text == '#define':
+			if next is not None and next[0] == 'IDENTIFIER':
+				definitions.append( (next[1], 'macro', next[2]) )
+		elif type != 'IDENTIFIER' or next is None:
+			continue
+		elif text in record_types:
+			if after is not None and next[0] == 'IDENTIFIER' and after[0] == 'LBRACE':
+				definitions.append( (next[1], text, next[2]) )
+		elif depth == 0 and isCandidate(previous, token, next):
+			candidates.append( [text, line_number, 0] )
+
+	return definitions
+
+# worker of SymbolIndex.update, definitions and names used in a file,
+# a file not lexed has none of them
+def findFileDefinitions(src_file):
+	names = set()
+	try:
+		definitions = findDefinitions(streamTokens(src_file), names)
+	except (IOError, TypeError):
+		return (src_file, [], [])
+	return (src_file, definitions, sorted(names))
+
+# Definitions of all files rendered into a destination, in a sqlite file
+# there. Files are lexed again only when they change, names are looked up
+# once per page (or chunk) and every occurrence is a dict lookup then.
+class SymbolIndex(object):
+
+	def __init__(self, file):
+		self.file = file
+		self.directory = os.path.dirname(os.path.realpath(file))
+		# connection (and pid it was opened by) of every thread, sqlite
+		# connections can be used only by the thread which opened them
+		self.local = threading.local()
+
+	def getConnection(self):
+		# workers forked with the index open their own connection
+		if getattr(self.local, 'connection', None) is None or self.local.pid != os.getpid():
+			self.local.connection = sqlite3.connect(self.file)
+			self.local.connection.text_factory = str
+			self.local.pid = os.getpid()
+			self.createTables()
+		return self.local.connection
+
+	def createTables(self):
+		connection = self.local.connection
+		if connection.execute("PRAGMA user_version").fetchone()[0] != index_version:
+			connection.executescript("""
+				DROP TABLE IF EXISTS files;
+				DROP TABLE IF EXISTS symbols;
+				DROP TABLE IF EXISTS names;
+				DROP TABLE IF EXISTS meta;
+			""")
+		connection.executescript("""
+			CREATE TABLE IF NOT EXISTS files (source TEXT PRIMARY KEY, size INTEGER, mtime REAL, digest TEXT, page TEXT);
+			CREATE TABLE IF NOT EXISTS symbols (name TEXT, kind TEXT, source TEXT, line INTEGER);
+			CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name);
+			CREATE INDEX IF NOT EXISTS symbols_source ON symbols (source);
+			CREATE TABLE IF NOT EXISTS names (name TEXT, source TEXT);
+			CREATE INDEX IF NOT EXISTS names_source ON names (source);
+			PRAGMA user_version = %d;
+		""" % index_version)
+
+	# closes the connection of the calling thread
+	def close(self):
+		if getattr(self.local, 'connection', None) is not None and self.local.pid == os.getpid():
+			self.local.connection.close()
+		self.local.connection = None
+
+	def fingerprint(self, src_file, stored):
+		# content is hashed again only when stat changes
+		st = os.stat(src_file)
+		if stored is not None and stored[0] == st.st_size and stored[1] == st.st_mtime:
+			return (st.st_size, st.st_mtime, stored[2])
+
+		return (st.st_size, st.st_mtime, hashFile(src_file))
+
+	# index definitions of (source file, page file) jobs, changed files are
+	# lexed in parallel unless processes == 1, returns number of lexed files
+	def update(self, jobs, processes = None):
+		connection = self.getConnection()
+		stored = {}
+		for (source, size, mtime, digest, page) in connection.execute("SELECT source, size, mtime, digest, page FROM files"):
+			stored[source] = (size, mtime, digest, page)
+
+		changed = {}
+		for (src_file, page_file) in jobs:
+			src_file = os.path.realpath(src_file)
+			page = os.path.relpath(os.path.realpath(page_file), self.directory)
+			try:
+				(size, mtime, digest) = self.fingerprint(src_file, stored.get(src_file))
+			except (IOError, OSError):
+				continue
+			if src_file not in stored or stored[src_file][2:] != (digest, page):
+				changed[src_file] = (size, mtime, digest, page)
+			elif stored[src_file][:2] != (size, mtime):
+				# touched only
+				connection.execute("UPDATE files SET size = ?, mtime = ? WHERE source = ?", (size, mtime, src_file))
+
+		removed = [source for source in stored if not os.path.exists(source)]
+		if not changed and not removed:
+			connection.commit()
+			return 0
+
+		sources = sorted(changed)
+		if processes == 1 or len(sources) < 2:
+			results = map(findFileDefinitions, sources)
+		else:
+			pool = multiprocessing.Pool(processes)
+			try:
+				results = pool.map(findFileDefinitions, sources, 8)
+			finally:
+				pool.close()
+				pool.join()
+
+		# one transaction, readers never see a half updated index
+		with connection:
+			for source in removed + sources:
+				connection.execute("DELETE FROM symbols WHERE source = ?", (source,))
+				connection.execute("DELETE FROM names WHERE source = ?", (source,))
+				connection.execute("DELETE FROM files WHERE source = ?", (source,))
+			for (source, definitions, names) in results:
+				connection.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?)", (source,) + changed[source])
+				connection.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?)", [(name, kind, source, line) for (name, kind, line) in definitions])
+				connection.executemany("INSERT INTO names VALUES (?, ?)", [(name, source) for name in names])
+
+		return len(sources)
+
+	# changes whenever a link of the page of src_file changes (as lookup of
+	# all names used in src_file returns them), not with other definitions
+	def getPageDigest(self, src_file, page_file):
+		src_file = os.path.realpath(src_file)
+		query = "SELECT symbols.name, kind, symbols.source, line, page FROM names JOIN symbols ON symbols.name = names.name JOIN files ON files.source = symbols.source WHERE names.source = ?"
+		links = self.makeLinks(self.getConnection().execute(query, (src_file,)), src_file, page_file)
+
+		digest = hashlib.md5()
+		for name in sorted(links):
+			digest.update("%s\0%s\n" % (name, links[name]))
+		return digest.hexdigest()
+
+	# name -> href of its definition for names used in a page, definitions
+	# in the page itself are preferred and linked as #line
+	def lookup(self, names, src_file, page_file):
+		src_file = os.path.realpath(src_file)
+		connection = self.getConnection()
+
+		names = list(names)
+		rows = []
+		for start in range(0, len(names), lookup_batch):
+			batch = names[start:start + lookup_batch]
+			query = "SELECT name, kind, source, line, page FROM symbols JOIN files USING (source) WHERE name IN (%s)" % ",".join("?" * len(batch))
+			rows.extend(connection.execute(query, batch))
+		return self.makeLinks(rows, src_file, page_file)
+
+	# links of (name, kind, source, line, page) rows of definitions
+	def makeLinks(self, rows, src_file, page_file):
+		page_dir = os.path.dirname(os.path.realpath(page_file))
+		best = {}
+		for (name, kind, source, line, page) in rows:
+			order = (source != src_file, kind_order.get(kind, 3), page, line)
+			if name not in best or order < best[name][0]:
+				best[name] = (order, source, line, page)
+
+		links = {}
+		for name in best:
+			(order, source, line, page) = best[name]
+			if source == src_file:
+				links[name] = "#%d" % line
+			else:
+				href = os.path.relpath("%s/%s" % (self.directory, page), page_dir)
+				links[name] = "%s#%d" % (urllib.quote(href), line)
+		return links
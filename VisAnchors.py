@@ -0,0 +1,236 @@
+#!/bin/python
+
+import os
+import json
+import zlib
+import difflib
+import hashlib
+
+anchors_version = 1
+# .vis commands which could not be placed after a source change
+unplaced_prefix = "#unplaced:"
+
+# md5 of a file and a hash of the tokens of every line, whitespaces
+# between (and around) tokens do not change it
+def lineHashes(file):
+	hashes = []
+	digest = hashlib.md5()
+	with open(file, "r") as fd:
+		for line in fd:
+			digest.update(line)
+			hashes.append(zlib.crc32("".join(line.split())) & 0xffffffff)
+	return (digest.hexdigest(), hashes)
+
+# new line index of old line indexes in wanted (or None if not placed):
+#   - lines of unchanged runs found by the diff
+#   - a changed line found exactly once in the changed run it is in
+#   - a line occuring exactly once in both files (moved code)
+#   - a line with its neighbours occuring exactly once in the new file
+def mapLines(old, new, wanted):
+	matcher = difflib.SequenceMatcher(None, old, new)
+	mapping = {}
+	# (old index, new run start, new run end) of changed lines
+	changed = []
+	wanted = sorted(wanted)
+	next_wanted = 0
+	# runs cover the old lines in order
+	for (tag, i1, i2, j1, j2) in matcher.get_opcodes():
+		while next_wanted < len(wanted) and wanted[next_wanted] < i2:
+			index = wanted[next_wanted]
+			next_wanted = next_wanted + 1
+			if tag == 'equal':
+				mapping[index] = j1 + index - i1
+			else:
+				changed.append( (index, j1, j2) )
+
+	if not changed:
+		return mapping
+
+	new_positions = {}
+	for (position, line_hash) in enumerate(new):
+		new_positions.setdefault(line_hash, []).append(position)
+	old_counts = {}
+	for line_hash in old:
+		old_counts[line_hash] = old_counts.get(line_hash, 0) + 1
+	contexts = None
+
+	for (index, j1, j2) in changed:
+		positions = new_positions.get(old[index], [])
+		in_run = [position for position in positions if j1 <= position < j2]
+		if len(in_run) == 1:
+			mapping[index] = in_run[0]
+			continue
+		if len(positions) == 1 and old_counts[old[index]] == 1:
+			mapping[index] = positions[0]
+			continue
+
+		if contexts is None:
+			contexts = {}
+			for position in range(0, len(new)):
+				contexts.setdefault(contextKey(new, position), []).append(position)
+		positions = contexts.get(contextKey(old, index), [])
+		if len(positions) == 1:
+			mapping[index] = positions[0]
+		else:
+			mapping[index] = None
+
+	return mapping
+
+def contextKey(hashes, index):
+	before = None
+	after = None
+	if index > 0:
+		before = hashes[index - 1]
+	if index + 1 < len(hashes):
+		after = hashes[index + 1]
+	return (before, hashes[index], after)
+
+# Line hashes of the source a .vis file was last rendered with. When the
+# source changes, line numbers of the .vis file are moved to the lines
+# their code moved to, commands whose lines are gone are commented out.
+class VisAnchors(object):
+
+	def __init__(self, file):
+		self.file = file
+		self.size = None
+		self.mtime = None
+		self.digest = None
+		self.hashes = []
+		self.parse()
+
+	def parse(self):
+		if not os.path.exists(self.file):
+			return
+
+		try:
+			with open(self.file, "r") as fd:
+				anchors = json.load(fd)
+		except ValueError:
+			return
+
+		if anchors.get('version') != anchors_version:
+			return
+
+		self.size = anchors['size']
+		self.mtime = anchors['mtime']
+		self.digest = anchors['digest']
+		self.hashes = anchors['hashes']
+
+	def save(self, size, mtime, digest, hashes):
+		(self.size, self.mtime, self.digest, self.hashes) = (size, mtime, digest, hashes)
+		tmp_file = "%s.tmp" % self.file
+		with open(tmp_file, "w") as fd:
+			json.dump({'version': anchors_version, 'size': size, 'mtime': mtime, 'digest': digest, 'hashes': hashes}, fd, separators = (',', ':'))
+		os.rename(tmp_file, self.file)
+
+	# moves commands of vis_file to the current src_file, returns
+	# (moved, unplaced) lists of the .vis lines, the first run only
+	# remembers the source
+	def update(self, src_file, vis_file):
+		st = os.stat(src_file)
+		if self.size == st.st_size and self.mtime == st.st_mtime:
+			return ([], [])
+
+		(digest, hashes) = lineHashes(src_file)
+		moved = []
+		unplaced = []
+		if self.digest is not None and digest != self.digest and os.path.exists(vis_file):
+			(moved, unplaced) = self.rewrite(vis_file, hashes)
+
+		self.save(st.st_size, st.st_mtime, digest, hashes)
+		return (moved, unplaced)
+
+	def rewrite(self, vis_file, hashes):
+		with open(vis_file, "r") as fd:
+			vis_lines = fd.read().split("\n")
+
+		# old line index of every command line, fold end and link target
+		wanted = set()
+		for line in vis_lines:
+			for number in self.lineNumbers(line):
+				if 0 < number <= len(self.hashes):
+					wanted.add(number - 1)
+
+		mapping = mapLines(self.hashes, hashes, wanted)
+
+		moved = []
+		unplaced = []
+		for index in range(0, len(vis_lines)):
+			line = vis_lines[index]
+			numbers = self.lineNumbers(line)
+			if not numbers:
+				continue
+
+			new_numbers = []
+			for number in numbers:
+				if 0 < number <= len(self.hashes):
+					position = mapping.get(number - 1)
+					new_numbers.append(position is not None and position + 1 or None)
+				elif number > len(self.hashes):
+					# past the end of the old source, moves with it
+					new_numbers.append(number - len(self.hashes) + len(hashes))
+				else:
+					new_numbers.append(number)
+
+			if None in new_numbers:
+				unplaced.append(line)
+				vis_lines[index] = "%s%s" % (unplaced_prefix, line)
+			elif new_numbers != numbers:
+				vis_lines[index] = self.setLineNumbers(line, new_numbers)
+				moved.append(vis_lines[index])
+
+		if moved or unplaced:
+			tmp_file = "%s.tmp" % vis_file
+			with open(tmp_file, "w") as fd:
+				fd.write("\n".join(vis_lines))
+			os.rename(tmp_file, vis_file)
+
+		return (moved, unplaced)
+
+	# line numbers of a .vis line: its line (and the end line of a fold or
+	# the line a needinfo[link=N] points to)
+	def lineNumbers(self, line):
+		if len(line) == 0 or line[0] == "#":
+			return []
+		items = line.split(":")
+		if len(items) < 3 or not items[0].isdigit():
+			return []
+		if items[1] == 'fold':
+			if not items[2].isdigit():
+				return []
+			return [int(items[0]), int(items[2])]
+		if items[1].startswith('needinfo'):
+			link = self.needinfoLink(items[1])
+			if link is not None:
+				(name, attrs, index) = link
+				return [int(items[0]), int(attrs[index].split("=")[1])]
+		return [int(items[0])]
+
+	# (name, attributes, index of the link attribute) of a needinfo command
+	# with a link to a line (the last one counts, as in VisualizationParser),
+	# None if there is none
+	def needinfoLink(self, command):
+		parts = command.split('[')
+		if len(parts) < 2:
+			return None
+		attrs = parts[1][0:-1].split(",")
+		link = None
+		for index in range(0, len(attrs)):
+			pair = attrs[index].split("=")
+			if len(pair) == 2 and pair[0] == 'link':
+				link = index
+		if link is None or not attrs[link].split("=")[1].isdigit():
+			return None
+		return (parts[0], attrs, link)
+
+	# .vis line with its line numbers (as returned by lineNumbers) replaced
+	def setLineNumbers(self, line, numbers):
+		items = line.split(":")
+		items[0] = str(numbers[0])
+		if items[1] == 'fold':
+			items[2] = str(numbers[1])
+		elif len(numbers) > 1:
+			(name, attrs, index) = self.needinfoLink(items[1])
+			attrs[index] = "link=%d" % numbers[1]
+			items[1] = "%s[%s]" % (name, ",".join(attrs))
+		return ":".join(items)
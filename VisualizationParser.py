@@ -1,5 +1,48 @@
 #!/bin/python
 
+import sys
+
+# <linenumber>:<command>:<value> of a .vis file as a line number and command,
+# ValueError if the line has not the format of its command
+def parseCommand(line):
+	items = line.split(":")
+	if len(items) < 3 or not items[0].isdigit():
+		raise ValueError("'%s' not recognized, wrong format" % line)
+
+	line_number = int(items[0])
+	command = items[1]
+
+	if command == 'fold':
+		if len(items) < 5 or not items[2].isdigit() or not items[3].isdigit():
+			raise ValueError("'%s' not recognized, wrong format" % line)
+
+		return (line_number, {'command': items[1], 'endline': int(items[2]), 'folded': int(items[3]), 'value': ":".join(items[4:])})
+	elif command == 'highlight':
+		if len(items) < 4:
+			raise ValueError("'%s' not recognized, wrong format" % line)
+
+		return (line_number, {'command': items[1], 'keyword': items[2], 'value': items[3:][0]})
+	elif command.startswith('needinfo', 0, 8):
+		if len(items) < 4:
+			raise ValueError("'%s' not recognized, wrong format" % line)
+		# does the command contains attribues?
+		attrs = command.split('[')
+
+		attrs_db = {}
+		# comma separated values
+		if len(attrs) > 1:
+			attrs = attrs[1][0:-1].split(",")
+			for attr in attrs:
+				pair = attr.split("=")
+				if len(pair) != 2:
+					continue
+
+				attrs_db[ pair[0] ] = pair[1]
+
+		return (line_number, {'command': 'needinfo', 'keyword': items[2], 'value': items[3:][0], 'attrs': attrs_db })
+	else:
+		return (line_number, {'command': items[1], 'value': "// " + ":".join(items[2:])})
+
 class VisualizationParser(object):
 
 	def __init__(self, file):
@@ -16,7 +59,7 @@ class VisualizationParser(object):
 	def parse(self):
 		vis_content = ""
 		with open(self.file, "r") as file:
-        		vis_content = file.read()
+			vis_content = file.read()
 
 		line_counter = 0
 		for line in vis_content.split("\n"):
@@ -29,51 +72,13 @@ class VisualizationParser(object):
 			if line[0] == "#":
 				continue
 
-			#<linenumber>:<command>:<value>
-			items = line.split(":")
-			if len(items) < 3:
-				sys.stderr.write("line %s: '%s' not recognized, wrong format" % (line_counter, line))
+			try:
+				(line_number, command) = parseCommand(line)
+			except ValueError as error:
+				sys.stderr.write("line %s: %s\n" % (line_counter, error))
 				continue
 
-			command = items[1]
-
-			if command == 'fold':
-				if len(items) < 5:
-					sys.stderr.write("line %s: '%s' not recognized, wrong format" % (line_counter, line))
-	                                continue
-
-				self.addCommand(int(items[0]), {'command': items[1], 'endline': int(items[2]), 'folded': int(items[3]), 'value': ":".join(items[4:])})
-				#self.lines[ int(items[0]) ] = {'command': items[1], 'endline': int(items[2]), 'folded': int(items[3]), 'value': ":".join(items[4:])}
-			elif command == 'highlight':
-				if len(items) < 3:
-					sys.stderr.write("line %s: '%s' not recognized, wrong format" % (line_counter, line))
-                                        continue
-
-				self.addCommand(int(items[0]), {'command': items[1], 'keyword': items[2], 'value': items[3:][0]})
-				#self.lines[ int(items[0]) ] = {'command': items[1], 'keyword': items[2], 'value': items[3:][0]}
-			elif command.startswith('needinfo', 0, 8):
-				if len(items) < 3:
-					sys.stderr.write("line %s: '%s' not recognized, wrong format" % (line_counter, line))
-                                        continue
-				# does the command contains attribues?
-				attrs = command.split('[')
-
-				attrs_db = {}
-				# comma separated values
-				if len(attrs) > 1:
-					attrs = attrs[1][0:-1].split(",")
-					for attr in attrs:
-						pair = attr.split("=")
-						if len(pair) != 2:
-							continue
-
-						attrs_db[ pair[0] ] = pair[1]
-
-				self.addCommand( int(items[0]), {'command': 'needinfo', 'keyword': items[2], 'value': items[3:][0], 'attrs': attrs_db } )
-				#self.lines[ int(items[0]) ] = {'command': 'needinfo', 'keyword': items[2], 'value': items[3:][0], 'attrs': attrs_db }
-			else:	
-				self.addCommand( int(items[0]), {'command': items[1], 'value': "// " + ":".join(items[2:])} )
-				#self.lines[ int(items[0]) ] = {'command': items[1], 'value': "// " + ":".join(items[2:])}
+			self.addCommand(line_number, command)
 
 	def getCommands(self):
 		return self.lines
@@ -0,0 +1,218 @@
+#!/bin/python
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import SocketServer
+
+# Only the client side is imported by visualize.py before it knows whether
+# it renders itself, visualizer modules (ply, lexer tables) are imported
+# by the daemon when it starts.
+
+# number of token tables kept by the daemon
+token_cache_size = 64
+
+def getSocketFile():
+	runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "")
+	if len(runtime_dir) == 0:
+		return "/tmp/codevisualizer-%d.sock" % os.getuid()
+	return "%s/codevisualizer.sock" % runtime_dir
+
+# send one request, returns the response or None if no daemon is running
+def sendRequest(socket_file, request):
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		try:
+			sock.connect(socket_file)
+		except socket.error as e:
+			if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+				return None
+			raise
+
+		sock.sendall("%s\n" % json.dumps(request))
+		fd = sock.makefile("r")
+		response = fd.readline()
+		fd.close()
+	finally:
+		sock.close()
+
+	if len(response) == 0:
+		return None
+	return json.loads(response)
+
+class DaemonHandler(SocketServer.StreamRequestHandler):
+
+	# one json request per line, one json response per line
+	def handle(self):
+		for line in self.rfile:
+			if len(line.strip()) == 0:
+				continue
+
+			try:
+				request = json.loads(line)
+			except ValueError:
+				response = {'status': 'error', 'error': "request is not valid json"}
+			else:
+				response = self.server.daemon.process(request)
+
+			self.wfile.write("%s\n" % json.dumps(response))
+			self.wfile.flush()
+
+class VisualizeDaemon(object):
+
+	def __init__(self, script_home, socket_file, debug = False):
+		from SourceVisualizer import SourceVisualizer, mkdir_p
+		from BuildManifest import BuildManifest
+		from CodeTokenizer import getLexer
+		self.SourceVisualizer = SourceVisualizer
+		self.BuildManifest = BuildManifest
+		self.mkdir_p = mkdir_p
+
+		self.script_home = script_home
+		self.socket_file = socket_file
+		self.debug_mode = debug
+		self.running = False
+		self.started = time.time()
+		self.renders = 0
+		# (layout mode, shared layout) -> [keywords stat, SourceVisualizer]
+		self.visualizers = {}
+		# keyworddb file -> [keyworddb stat, keyworddb]
+		self.keyworddbs = {}
+		# token tables are shared by all visualizers
+		self.token_cache = None
+
+		# build (or load) the lexer before the first request comes
+		getLexer()
+
+	def debug(self, msg):
+		if self.debug_mode:
+			print msg
+			sys.stdout.flush()
+
+	def getStamp(self, files):
+		stamp = []
+		for file in files:
+			try:
+				st = os.stat(file)
+				stamp.append( (st.st_size, st.st_mtime, st.st_ino) )
+			except OSError:
+				stamp.append(None)
+		return stamp
+
+	def getVisualizer(self, layout_mode, shared_layout):
+		key = (layout_mode, shared_layout)
+		stamp = self.getStamp(["%s/keywords" % self.script_home])
+		if key not in self.visualizers or self.visualizers[key][0] != stamp:
+			self.debug("Parsing keywords for layout mode %s %s" % key)
+			visualizer = self.SourceVisualizer(self.script_home, False, layout_mode, shared_layout)
+			if self.token_cache is None:
+				visualizer.enableTokenCache(token_cache_size)
+				self.token_cache = visualizer.token_cache
+			else:
+				visualizer.token_cache = self.token_cache
+				visualizer.token_cache_size = token_cache_size
+			self.visualizers[key] = [stamp, visualizer]
+
+		return self.visualizers[key][1]
+
+	def loadKeywordDB(self, visualizer, destination):
+		keyworddb_file = "%s/keyworddb" % destination
+		stamp = self.getStamp([keyworddb_file, "%s.idx" % keyworddb_file])
+		if keyworddb_file not in self.keyworddbs or self.keyworddbs[keyworddb_file][0] != stamp:
+			self.debug("Loading %s" % keyworddb_file)
+			visualizer.loadKeywordDB(destination)
+			# an empty keyworddb is created when missing
+			stamp = self.getStamp([keyworddb_file, "%s.idx" % keyworddb_file])
+			self.keyworddbs[keyworddb_file] = [stamp, visualizer.keyworddb]
+
+		visualizer.keyworddb_file = keyworddb_file
+		visualizer.keyworddb = self.keyworddbs[keyworddb_file][1]
+
+	def render(self, request):
+		src_file = request['file']
+		destination = request['dest']
+		visualizer = self.getVisualizer(request.get('layout_mode', "copy"), request.get('layout_dir', ""))
+		visualizer.lazy_folds = request.get('lazy_folds', False)
+		visualizer.virtual = request.get('virtual', False)
+		visualizer.compact = request.get('compact', False)
+		visualizer.gzip_output = request.get('gzip', False)
+		visualizer.bundle = request.get('bundle', False)
+		visualizer.symbols = request.get('symbols', False)
+		visualizer.callgraph = request.get('callgraph', False)
+		visualizer.search = request.get('search', False)
+		visualizer.reanchor = request.get('reanchor', True)
+		visualizer.lex_processes = request.get('jobs', 0) or None
+
+		self.mkdir_p(destination)
+		visualizer.prepareDestination(destination)
+		self.loadKeywordDB(visualizer, destination)
+		visualizer.openSymbolIndex(destination)
+		visualizer.updateSymbols([(src_file, destination)], 1)
+		visualizer.openCallGraph(destination)
+		visualizer.updateCallGraph([(src_file, destination)], 1)
+		visualizer.openSearchIndex(destination)
+
+		if 'annotation' in request:
+			visualizer.annotate(src_file, destination, request['annotation'])
+
+		page = visualizer.getPageFile(src_file, destination)
+		# the manifest is read every time, pages may be rendered by visualize.py too
+		manifest = self.BuildManifest(destination)
+		if not request.get('force', False) and visualizer.isUpToDate(manifest, src_file, destination):
+			self.debug("%s is up to date" % page)
+			return {'status': 'ok', 'page': page, 'rendered': False}
+
+		start = time.time()
+		lines = visualizer.visualize(src_file, destination)
+		seconds = time.time() - start
+		visualizer.recordPage(manifest, src_file, destination)
+		manifest.save()
+		visualizer.buildSearchIndex(manifest)
+		self.renders = self.renders + 1
+		self.debug("%8.3fs %7d lines  %s" % (seconds, lines, src_file))
+
+		return {'status': 'ok', 'page': page, 'rendered': True, 'lines': lines, 'seconds': seconds}
+
+	def process(self, request):
+		command = request.get('command', "")
+		try:
+			if command == "render" or command == "annotate":
+				return self.render(request)
+			elif command == "ping":
+				return {'status': 'ok', 'pid': os.getpid(), 'uptime': time.time() - self.started, 'renders': self.renders}
+			elif command == "stop":
+				self.running = False
+				return {'status': 'ok'}
+		except Exception as e:
+			return {'status': 'error', 'error': str(e)}
+
+		return {'status': 'error', 'error': "unknown command '%s'" % command}
+
+	def serve(self):
+		# another daemon already listening?
+		if sendRequest(self.socket_file, {'command': 'ping'}) is not None:
+			raise RuntimeError("daemon already running on %s" % self.socket_file)
+
+		if os.path.exists(self.socket_file):
+			os.unlink(self.socket_file)
+
+		# requests are handled one by one, pages of one destination share
+		# the manifest, layout and keyworddb
+		old_umask = os.umask(0077)
+		try:
+			server = SocketServer.UnixStreamServer(self.socket_file, DaemonHandler)
+		finally:
+			os.umask(old_umask)
+
+		server.daemon = self
+		self.running = True
+		self.debug("Listening on %s" % self.socket_file)
+		try:
+			while self.running:
+				server.handle_request()
+		finally:
+			server.server_close()
+			os.unlink(self.socket_file)
@@ -0,0 +1,63 @@
+#!/bin/python
+
+# Compare the single pass keyword colorizer with the original
+# per keyword implementation (three re.sub calls for every keyword).
+# Neither is used by HTMLVisualizer any more (it colors keywords from the
+# token table of a line), both are kept in bench/linerender.py.
+#
+# usage: bench/colorkeywords.py [source file] [rounds]
+
+import os
+import re
+import sys
+import time
+
+script_home = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, script_home)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from CodeParser import CodeParser
+from HTMLVisualizer import HTMLVisualizer
+from linerender import colorLiterals, colorKeywords
+
+def legacyColorKeywords(htmlVis, line):
+	# original implementation, only with css aliasing and the raw string
+	# in the last substitution fixed (it used to emit \x01 instead of \1)
+	for keyword in htmlVis.keywords:
+		css = htmlVis.keyword_classes[keyword]
+		line = re.sub(r"(\s)(%s)(\s)" % keyword, r"\1<span class='%s'>\2</span>\3" % css, line)
+		line = re.sub(r"^%s(\s)" % keyword, r"<span class='%s'>%s</span>\1" % (css, keyword), line)
+		line = re.sub(r"(\s)%s$" % keyword, r"\1<span class='%s'>%s</span>" % (css, keyword), line)
+	return line
+
+def measure(function, htmlVis, segments, rounds):
+	start = time.time()
+	for i in range(0, rounds):
+		out = [function(htmlVis, segment) for segment in segments]
+	return (time.time() - start, out)
+
+if __name__ == "__main__":
+	src_file = "%s/examples/manp.c" % script_home
+	rounds = 5
+	if len(sys.argv) > 1:
+		src_file = sys.argv[1]
+	if len(sys.argv) > 2:
+		rounds = int(sys.argv[2])
+
+	htmlVis = HTMLVisualizer([], {}, [], {}, "%s/keywords" % script_home, script_home)
+	segments = []
+	for line in CodeParser(src_file).getLines():
+		segments.append(colorLiterals(htmlVis.pretokenize(line)))
+
+	(legacy_time, legacy_out) = measure(legacyColorKeywords, htmlVis, segments, rounds)
+	(single_time, single_out) = measure(colorKeywords, htmlVis, segments, rounds)
+
+	print "%s: %d lines, %d keywords, %d rounds" % (src_file, len(segments), len(htmlVis.keywords), rounds)
+	print "per keyword re.sub: %8.3fs" % legacy_time
+	print "single pass:        %8.3fs (%.1fx)" % (single_time, legacy_time / max(single_time, 1e-9))
+
+	differ = [i + 1 for i in range(0, len(segments)) if legacy_out[i] != single_out[i]]
+	if differ:
+		print "outputs differ on lines: %s" % ", ".join(map(str, differ))
+		exit(1)
+	print "outputs identical"
@@ -0,0 +1,74 @@
+#!/bin/python
+
+# Latency of rendering one page:
+#   - one-shot: visualize.py --no-daemon (interpreter, ply, lexer, keywords, keyworddb)
+#   - client: visualize.py talking to a running daemon
+#   - socket: render request sent straight to the daemon
+# Each render is forced, annotate requests leave the token table cached.
+#
+# usage: bench/daemon.py [source file] [destination] [rounds]
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+import tempfile
+
+script_home = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, script_home)
+
+from VisualizeDaemon import sendRequest
+
+def measure(function, rounds):
+	times = []
+	for i in range(0, rounds):
+		start = time.time()
+		function()
+		times.append(time.time() - start)
+	times.sort()
+	return (times[len(times) / 2] * 1000, times[0] * 1000)
+
+if __name__ == "__main__":
+	src_file = "%s/examples/manp.c" % script_home
+	destination = ""
+	rounds = 10
+	if len(sys.argv) > 1:
+		src_file = os.path.realpath(sys.argv[1])
+	if len(sys.argv) > 2 and len(sys.argv[2]) > 0:
+		destination = os.path.realpath(sys.argv[2])
+	if len(sys.argv) > 3:
+		rounds = int(sys.argv[3])
+
+	tmp_dir = tempfile.mkdtemp()
+	if destination == "":
+		destination = "%s/dest" % tmp_dir
+	socket_file = "%s/daemon.sock" % tmp_dir
+	visualize = [sys.executable, "%s/visualize.py" % script_home, "--socket=%s" % socket_file, "--dest=%s" % destination, "--force"]
+	request = {'command': 'render', 'file': src_file, 'dest': destination, 'force': True}
+
+	# the first run creates the destination and the lexer table
+	subprocess.check_call(visualize + ["--no-daemon", src_file])
+
+	results = []
+	results.append( ("one-shot", measure(lambda: subprocess.check_call(visualize + ["--no-daemon", src_file]), rounds)) )
+
+	daemon = subprocess.Popen([sys.executable, "%s/visualize.py" % script_home, "--daemon", "--socket=%s" % socket_file])
+	try:
+		while sendRequest(socket_file, {'command': 'ping'}) is None:
+			time.sleep(0.05)
+
+		# first request parses keywords and keyworddb
+		results.append( ("first request", measure(lambda: sendRequest(socket_file, request), 1)) )
+		results.append( ("client", measure(lambda: subprocess.check_call(visualize + [src_file]), rounds)) )
+		results.append( ("socket", measure(lambda: sendRequest(socket_file, request), rounds)) )
+		results.append( ("interpreter", measure(lambda: subprocess.check_call([sys.executable, "-c", "pass"]), rounds)) )
+	finally:
+		sendRequest(socket_file, {'command': 'stop'})
+		daemon.wait()
+		shutil.rmtree(tmp_dir)
+
+	print "%s, %d rounds, milliseconds" % (src_file, rounds)
+	print "%-14s %10s %10s" % ("", "median", "min")
+	for (name, (median, minimum)) in results:
+		print "%-14s %10.1f %10.1f" % (name, median, minimum)
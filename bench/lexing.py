@@ -0,0 +1,73 @@
+#!/bin/python
+
+# Time of lexing a synthetic source made of copies of a C file in one pass
+# and in chunks by pools of processes, as a whole and streamed. Token
+# tables of every pool must be the same as those of the single pass, even
+# in iteration order (compared by digests, many live objects of kept tables
+# would slow down the garbage collector).
+#
+# usage: bench/lexing.py [source file] [lines] [processes ...]
+
+import os
+import sys
+import time
+import shutil
+import marshal
+import hashlib
+import tempfile
+import multiprocessing
+
+script_home = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, script_home)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from memory import makeSource
+from CodeTokenizer import CodeTokenizer, tokenizeChunks, parallel_chunk_size
+
+def tables(codeTokenizer):
+	return (codeTokenizer.getKeywords(), codeTokenizer.getComments(), codeTokenizer.getTokens())
+
+def digest(result):
+	return hashlib.md5(marshal.dumps(result)).hexdigest()
+
+def lexWhole(src_file, content, processes):
+	start = time.time()
+	result = tables(CodeTokenizer(src_file, content, processes = processes))
+	return (time.time() - start, digest(result))
+
+def lexStream(src_file, processes):
+	start = time.time()
+	digests = [digest( (first_index, lines, tables(codeTokenizer)) ) for (first_index, lines, codeTokenizer) in tokenizeChunks(src_file, parallel_chunk_size, processes)]
+	return (time.time() - start, digests)
+
+if __name__ == "__main__":
+	template = "%s/examples/manp.c" % script_home
+	lines = 100000
+	counts = [2, 4, multiprocessing.cpu_count()]
+	if len(sys.argv) > 1:
+		template = sys.argv[1]
+	if len(sys.argv) > 2:
+		lines = int(sys.argv[2])
+	if len(sys.argv) > 3:
+		counts = [int(count) for count in sys.argv[3:]]
+
+	tmp_dir = tempfile.mkdtemp()
+	try:
+		src_file = "%s/source.c" % tmp_dir
+		makeSource(template, lines, src_file)
+		with open(src_file, "r") as fd:
+			content = fd.read()
+
+		print "%s: %d lines, %d bytes, %d cpus" % (template, lines, len(content), multiprocessing.cpu_count())
+		print "%9s %6s %9s %6s" % ("processes", "whole", "streamed", "same")
+		(whole_seconds, whole) = lexWhole(src_file, content, 1)
+		(stream_seconds, stream) = lexStream(src_file, 1)
+		print "%9d %5.2fs %8.2fs %6s" % (1, whole_seconds, stream_seconds, "-")
+		for processes in sorted(set(counts)):
+			if processes < 2:
+				continue
+			(parallel_whole_seconds, parallel_whole) = lexWhole(src_file, content, processes)
+			(parallel_stream_seconds, parallel_stream) = lexStream(src_file, processes)
+			print "%9d %5.2fs %8.2fs %6s" % (processes, parallel_whole_seconds, parallel_stream_seconds, parallel_whole == whole and parallel_stream == stream)
+	finally:
+		shutil.rmtree(tmp_dir)
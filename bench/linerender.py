@@ -0,0 +1,163 @@
+#!/bin/python
+
+# Time rendering of the longest lines of a source file:
+#   - the original per character postTokenize against the tag split one
+#   - the original chain of stages (escape, literals, keywords, tabs,
+#     spaces) against the single pass over a segment and against the token
+#     table path HTMLVisualizer renders with
+# Lines are also repeated to show how each stage scales with line length.
+# The chain and the single pass are not part of HTMLVisualizer any more,
+# they are kept here (and used by bench/colorkeywords.py too).
+#
+# usage: bench/linerender.py [source file] [number of lines] [rounds]
+
+import os
+import re
+import sys
+import time
+
+script_home = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, script_home)
+
+from CodeParser import CodeParser
+from CodeTokenizer import CodeTokenizer
+from HTMLVisualizer import HTMLVisualizer
+
+tag_re = re.compile(r"(<[^>]*>)")
+literal_pattern = r"'[^']*'|\"[^\"]*\""
+
+def tokenize(line):
+	return line.replace('\t', 6*"&nbsp;")
+
+def postTokenize(line):
+	# replace spaces outside tags, tags are the odd items of the split
+	parts = tag_re.split(line)
+	for index in range(0, len(parts), 2):
+		parts[index] = parts[index].replace(' ', "&nbsp;")
+
+	return "".join(parts)
+
+def colorLiterals(line):
+	line = re.sub(r"('[^']*')", r"<span class='str_literal'>\1</span>", line)
+	line = re.sub(r'("[^"]*")', r"<span class='str_literal'>\1</span>", line)
+	return line
+
+# id of a HTMLVisualizer -> pattern of all its keywords
+keywords_res = {}
+
+def getKeywordsPattern(htmlVis):
+	# longest first so a keyword never shadows a longer one sharing its prefix
+	alternatives = sorted(htmlVis.keywords, key = len, reverse = True)
+	return r"(?<!\S)(?P<keyword>%s)(?!\S)" % "|".join(map(re.escape, alternatives))
+
+def keywordSpan(htmlVis, match):
+	keyword = match.group('keyword')
+	# keyword has to be separated by a whitespace at least from one side
+	if match.start() == 0 and match.end() == len(match.string):
+		return keyword
+
+	return "<span class='%s'>%s</span>" % (htmlVis.keyword_classes[keyword], keyword)
+
+# single pass over all keywords of htmlVis
+def colorKeywords(htmlVis, line):
+	if not htmlVis.keywords:
+		return line
+
+	if id(htmlVis) not in keywords_res:
+		keywords_res[id(htmlVis)] = re.compile(getKeywordsPattern(htmlVis))
+	return keywords_res[id(htmlVis)].sub(lambda match: keywordSpan(htmlVis, match), line)
+
+# id of a HTMLVisualizer -> pattern of literals and all its keywords
+segment_res = {}
+
+# escape, literals, keywords and whitespaces in one pass over a segment
+def renderSegment(htmlVis, text):
+	if id(htmlVis) not in segment_res:
+		if htmlVis.keywords:
+			segment_res[id(htmlVis)] = re.compile(r"(?P<literal>%s)|%s" % (literal_pattern, getKeywordsPattern(htmlVis)))
+		else:
+			segment_res[id(htmlVis)] = re.compile(r"(?P<literal>%s)" % literal_pattern)
+
+	text = htmlVis.pretokenize(text)
+	out = []
+	last = 0
+	for match in segment_res[id(htmlVis)].finditer(text):
+		out.append(htmlVis.whitespaces(text[last:match.start()]))
+		if match.group('literal') is not None:
+			out.append("<span class='%s'>%s</span>" % (htmlVis.css('str_literal'), htmlVis.whitespaces(match.group('literal'))))
+		else:
+			out.append(keywordSpan(htmlVis, match))
+		last = match.end()
+
+	out.append(htmlVis.whitespaces(text[last:]))
+	return "".join(out)
+
+def legacyPostTokenize(line):
+	in_tag = 0
+	oline = ""
+	for char in line:
+		if char == ' ' and in_tag == 0:
+			oline = oline + "&nbsp;"
+		else:
+			oline = oline + char
+
+		if char == '<':
+			in_tag = in_tag + 1
+		elif char == '>':
+			in_tag = in_tag - 1
+
+	return oline
+
+def legacyStages(htmlVis, line):
+	new = htmlVis.pretokenize(line)
+	new = colorLiterals(new)
+	new = colorKeywords(htmlVis, new)
+	new = tokenize(new)
+	return legacyPostTokenize(new)
+
+def measure(function, items, rounds):
+	start = time.time()
+	for i in range(0, rounds):
+		for item in items:
+			function(item)
+	return (time.time() - start) / (rounds * len(items)) * 1e6
+
+def tokenTable(htmlVis, lines):
+	# lex the lines as one file, keep their token tables
+	content = "\n".join(lines)
+	tokens = CodeTokenizer("", content).getTokens()
+	return [(lines[i], tokens.get(i + 1, [])) for i in range(0, len(lines))]
+
+if __name__ == "__main__":
+	src_file = "%s/examples/manp.c" % script_home
+	count = 20
+	rounds = 200
+	if len(sys.argv) > 1:
+		src_file = sys.argv[1]
+	if len(sys.argv) > 2:
+		count = int(sys.argv[2])
+	if len(sys.argv) > 3:
+		rounds = int(sys.argv[3])
+
+	htmlVis = HTMLVisualizer([], {}, [], {}, "%s/keywords" % script_home, script_home)
+	longest = sorted(CodeParser(src_file).getLines(), key = len, reverse = True)[:count]
+
+	print "%s: %d longest lines, %d rounds, microseconds per line" % (src_file, len(longest), rounds)
+	print "%6s %12s %12s %12s %12s %12s" % ("chars", "postTok old", "postTok new", "stages old", "segment", "tokens")
+	for repeat in [1, 4, 16]:
+		lines = [" ".join([line] * repeat) for line in longest]
+		staged = [tokenize(colorKeywords(htmlVis, colorLiterals(htmlVis.pretokenize(line)))) for line in lines]
+		for line in staged:
+			if legacyPostTokenize(line) != postTokenize(line):
+				print "postTokenize outputs differ: %s" % line
+				exit(1)
+
+		tokenized = tokenTable(htmlVis, lines)
+		r = max(1, rounds / repeat)
+		print "%6d %12.1f %12.1f %12.1f %12.1f %12.1f" % (
+			sum(map(len, lines)) / len(lines),
+			measure(legacyPostTokenize, staged, r),
+			measure(postTokenize, staged, r),
+			measure(lambda line: legacyStages(htmlVis, line), lines, r),
+			measure(lambda line: renderSegment(htmlVis, line), lines, r),
+			measure(lambda item: htmlVis.renderTokens(item[0], item[1], 0, len(item[0])), tokenized, r))
@@ -0,0 +1,73 @@
+#!/bin/python
+
+# Peak memory (max rss) and time of rendering a synthetic source made of
+# copies of a C file, rendered as a whole and streamed in chunks.
+# Every render runs in its own process.
+#
+# usage: bench/memory.py [source file] [lines ...]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+script_home = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, script_home)
+
+def makeSource(template, lines, src_file):
+	with open(template, "r") as fd:
+		content = fd.read()
+	template_lines = content.count("\n")
+
+	written = 0
+	with open(src_file, "w") as fd:
+		while written + template_lines <= lines:
+			fd.write(content)
+			written = written + template_lines
+		fd.write("\n".join(content.split("\n")[:lines - written]))
+
+def render(src_file, destination, stream):
+	import SourceVisualizer
+	visualizer = SourceVisualizer.SourceVisualizer(script_home)
+	if stream:
+		visualizer.stream_threshold = 0
+	else:
+		visualizer.stream_threshold = os.path.getsize(src_file) + 1
+	visualizer.prepareDestination(destination)
+	visualizer.loadKeywordDB(destination)
+	visualizer.visualize(src_file, destination)
+
+def measure(src_file, destination, stream):
+	start = time.time()
+	pid = os.fork()
+	if pid == 0:
+		try:
+			render(src_file, destination, stream)
+		finally:
+			os._exit(0)
+
+	(pid, status, usage) = os.wait4(pid, 0)
+	# ru_maxrss is in kilobytes on linux
+	return (usage.ru_maxrss / 1024.0, time.time() - start)
+
+if __name__ == "__main__":
+	template = "%s/examples/manp.c" % script_home
+	sizes = [10000, 100000, 1000000]
+	if len(sys.argv) > 1:
+		template = sys.argv[1]
+	if len(sys.argv) > 2:
+		sizes = map(int, sys.argv[2:])
+
+	tmp_dir = tempfile.mkdtemp()
+	try:
+		print "%s copies, peak rss in MB, seconds" % template
+		print "%8s %8s %10s %8s %10s %8s" % ("lines", "MB", "whole rss", "time", "stream rss", "time")
+		for lines in sizes:
+			src_file = "%s/source.c" % tmp_dir
+			makeSource(template, lines, src_file)
+			(whole_rss, whole_time) = measure(src_file, tmp_dir, False)
+			(stream_rss, stream_time) = measure(src_file, tmp_dir, True)
+			print "%8d %8.1f %10.1f %8.2f %10.1f %8.2f" % (lines, os.path.getsize(src_file) / 1048576.0, whole_rss, whole_time, stream_rss, stream_time)
+	finally:
+		shutil.rmtree(tmp_dir)
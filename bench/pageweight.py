@@ -0,0 +1,194 @@
+#!/bin/python
+
+# Size of pages rendered in different output modes from a C file and its
+# .vis file copied several times (annotations are copied with the code).
+# Pages in the virtual mode draw only the lines in the browser window,
+# with node installed the time vis.js needs to parse their line data and
+# draw the first window is measured as well. Elements are the tags the
+# browser creates on load, for virtual pages those of the first window.
+# With --annotate-calls every called function gets a keyworddb entry, as
+# if the keyworddb was made of whatis descriptions of a whole project.
+#
+# usage: bench/pageweight.py [--annotate-calls] [source file] [copies ...]
+
+import os
+import re
+import sys
+import gzip
+import time
+import shutil
+import tempfile
+import subprocess
+
+script_home = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, script_home)
+
+from SourceVisualizer import SourceVisualizer
+
+# output modes, attributes of SourceVisualizer
+modes = [
+	("html", {}),
+	("lazy folds", {'lazy_folds': True}),
+	("virtual", {'virtual': True}),
+	("compact", {'compact': True}),
+	("compact virt", {'compact': True, 'virtual': True})
+]
+
+call_re = re.compile(r'\b([A-Za-z_][A-Za-z0-9_]*)\s*\(')
+
+element_re = re.compile(r'<[a-zA-Z]')
+
+# parse the line data, build rows and draw the first 60 lines (+ margin),
+# prints milliseconds and elements drawn
+node_script = """
+var fs = require("fs")
+global.document = {}
+global.window = {location: {hash: ""}}
+var ready = null
+var drawn = ""
+global.$ = function(arg) {
+	if (typeof arg == "function") { ready = arg }
+	return {
+		ready: function(fn) { ready = fn }, css: function() {},
+		html: function(html) { drawn = html },
+		scroll: function() {}, resize: function() {}, on: function() {},
+		scrollTop: function() { return 0 }, height: function() { return 60 * 16 },
+		offset: function() { return {top: 0} },
+		children: function() { return {first: function() { return {outerHeight: function() { return 16 }} }} }
+	}
+}
+function countElements(html) {
+	var tags = html.match(/<[a-z]/g)
+	return tags ? tags.length : 0
+}
+eval(fs.readFileSync(process.argv[2], "utf8"))
+var page = fs.readFileSync(process.argv[3], "latin1")
+var start = Date.now()
+eval(page.substring(page.indexOf("visPage("), page.lastIndexOf("</script>")))
+ready()
+console.log((Date.now() - start) + " " + countElements(drawn))
+"""
+
+def makeCopies(template, copies, destination):
+	basename = os.path.basename(template)
+	with open(template, "r") as fd:
+		content = fd.read()
+	lines = content.count("\n")
+
+	vis_lines = []
+	if os.path.exists("%s.vis" % template):
+		with open("%s.vis" % template, "r") as fd:
+			vis_lines = [line for line in fd.read().split("\n") if len(line) > 0 and line[0] != "#"]
+
+	src_file = "%s/%s" % (destination, basename)
+	with open(src_file, "w") as fd:
+		fd.write(content * copies)
+
+	# line numbers (and fold ends) moved to every copy
+	with open("%s.vis" % src_file, "w") as fd:
+		for copy in range(0, copies):
+			offset = copy * lines
+			for line in vis_lines:
+				items = line.split(":")
+				items[0] = str(int(items[0]) + offset)
+				if items[1] == "fold":
+					items[2] = str(int(items[2]) + offset)
+				fd.write("%s\n" % ":".join(items))
+
+	return src_file
+
+def makeCallsKeywordDB(src_file, destination):
+	with open(src_file, "r") as fd:
+		calls = set(call_re.findall(fd.read()))
+	with open("%s/keyworddb" % destination, "w") as fd:
+		for call in sorted(calls):
+			fd.write("%s:%s - what %s does, as described by its manual page\n" % (call, call, call))
+	return len(calls)
+
+def gzipSize(file):
+	tmp_file = "%s.gz" % file
+	with open(file, "rb") as src:
+		dst = gzip.open(tmp_file, "wb")
+		dst.write(src.read())
+		dst.close()
+	size = os.path.getsize(tmp_file)
+	os.unlink(tmp_file)
+	return size
+
+def directorySize(directory):
+	size = 0
+	for (root, dirs, files) in os.walk(directory):
+		for file in files:
+			size = size + os.path.getsize("%s/%s" % (root, file))
+	return size
+
+def nodeTime(page, tmp_dir):
+	script = "%s/draw.js" % tmp_dir
+	with open(script, "w") as fd:
+		fd.write(node_script)
+	try:
+		output = subprocess.check_output(["node", script, "%s/layout/vis.js" % script_home, page])
+	except (OSError, subprocess.CalledProcessError):
+		return None
+	(milliseconds, elements) = output.split()
+	return (int(milliseconds), int(elements))
+
+# elements the browser creates when loading the page
+def countElements(page):
+	with open(page, "r") as fd:
+		return len(element_re.findall(fd.read()))
+
+if __name__ == "__main__":
+	args = sys.argv[1:]
+	annotate_calls = "--annotate-calls" in args
+	if annotate_calls:
+		args.remove("--annotate-calls")
+
+	template = "%s/examples/manp.c" % script_home
+	scales = [1, 4, 16]
+	if len(args) > 0:
+		template = os.path.realpath(args[0])
+	if len(args) > 1:
+		scales = map(int, args[1:])
+
+	tmp_dir = tempfile.mkdtemp()
+	try:
+		if annotate_calls:
+			print "%s copies, every call annotated, sizes in KB" % template
+		else:
+			print "%s copies, sizes in KB" % template
+		print "%6s %7s %-12s %9s %9s %9s %9s %9s %9s" % ("copies", "lines", "mode", "page", "gzipped", "extra", "render", "elements", "node draw")
+		for copies in scales:
+			for (name, settings) in modes:
+				destination = "%s/%s-%d" % (tmp_dir, name.replace(" ", "-"), copies)
+				os.makedirs(destination)
+				src_file = makeCopies(template, copies, destination)
+				if annotate_calls:
+					makeCallsKeywordDB(src_file, destination)
+				visualizer = SourceVisualizer(script_home)
+				for attribute in settings:
+					setattr(visualizer, attribute, settings[attribute])
+				visualizer.prepareDestination(destination)
+				visualizer.loadKeywordDB(destination)
+
+				start = time.time()
+				lines = visualizer.visualize(src_file, destination)
+				seconds = time.time() - start
+
+				page = visualizer.getPageFile(src_file, destination)
+				# files loaded later (folds) besides the page and layout
+				extra = 0
+				if os.path.exists("%s.folds" % page):
+					extra = directorySize("%s.folds" % page)
+
+				elements = countElements(page)
+				draw = "-"
+				if settings.get('virtual'):
+					result = nodeTime(page, tmp_dir)
+					if result is not None:
+						draw = "%dms" % result[0]
+						elements = result[1]
+
+				print "%6d %7d %-12s %9.1f %9.1f %9.1f %8.2fs %9d %9s" % (copies, lines, name, os.path.getsize(page) / 1024.0, gzipSize(page) / 1024.0, extra / 1024.0, seconds, elements, draw)
+	finally:
+		shutil.rmtree(tmp_dir)
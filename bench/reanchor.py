@@ -0,0 +1,96 @@
+#!/bin/python
+
+# Time of moving .vis commands after random edits of a source: blocks of
+# lines inserted and deleted, lines re-indented and a block moved. The
+# source gets a command every few lines. Commands must end up on lines
+# with the same code (wrong) or be reported as unplaced.
+#
+# usage: bench/reanchor.py [source file] [commands every N lines] [rounds]
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+script_home = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, script_home)
+
+from VisAnchors import VisAnchors
+
+def editLines(lines, rnd):
+	new = list(lines)
+	for edit in range(0, 20):
+		position = rnd.randrange(len(new))
+		new[position:position] = ["/* inserted %d-%d */" % (edit, index) for index in range(0, rnd.randrange(1, 30))]
+	for edit in range(0, 20):
+		position = rnd.randrange(len(new))
+		del(new[position:position + rnd.randrange(1, 5)])
+	for edit in range(0, 20):
+		position = rnd.randrange(len(new))
+		new[position] = "    %s   " % new[position]
+
+	# a function sized block moved elsewhere
+	position = rnd.randrange(max(len(new) - 60, 1))
+	block = new[position:position + 40]
+	del(new[position:position + 40])
+	position = rnd.randrange(len(new))
+	new[position:position] = block
+	return new
+
+def tokens(line):
+	return "".join(line.split())
+
+if __name__ == "__main__":
+	template = "%s/examples/manp.c" % script_home
+	step = 25
+	rounds = 5
+	if len(sys.argv) > 1:
+		template = sys.argv[1]
+	if len(sys.argv) > 2:
+		step = int(sys.argv[2])
+	if len(sys.argv) > 3:
+		rounds = int(sys.argv[3])
+
+	with open(template, "r") as fd:
+		lines = fd.read().split("\n")
+	# commands on non empty lines
+	commands = ["%d:comment:line %d" % (number, number) for number in range(1, len(lines) + 1, step) if lines[number - 1].strip()]
+
+	tmp_dir = tempfile.mkdtemp()
+	try:
+		print "%s: %d lines, %d commands" % (template, len(lines), len(commands))
+		print "%5s %9s %7s %9s %6s" % ("round", "seconds", "moved", "unplaced", "wrong")
+		for round in range(0, rounds):
+			src_file = "%s/source.c" % tmp_dir
+			vis_file = "%s/source.c.vis" % tmp_dir
+			anchors_file = "%s/anchors" % tmp_dir
+			shutil.copy(template, src_file)
+			with open(vis_file, "w") as fd:
+				fd.write("\n".join(commands) + "\n")
+			if os.path.exists(anchors_file):
+				os.unlink(anchors_file)
+			VisAnchors(anchors_file).update(src_file, vis_file)
+
+			new = editLines(lines, random.Random(round))
+			with open(src_file, "w") as fd:
+				fd.write("\n".join(new))
+			# a new mtime even within the same second
+			os.utime(src_file, (0, 0))
+
+			start = time.time()
+			(moved, unplaced) = VisAnchors(anchors_file).update(src_file, vis_file)
+			seconds = time.time() - start
+
+			with open(vis_file, "r") as fd:
+				new_commands = [line for line in fd.read().split("\n") if line]
+			wrong = 0
+			for (command, new_command) in zip(commands, new_commands):
+				if new_command.startswith("#"):
+					continue
+				if tokens(lines[int(command.split(":")[0]) - 1]) != tokens(new[int(new_command.split(":")[0]) - 1]):
+					wrong = wrong + 1
+			print "%5d %8.3fs %7d %9d %6d" % (round, seconds, len(moved), len(unplaced), wrong)
+	finally:
+		shutil.rmtree(tmp_dir)
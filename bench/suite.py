@@ -0,0 +1,215 @@
+#!/bin/python
+
+# Time and peak memory of render stages (see StageProfiler) for synthetic
+# sources made of copies of a C file, annotated densely by a generated
+# .vis file, with keyworddbs of source identifiers and filler entries.
+# Cases:
+#   - render: every size with the default keyworddb size
+#   - keyworddb: the smallest size with every keyworddb size
+#   - rerender: the smallest size again after one annotation is added,
+#     the fragment cache is used
+# Every render runs in its own process. Results saved with --output can
+# be compared with those of another commit by --compare.
+#
+# usage: bench/suite.py [--sizes=N,...] [--keywords=N,...] [--compile-db]
+#                       [--output=FILE] [--compare=FILE] [source file]
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import optparse
+import tempfile
+import subprocess
+
+script_home = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, script_home)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from memory import makeSource
+
+identifier_re = re.compile(r'\b([A-Za-z_][A-Za-z0-9_]*)\b')
+
+# every line with an identifier is annotated, a fold every fold_step lines
+fold_step = 40
+fold_length = 20
+
+def makeVis(src_file):
+	annotations = 0
+	with open(src_file, "r") as src:
+		with open("%s.vis" % src_file, "w") as fd:
+			line_number = 0
+			for line in src:
+				line_number = line_number + 1
+				if line_number % fold_step == 0:
+					fd.write("%d:fold:%d:%d:fold of line %d\n" % (line_number, line_number + fold_length, (line_number / fold_step) % 2, line_number))
+					annotations = annotations + 1
+
+				identifiers = identifier_re.findall(line)
+				if not identifiers:
+					continue
+				kind = line_number % 3
+				if kind == 0:
+					fd.write("%d:comment:about line %d\n" % (line_number, line_number))
+				elif kind == 1:
+					fd.write("%d:highlight:%s:%s used here\n" % (line_number, identifiers[0], identifiers[0]))
+				else:
+					fd.write("%d:needinfo:%s:what is %s\n" % (line_number, identifiers[-1], identifiers[-1]))
+				annotations = annotations + 1
+	return annotations
+
+# identifiers of the source first, filler keywords up to size
+def makeKeywordDB(src_file, size, destination):
+	with open(src_file, "r") as fd:
+		identifiers = sorted(set(identifier_re.findall(fd.read())))[:size]
+	with open("%s/keyworddb" % destination, "w") as fd:
+		for identifier in identifiers:
+			fd.write("%s:%s - description of %s\n" % (identifier, identifier, identifier))
+		for index in range(len(identifiers), size):
+			fd.write("filler_%d:description of filler keyword %d\n" % (index, index))
+
+def render(src_file, destination, compile_db, write_fd):
+	from SourceVisualizer import SourceVisualizer
+	from StageProfiler import StageProfiler
+	from KeywordDB import compileKeywordDB
+
+	if compile_db:
+		compileKeywordDB("%s/keyworddb" % destination)
+	profiler = StageProfiler()
+	visualizer = SourceVisualizer(script_home)
+	visualizer.profiler = profiler
+	visualizer.prepareDestination(destination)
+	visualizer.loadKeywordDB(destination)
+	visualizer.visualize(src_file, destination)
+
+	with os.fdopen(write_fd, "w") as fd:
+		fd.write(json.dumps(profiler.getResults()))
+
+def measure(src_file, destination, compile_db):
+	(read_fd, write_fd) = os.pipe()
+	start = time.time()
+	pid = os.fork()
+	if pid == 0:
+		os.close(read_fd)
+		try:
+			render(src_file, destination, compile_db, write_fd)
+		finally:
+			os._exit(0)
+
+	os.close(write_fd)
+	with os.fdopen(read_fd, "r") as fd:
+		output = fd.read()
+	(pid, status, usage) = os.wait4(pid, 0)
+	seconds = time.time() - start
+	if len(output) == 0:
+		raise RuntimeError("render of %s failed" % src_file)
+
+	# ru_maxrss is in kilobytes on linux
+	return {'seconds': seconds, 'peak_rss_mb': usage.ru_maxrss / 1024.0, 'stages': json.loads(output)}
+
+def getCommit():
+	try:
+		return subprocess.check_output(["git", "-C", script_home, "rev-parse", "--short", "HEAD"], stderr = open(os.devnull, "w")).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return ""
+
+def runCase(name, template, lines, keywords, compile_db, tmp_dir, rerender = False):
+	destination = "%s/%s" % (tmp_dir, name.replace(" ", "-").replace("=", ""))
+	if not os.path.exists(destination):
+		os.makedirs(destination)
+	src_file = "%s/source.c" % destination
+	if not rerender:
+		makeSource(template, lines, src_file)
+		annotations = makeVis(src_file)
+		makeKeywordDB(src_file, keywords, destination)
+		result = measure(src_file, destination, compile_db)
+	else:
+		# rendered once, then the new annotation only
+		annotations = makeVis(src_file) + 1
+		with open("%s.vis" % src_file, "a") as fd:
+			fd.write("1:comment:one more annotation\n")
+		result = measure(src_file, destination, compile_db)
+
+	case = {'name': name, 'lines': lines, 'keywords': keywords, 'annotations': annotations}
+	case.update(result)
+	return case
+
+def printCase(case):
+	stages = " ".join(["%s=%.2f" % (stage, case['stages'][stage]['seconds']) for stage in case['stages']])
+	print "%-28s %8.2fs %8.1f MB  %s" % (case['name'], case['seconds'], case['peak_rss_mb'], stages)
+	sys.stdout.flush()
+
+def compareResults(old, new):
+	print "%-28s %9s %9s %7s %9s %9s" % ("case", "old s", "new s", "ratio", "old MB", "new MB")
+	old_cases = dict([(case['name'], case) for case in old['cases']])
+	for case in new['cases']:
+		if case['name'] not in old_cases:
+			continue
+		old_case = old_cases[case['name']]
+		ratio = case['seconds'] / max(old_case['seconds'], 0.001)
+		print "%-28s %9.2f %9.2f %6.2fx %9.1f %9.1f" % (case['name'], old_case['seconds'], case['seconds'], ratio, old_case['peak_rss_mb'], case['peak_rss_mb'])
+		for stage in case['stages']:
+			if stage not in old_case['stages']:
+				continue
+			print "  %-26s %9.2f %9.2f" % (stage, old_case['stages'][stage]['seconds'], case['stages'][stage]['seconds'])
+
+if __name__ == "__main__":
+	parser = optparse.OptionParser(usage = "usage: %prog [--sizes=N,...] [--keywords=N,...] [--compile-db] [--output=FILE] [--compare=FILE] [source file]")
+	parser.add_option("", "--sizes", dest = "sizes", default = "10000,100000,1000000",
+		help = "lines of generated sources (default: %default)")
+	parser.add_option("", "--keywords", dest = "keywords", default = "1000,10000,100000",
+		help = "entries of generated keyworddbs, the middle one is used with every size (default: %default)")
+	parser.add_option("", "--compile-db", dest = "compile_db", action = "store_true", default = False,
+		help = "use compiled keyworddbs")
+	parser.add_option("", "--output", dest = "output", default = "",
+		help = "save results as json")
+	parser.add_option("", "--compare", dest = "compare", default = "",
+		help = "compare results with those saved by --output")
+	options, args = parser.parse_args()
+
+	template = "%s/examples/manp.c" % script_home
+	if len(args) > 0:
+		template = os.path.realpath(args[0])
+	sizes = map(int, options.sizes.split(","))
+	keyword_sizes = map(int, options.keywords.split(","))
+	default_keywords = keyword_sizes[len(keyword_sizes) / 2]
+
+	results = {
+		'commit': getCommit(),
+		'python': sys.version.split()[0],
+		'template': os.path.basename(template),
+		'compile_db': options.compile_db,
+		'cases': []
+	}
+
+	tmp_dir = tempfile.mkdtemp()
+	try:
+		print "%s copies, commit %s" % (template, results['commit'])
+		for lines in sizes:
+			case = runCase("render lines=%d" % lines, template, lines, default_keywords, options.compile_db, tmp_dir)
+			results['cases'].append(case)
+			printCase(case)
+
+		for keywords in keyword_sizes:
+			if keywords == default_keywords:
+				continue
+			case = runCase("keyworddb keywords=%d" % keywords, template, sizes[0], keywords, options.compile_db, tmp_dir)
+			results['cases'].append(case)
+			printCase(case)
+
+		case = runCase("render lines=%d" % sizes[0], template, sizes[0], default_keywords, options.compile_db, tmp_dir, True)
+		case['name'] = "rerender lines=%d" % sizes[0]
+		results['cases'].append(case)
+		printCase(case)
+	finally:
+		shutil.rmtree(tmp_dir)
+
+	if options.output != "":
+		with open(options.output, "w") as fd:
+			json.dump(results, fd, indent = 1, sort_keys = True)
+
+	if options.compare != "":
+		with open(options.compare, "r") as fd:
+			compareResults(json.load(fd), results)
@@ -1,4 +1,11 @@
 function toggleFold(fold_id) {
+	// lazy folds get their content on the first unfold
+	var fold = $("div#fold_" + fold_id)
+	if (fold.attr("data-src") && !fold.data("loaded") && !fold.is(":visible")) {
+		loadFold(fold.attr("data-src"))
+		return
+	}
+
 	if ($("div#fold_" + fold_id).is(":visible")) {
 		$("span.fold_on_id_" + fold_id).hide()
 		$("span.fold_off_id_" + fold_id).show()
@@ -9,3 +16,325 @@ function toggleFold(fold_id) {
 
 	$("div#fold_" + fold_id).toggle()
 }
+
+function loadFold(src) {
+	loadScript(src)
+}
+
+function loadScript(src, onerror) {
+	var script = document.createElement("script")
+	script.type = "text/javascript"
+	script.src = src
+	if (onerror) {
+		script.onerror = onerror
+	}
+	document.getElementsByTagName("head")[0].appendChild(script)
+}
+
+// called by the fold's file, folded is a list of folded folds inside it
+function foldLoaded(fold_id, content, folded) {
+	var fold = $("div#fold_" + fold_id)
+	fold.html(content)
+	fold.find("span.fold_off").hide()
+	fold.data("loaded", true)
+	toggleFold(fold_id)
+
+	// only folds of a visible fold can be folded
+	for (var i = 0; i < folded.length; i++) {
+		toggleFold(folded[i])
+	}
+}
+
+// visualize --serve: wait for a newer version of the page and reload it
+function liveReload(page, version) {
+	$.ajax({
+		url: "/__reload",
+		data: {page: page, version: version},
+		dataType: "json",
+		cache: false,
+		success: function(data) {
+			if (data.version != version) {
+				location.reload()
+			} else {
+				liveReload(page, version)
+			}
+		},
+		error: function() {
+			setTimeout(function() { liveReload(page, version) }, 1000)
+		}
+	})
+}
+
+// visualize --virtual: the page holds line data, only lines in the window
+// (and a few around) are drawn
+var vis = null
+// lines drawn above and below the window
+var visMargin = 50
+
+function visPage(data) {
+	vis = {data: data, folded: {}, starts: {}, rows: [], lineRows: {}, rowHeight: 0, first: -1, last: -1}
+	for (var i = 0; i < data.folds.length; i++) {
+		var fold = data.folds[i]
+		if (fold[3]) {
+			vis.folded[fold[0]] = true
+		}
+		if (!vis.starts[fold[1]]) {
+			vis.starts[fold[1]] = []
+		}
+		vis.starts[fold[1]].push(fold)
+	}
+
+	$(document).ready(function() {
+		vis.lines = $("div#lines")
+		vis.lines.html("<div class='row'>&nbsp;</div>")
+		vis.rowHeight = vis.lines.children().first().outerHeight() || 16
+		buildRows()
+		$(window).scroll(drawRows)
+		$(window).resize(drawRows)
+		$(window).on("hashchange", jumpToHash)
+		if (!jumpToHash()) {
+			drawRows()
+		}
+	})
+}
+
+function escapeText(text) {
+	return text.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/\t/g, "&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;").replace(/ /g, "&nbsp;")
+}
+
+function lineHtml(entry) {
+	if (typeof entry == "string") {
+		return escapeText(entry)
+	}
+	if (entry.h !== undefined) {
+		return entry.h
+	}
+
+	var text = entry[0]
+	var runs = entry[1]
+	var out = []
+	var last = 0
+	for (var i = 0; i < runs.length; i += 3) {
+		var start = runs[i]
+		var end = start + runs[i + 1]
+		if (start > last) {
+			out.push(escapeText(text.substring(last, start)))
+		}
+		out.push("<span class='" + vis.data.classes[runs[i + 2]] + "'>" + escapeText(text.substring(start, end)) + "</span>")
+		last = end
+	}
+	out.push(escapeText(text.substring(last)))
+	return out.join("")
+}
+
+function lineNumber(line) {
+	var number = "" + line
+	var padding = ""
+	for (var i = number.length; i < 4; i++) {
+		padding = padding + "&nbsp;"
+	}
+	return "<a name='" + line + "'>" + padding + number + "</a> "
+}
+
+// rows are fold headers and lines outside of folded folds
+function buildRows() {
+	var count = vis.data.lines.length
+	var line = 1
+	vis.rows = []
+	vis.lineRows = {}
+	while (line <= count) {
+		var folds = vis.starts[line] || []
+		var skip = 0
+		for (var i = 0; i < folds.length && !skip; i++) {
+			vis.rows.push({fold: folds[i]})
+			if (vis.folded[folds[i][0]]) {
+				skip = folds[i][2]
+			}
+		}
+
+		if (skip) {
+			line = Math.max(skip, line) + 1
+			continue
+		}
+
+		vis.lineRows[line] = vis.rows.length
+		vis.rows.push({line: line})
+		line++
+	}
+
+	vis.lines.css("height", vis.rows.length * vis.rowHeight)
+	vis.first = -1
+	vis.last = -1
+}
+
+function rowHtml(row) {
+	if (row.line) {
+		return lineNumber(row.line) + lineHtml(vis.data.lines[row.line - 1])
+	}
+
+	var fold = row.fold
+	var button = vis.folded[fold[0]] ? "Unfold" : "Fold"
+	return "<span class='fold_button' onclick='toggleVirtualFold(" + fold[0] + ")'>" + button + "</span><span class='fold_text'>" + fold[4] + "</span>"
+}
+
+function drawRows() {
+	var top = $(window).scrollTop() - vis.lines.offset().top
+	var first = Math.max(0, Math.floor(top / vis.rowHeight) - visMargin)
+	var last = Math.min(vis.rows.length, Math.ceil((top + $(window).height()) / vis.rowHeight) + visMargin)
+	if (first == vis.first && last == vis.last) {
+		return
+	}
+
+	var out = []
+	for (var i = first; i < last; i++) {
+		out.push("<div class='row' style='top: " + (i * vis.rowHeight) + "px'>" + rowHtml(vis.rows[i]) + "</div>")
+	}
+	vis.lines.html(out.join(""))
+	vis.first = first
+	vis.last = last
+}
+
+function toggleVirtualFold(fold_id) {
+	vis.folded[fold_id] = !vis.folded[fold_id]
+	buildRows()
+	drawRows()
+}
+
+// #<line>, folds hiding the line are unfolded
+function jumpToHash() {
+	var line = parseInt(window.location.hash.substring(1))
+	if (!vis || isNaN(line) || line < 1 || line > vis.data.lines.length) {
+		return false
+	}
+
+	var unfolded = false
+	for (var i = 0; i < vis.data.folds.length; i++) {
+		var fold = vis.data.folds[i]
+		if (vis.folded[fold[0]] && fold[1] <= line && line <= fold[2]) {
+			vis.folded[fold[0]] = false
+			unfolded = true
+		}
+	}
+	if (unfolded) {
+		buildRows()
+	}
+
+	$(window).scrollTop(vis.lines.offset().top + vis.lineRows[line] * vis.rowHeight)
+	drawRows()
+	return true
+}
+
+// visualize --search: prefix index of all pages, split into shards by the
+// first two letters of terms, a shard is loaded when a query needs it
+var search = null
+// results shown at most
+var searchLimit = 100
+
+function searchInit(root, page) {
+	search = {root: root, page: page, pages: null, shards: {}, query: ""}
+	$(document).ready(function() {
+		$("input#search").on("input", function() { searchQuery($(this).val()) })
+		loadScript(root + "/search/pages.js")
+		if (!vis) {
+			$(window).on("hashchange", revealHash)
+			revealHash()
+		}
+	})
+}
+
+function searchPages(pages) {
+	search.pages = pages
+	searchShow()
+}
+
+function searchShard(shard, data) {
+	search.shards[shard] = data
+	searchShow()
+}
+
+function searchShardName(term) {
+	return term.substring(0, 2).toLowerCase().replace(/[^a-z0-9]/g, "_")
+}
+
+function searchQuery(query) {
+	search.query = query
+	if (query.length < 2) {
+		$("div#search_results").html("")
+		return
+	}
+
+	var shard = searchShardName(query)
+	if (search.shards[shard] === undefined) {
+		// loading, no shard means no terms
+		search.shards[shard] = null
+		loadScript(search.root + "/search/" + shard + ".js", function() { searchShard(shard, {i: {}, a: {}}) })
+	}
+	searchShow()
+}
+
+function searchHref(page, line) {
+	if (search.pages[page] == search.page) {
+		return "#" + line
+	}
+	return search.root + "/" + search.pages[page] + "#" + line
+}
+
+function searchResult(page, line, text) {
+	return "<div><a href='" + searchHref(page, line) + "'>" + escapeText(search.pages[page] + ":" + line) + "</a> " + text + "</div>"
+}
+
+// identifiers (every line they are used on) and words of annotations
+// starting with the query
+function searchShow() {
+	var query = search.query.toLowerCase()
+	var data = search.shards[searchShardName(query)]
+	if (query.length < 2 || !data || !search.pages) {
+		return
+	}
+
+	var out = []
+	for (var term in data.i) {
+		if (term.toLowerCase().indexOf(query) != 0) {
+			continue
+		}
+		for (var i = 0; i < data.i[term].length && out.length < searchLimit; i++) {
+			var lines = data.i[term][i]
+			for (var j = 1; j < lines.length && out.length < searchLimit; j++) {
+				out.push(searchResult(lines[0], lines[j], "<b>" + escapeText(term) + "</b>"))
+			}
+		}
+	}
+	for (var term in data.a) {
+		if (term.toLowerCase().indexOf(query) != 0) {
+			continue
+		}
+		for (var i = 0; i < data.a[term].length && out.length < searchLimit; i++) {
+			var entry = data.a[term][i]
+			out.push(searchResult(entry[0], entry[1], escapeText(entry[3])))
+		}
+	}
+
+	if (out.length == 0) {
+		out.push("<div>no results</div>")
+	}
+	$("div#search_results").html(out.join(""))
+}
+
+// #<line> of a page with html lines, folds hiding the line are unfolded
+function revealHash() {
+	var line = parseInt(window.location.hash.substring(1))
+	if (isNaN(line)) {
+		return
+	}
+
+	var folds = $("a[name='" + line + "']").parents("div.fold").get().reverse()
+	for (var i = 0; i < folds.length; i++) {
+		if ($(folds[i]).css("display") == "none") {
+			toggleFold(parseInt(folds[i].id.substring(5)))
+		}
+	}
+	var anchor = $("a[name='" + line + "']")
+	if (anchor.length) {
+		$(window).scrollTop(anchor.offset().top)
+	}
+}
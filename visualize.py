@@ -11,17 +11,18 @@
 
 import sys
 import os
+import time
 import optparse
-from CodeParser import CodeParser
-from VisualizationParser import VisualizationParser
-from HTMLVisualizer import HTMLVisualizer
-import CodeTokenizer
+from BuildManifest import BuildManifest
+from LayoutSync import layout_modes
+from KeywordDB import compileKeywordDB
+from VisualizeDaemon import getSocketFile, sendRequest
 
 version = "0.0"
 debug_level = 0
 
 # argument parsing
-parser = optparse.OptionParser(usage="usage: %prog [--debug] [--dest=DEST] file")
+parser = optparse.OptionParser(usage="usage: %prog [--debug] [--dest=DEST] [--recursive=DIR] [--jobs=N] [--force] [--layout-mode=MODE] [--layout-dir=DIR] [--compile-db] [--annotate=LINE:COMMAND:VALUE] [--daemon] [--stop-daemon] [--no-daemon] [--socket=FILE] [--serve] [--port=PORT] [--lazy-folds] [--virtual] [--compact] [--gzip] [--bundle] [--symbols] [--callgraph] [--search] [--no-reanchor] [--profile=DIR] file ...")
 parser.add_option(
     "", "--debug", dest = "debug", action = "store_true", default = False,
     help = "debug mode"
@@ -32,12 +33,127 @@ parser.add_option(
     help = "destination folder for generated files"
 )
 
+parser.add_option(
+    "", "--recursive", dest = "recursive", action = "store", default = "",
+    help = "visualize all C sources under DIR, destination mirrors its subdirectories"
+)
+
+parser.add_option(
+    "", "--jobs", dest = "jobs", action = "store", type = "int", default = 0,
+    help = "number of parallel jobs when visualizing more files, or lexing chunks of a large one (default: number of cpus)"
+)
+
+parser.add_option(
+    "", "--force", dest = "force", action = "store_true", default = False,
+    help = "render all pages, even those whose inputs did not change since the last run"
+)
+
+parser.add_option(
+    "", "--layout-mode", dest = "layout_mode", action = "store", default = "copy",
+    help = "how css and js files get into the destination: %s (default: copy)" % "|".join(layout_modes)
+)
+
+parser.add_option(
+    "", "--layout-dir", dest = "layout_dir", action = "store", default = "",
+    help = "one shared folder for css and js files all pages point to, instead of DEST/layout"
+)
+
+parser.add_option(
+    "", "--compile-db", dest = "compile_db", action = "store_true", default = False,
+    help = "compile DEST/keyworddb into an indexed DEST/keyworddb.idx used instead of the text one while it is up to date"
+)
+
+parser.add_option(
+    "", "--annotate", dest = "annotate", action = "store", default = "",
+    help = "append LINE:COMMAND:VALUE to the .vis file of the (only) file and render it"
+)
+
+parser.add_option(
+    "", "--daemon", dest = "daemon", action = "store_true", default = False,
+    help = "run as a daemon keeping the lexer, keywords, keyworddb and token tables loaded, single file renders are sent to it"
+)
+
+parser.add_option(
+    "", "--stop-daemon", dest = "stop_daemon", action = "store_true", default = False,
+    help = "stop a running daemon"
+)
+
+parser.add_option(
+    "", "--no-daemon", dest = "no_daemon", action = "store_true", default = False,
+    help = "render in this process even if a daemon is running"
+)
+
+parser.add_option(
+    "", "--socket", dest = "socket", action = "store", default = getSocketFile(),
+    help = "unix socket of the daemon (default: %default)"
+)
+
+parser.add_option(
+    "", "--serve", dest = "serve", action = "store_true", default = False,
+    help = "serve DEST over http, pages are rendered again and reloaded in the browser when their inputs change"
+)
+
+parser.add_option(
+    "", "--port", dest = "port", action = "store", type = "int", default = 8000,
+    help = "http port for --serve (default: %default)"
+)
+
+parser.add_option(
+    "", "--lazy-folds", dest = "lazy_folds", action = "store_true", default = False,
+    help = "write content of folded folds into separate files loaded on the first unfold"
+)
+
+parser.add_option(
+    "", "--virtual", dest = "virtual", action = "store_true", default = False,
+    help = "write lines as data drawn by vis.js, only lines in the browser window are in the page"
+)
+
+parser.add_option(
+    "", "--compact", dest = "compact", action = "store_true", default = False,
+    help = "write short markup and every annotation text only once per page"
+)
+
+parser.add_option(
+    "", "--gzip", dest = "gzip", action = "store_true", default = False,
+    help = "write a .gz file next to every page (and bundle) for static servers"
+)
+
+parser.add_option(
+    "", "--bundle", dest = "bundle", action = "store_true", default = False,
+    help = "load the layout as one content hashed script instead of its css and js files"
+)
+
+parser.add_option(
+    "", "--symbols", dest = "symbols", action = "store_true", default = False,
+    help = "index function, struct and macro definitions of rendered files in DEST/.symbols.db and link identifiers to them"
+)
+
+parser.add_option(
+    "", "--callgraph", dest = "callgraph", action = "store_true", default = False,
+    help = "write the call graph of rendered files into DEST/callgraph.dot and DEST/callgraph.json, linked from every page"
+)
+
+parser.add_option(
+    "", "--search", dest = "search", action = "store_true", default = False,
+    help = "write a search index of identifiers and annotations of all pages into DEST/search, pages get a search box"
+)
+
+parser.add_option(
+    "", "--no-reanchor", dest = "reanchor", action = "store_false", default = True,
+    help = "do not move line numbers of .vis files with the code when sources change"
+)
+
+parser.add_option(
+    "", "--profile", dest = "profile", action = "store", default = "",
+    help = "render in this process, print time and peak memory of render stages and save their cProfile stats into DIR/<stage>.prof"
+)
+
 options, args = parser.parse_args()
 
 if options.debug:
 	debug_level = 1
 
-if len(args) != 1:
+if len(args) == 0 and options.recursive == "" and not options.compile_db and not options.daemon and not options.stop_daemon and not options.serve:
 	print "Input source code missing!!!"
 	exit(0)
 
@@ -45,26 +161,19 @@ if len(options.dest) == 0:
 	print "Destination directory name must be at least of length 1"
 	exit(0)
 
-src_file = args[0]
+if options.layout_mode not in layout_modes:
+	print "Unknown layout mode '%s'" % options.layout_mode
+	exit(0)
+
 destination = options.dest
 
 def debug(msg):
 	if debug_level > 0:
 		print msg
 
-def mkdir_p(path):
-    if not os.access(path, os.F_OK):
-        os.makedirs(path)
-
 #####################################################################
 
 debug("Code Visualizer, version %s" % version)
-debug("Opening file: %s" % src_file)
-
-# read source code
-src_content = ""
-with open(src_file, "r") as file:
-	src_content = file.read()
 
 # create visualization file
 # is the destination relative?
@@ -74,48 +183,176 @@ if destination[0] != "/":
 # canonize the path
 destination = os.path.realpath(destination)
 
-# destination folder exists?
-if not os.path.exists(destination):
+script_home = os.path.dirname(os.path.realpath(__file__))
+
+if options.stop_daemon:
+	if sendRequest(options.socket, {'command': 'stop'}) is None:
+		print "No daemon running on %s" % options.socket
+	exit(0)
+
+if options.daemon:
+	from VisualizeDaemon import VisualizeDaemon
+	try:
+		VisualizeDaemon(script_home, options.socket, debug_level > 0).serve()
+	except (RuntimeError, KeyboardInterrupt) as e:
+		if str(e):
+			print e
+	exit(0)
+
+if options.annotate != "" and (len(args) != 1 or options.recursive != ""):
+	print "--annotate needs exactly one file"
+	exit(0)
+
+shared_layout = ""
+if options.layout_dir != "":
+	shared_layout = os.path.realpath(options.layout_dir)
+
+# a single file is rendered by the daemon if there is one running
+if len(args) == 1 and options.recursive == "" and not options.compile_db and not options.serve and not options.no_daemon and options.profile == "":
+	request = {
+		'command': 'render',
+		'file': os.path.realpath(args[0]),
+		'dest': destination,
+		'force': options.force,
+		'layout_mode': options.layout_mode,
+		'layout_dir': shared_layout,
+		'lazy_folds': options.lazy_folds,
+		'virtual': options.virtual,
+		'compact': options.compact,
+		'gzip': options.gzip,
+		'bundle': options.bundle,
+		'symbols': options.symbols,
+		'callgraph': options.callgraph,
+		'search': options.search,
+		'reanchor': options.reanchor,
+		'jobs': options.jobs
+	}
+	if options.annotate != "":
+		request['command'] = 'annotate'
+		request['annotation'] = options.annotate
+
+	response = sendRequest(options.socket, request)
+	if response is not None:
+		if response['status'] != 'ok':
+			print "%s: %s" % (args[0], response['error'])
+		elif not response['rendered']:
+			debug("%s is up to date" % response['page'])
+		else:
+			debug("Rendered by daemon in %.3fs: file://%s" % (response['seconds'], response['page']))
+		exit(0)
+
+# no daemon, everything is rendered in this process
+from SourceVisualizer import SourceVisualizer, findSources, findCollisions, uniqueJobs, visualizeFiles, printSummary, mkdir_p
+
+if options.compile_db:
 	mkdir_p(destination)
+	keyworddb_file = "%s/keyworddb" % destination
+	count = compileKeywordDB(keyworddb_file)
+	print "%s: %d keywords compiled" % (keyworddb_file, count)
+	if len(args) == 0 and options.recursive == "":
+		exit(0)
+
+visualizer = SourceVisualizer(script_home, debug_level > 0, options.layout_mode, shared_layout)
+visualizer.lazy_folds = options.lazy_folds
+visualizer.virtual = options.virtual
+visualizer.compact = options.compact
+visualizer.gzip_output = options.gzip
+visualizer.bundle = options.bundle
+visualizer.symbols = options.symbols
+visualizer.callgraph = options.callgraph
+visualizer.search = options.search
+visualizer.reanchor = options.reanchor
+# a large source is lexed by a pool of processes, in chunks
+visualizer.lex_processes = options.jobs or None
+
+profiler = None
+if options.profile != "":
+	from StageProfiler import StageProfiler
+	profiler = StageProfiler(True)
+	visualizer.profiler = profiler
+	# stages of workers would not be seen
+	visualizer.lex_processes = 1
+
+def printProfile():
+	if profiler is not None:
+		profiler.printReport()
+		for file in profiler.dumpStats(os.path.realpath(options.profile)):
+			debug("Stats saved to %s" % file)
+
+if len(args) == 1 and options.recursive == "" and not options.serve:
+	src_file = args[0]
+	debug("Opening file: %s" % src_file)
+	visualizer.prepareDestination(destination)
+	visualizer.loadKeywordDB(destination)
+	visualizer.openSymbolIndex(destination)
+	visualizer.updateSymbols([(src_file, destination)], 1)
+	visualizer.openCallGraph(destination)
+	visualizer.updateCallGraph([(src_file, destination)], 1)
+	visualizer.openSearchIndex(destination)
+	if options.annotate != "":
+		try:
+			visualizer.annotate(src_file, destination, options.annotate)
+		except ValueError as e:
+			print "%s: %s" % (src_file, e)
+			exit(0)
+	# only pages whose inputs changed since the last run are rendered
+	manifest = BuildManifest(destination)
+	if not options.force and visualizer.isUpToDate(manifest, src_file, destination):
+		debug("%s is up to date" % visualizer.getPageFile(src_file, destination))
+		exit(0)
+
+	visualizer.visualize(src_file, destination)
+	visualizer.recordPage(manifest, src_file, destination)
+	manifest.save()
+	visualizer.buildSearchIndex(manifest)
+	printProfile()
+	exit(0)
+
+# more files at once, every file is saved into destination,
+# files found under --recursive DIR into its mirrored subdirectory
+jobs = []
+for src_file in args:
+	jobs.append( (src_file, destination) )
+
+if options.recursive != "":
+	src_dir = os.path.realpath(options.recursive)
+	for src_file in findSources(src_dir, destination):
+		subdir = os.path.dirname(os.path.relpath(src_file, src_dir))
+		jobs.append( (src_file, os.path.normpath("%s/%s" % (destination, subdir))) )
+
+# pages are named after source files, sources of the same name need
+# --recursive to get into different subdirectories
+collisions = findCollisions(visualizer, jobs)
+if collisions:
+	for page in sorted(collisions):
+		print "%s would be rendered from more files: %s" % (page, ", ".join(collisions[page]))
+	exit(0)
+jobs = uniqueJobs(visualizer, jobs)
+
+processes = None
+if options.jobs > 0:
+	processes = options.jobs
+# stages of workers would not be seen
+if profiler is not None:
+	processes = 1
+
+start = time.time()
+mkdir_p(destination)
+visualizer.loadKeywordDB(destination)
+visualizer.openSymbolIndex(destination)
+visualizer.openCallGraph(destination)
+visualizer.openSearchIndex(destination)
+manifest = BuildManifest(destination)
+results = visualizeFiles(visualizer, jobs, processes, manifest, options.force)
+if jobs or not options.serve:
+	printSummary(results, time.time() - start, len(jobs) - len(results))
+	printProfile()
 
-# extract basename
-basename = os.path.basename(src_file)
-vis_file = destination + "/" + basename + ".vis"
-
-# read visualization file
-debug("Opening visualization file: %s " % vis_file)
-# does the vis file exist?
-if not os.path.exists(vis_file):
-	debug("file not found, creating empty file")
-	open(vis_file, 'a').close()
-
-debug("Opening html file for write: %s " % vis_file)
-html_file = destination + "/" + basename + ".html"
-# does the html file exist?
-if not os.path.exists(html_file):
-	debug("file not found, creating empty file")
-	open(html_file, 'a').close()
-
-debug("Parsing visualization file...")
-visParser = VisualizationParser(vis_file)
-vis_lines = visParser.getCommands()
-debug("Visualization file parsed")
-
-debug("Parsing source code file...")
-codeParser = CodeParser(src_file)
-code_lines = codeParser.getLines()
-debug("Source file parsed")
-
-debug("Extracting keywords from source code file")
-(code_keywords, code_comments) = CodeTokenizer.getCodeKeywordsOccurences(src_file)
-
-dir_parts = os.path.realpath(__file__).split("/")
-del(dir_parts[-1])
-script_home = "/".join(dir_parts) 
-keywords_file = script_home + "/keywords"
-
-debug("Initializing html output...")
-htmlVis = HTMLVisualizer(code_lines, code_keywords, code_comments, vis_lines, keywords_file, script_home)
-debug("Html output generated")
-htmlVis.printPage(basename, destination)
-debug("Saved to: file://%s" % html_file)
+if options.serve:
+	from LiveServer import LiveServer
+	# no pools are forked from threads of the server
+	visualizer.lex_processes = 1
+	try:
+		LiveServer(visualizer, destination, options.port).serve()
+	except KeyboardInterrupt:
+		pass